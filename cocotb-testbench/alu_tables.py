@@ -0,0 +1,220 @@
+"""
+Reference ALU of ADC, SBC and the compare instructions as lookup tables.
+
+Every table entry holds the result in the low byte and the flags N, V, Z, C
+at their status register positions in the high byte, so the expected values
+of an instruction are one indexed load:
+    ADC_TABLE / SBC_TABLE   index decimal << 17 | carry << 16 | A << 8 | operand
+    CMP_TABLE               index register << 8 | operand (V is not affected)
+The semantics are the ones of cpu.v: decimal mode adds/subtracts BCD digits
+nibble by nibble and clears V, SBC sets V like ADC (same operand signs,
+different result sign).
+
+The tables are built vectorized with NumPy and cached in ALU_CACHE_DIR,
+keyed by a hash of this file. The NumPy arrays can be indexed with arrays
+for bulk checks, the scalar functions adc(), sbc() and compare() use array
+copies that return plain ints.
+
+Usage: python alu_tables.py [--verify]
+"""
+import argparse
+import hashlib
+import os
+from array import array
+
+import numpy as np
+
+ALU_CACHE_DIR = os.environ.get("ALU_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".alu_cache"))
+
+N_FLAG = 0x80
+V_FLAG = 0x40
+Z_FLAG = 0x02
+C_FLAG = 0x01
+# Bit of every flag in the status byte of an entry
+FLAG_BITS = {"N": 7, "V": 6, "Z": 1, "C": 0}
+
+
+def pack_entries(result, carry, overflow):
+    result = result.astype(np.uint16)
+    status = (result & 0x80) | (overflow.astype(np.uint16) << 6) | ((result == 0).astype(np.uint16) << 1) | carry
+    return (result | (status.astype(np.uint16) << 8)).astype(np.uint16)
+
+
+def build_tables():
+    """
+    :return: (ADC table, SBC table, CMP table) as uint16 arrays.
+    """
+    index = np.arange(1 << 18, dtype=np.int32)
+    operand = index & 0xFF
+    acc = (index >> 8) & 0xFF
+    carry = (index >> 16) & 1
+    decimal = (index >> 17).astype(bool)
+
+    # Binary addition
+    total = acc + operand + carry
+    binary = total & 0xFF
+    overflow = (((acc ^ operand) & 0x80) == 0) & (((acc ^ binary) & 0x80) != 0)
+    # BCD addition
+    lo_nibble = (acc & 0x0F) + (operand & 0x0F) + carry
+    lo_nibble = np.where(lo_nibble > 9, lo_nibble + 6, lo_nibble)
+    hi_nibble = (acc >> 4) + (operand >> 4) + (lo_nibble > 0x0F)
+    decimal_carry = hi_nibble > 9
+    hi_nibble = np.where(decimal_carry, hi_nibble + 6, hi_nibble)
+    bcd = ((hi_nibble << 4) | (lo_nibble & 0x0F)) & 0xFF
+    adc_table = pack_entries(
+        np.where(decimal, bcd, binary),
+        np.where(decimal, decimal_carry, total > 0xFF).astype(np.uint16),
+        overflow & ~decimal,
+    )
+
+    # Binary subtraction (the borrow is the inverted carry)
+    borrow = carry ^ 1
+    difference = acc - operand - borrow
+    binary = difference & 0xFF
+    overflow = (((acc ^ operand) & 0x80) == 0) & (((acc ^ binary) & 0x80) != 0)
+    # BCD subtraction
+    lo_nibble = (acc & 0x0F) - (operand & 0x0F) - borrow
+    lo_nibble = np.where(lo_nibble < 0, lo_nibble - 6, lo_nibble)
+    hi_nibble = (acc >> 4) - (operand >> 4) - (lo_nibble < 0)
+    decimal_borrow = hi_nibble < 0
+    hi_nibble = np.where(decimal_borrow, hi_nibble - 6, hi_nibble)
+    bcd = ((hi_nibble << 4) | (lo_nibble & 0x0F)) & 0xFF
+    sbc_table = pack_entries(
+        np.where(decimal, bcd, binary),
+        np.where(decimal, ~decimal_borrow, difference >= 0).astype(np.uint16),
+        overflow & ~decimal,
+    )
+
+    register = acc[:1 << 16]
+    operand = operand[:1 << 16]
+    cmp_table = pack_entries((register - operand) & 0xFF, (register >= operand).astype(np.uint16),
+                             np.zeros(1 << 16, dtype=bool))
+    return adc_table, sbc_table, cmp_table
+
+
+def tables_key():
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def load_tables(cache_dir=ALU_CACHE_DIR):
+    """
+    Load the tables from the cache, build and store them if they are missing.
+
+    :return: (ADC table, SBC table, CMP table)
+    """
+    path = os.path.join(cache_dir, f"alu-{tables_key()}.npz")
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return data["adc"], data["sbc"], data["cmp"]
+    adc_table, sbc_table, cmp_table = build_tables()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, adc=adc_table, sbc=sbc_table, cmp=cmp_table)
+    os.replace(tmp_path, path)  # atomic, parallel runs may build the same tables
+    return adc_table, sbc_table, cmp_table
+
+
+ADC_TABLE, SBC_TABLE, CMP_TABLE = load_tables()
+# Indexing an array.array returns a plain int, which is much faster than a NumPy scalar
+_ADC = array("H", ADC_TABLE.tobytes())
+_SBC = array("H", SBC_TABLE.tobytes())
+_CMP = array("H", CMP_TABLE.tobytes())
+
+
+def adc(acc, operand, carry, decimal):
+    """
+    :return: (result, status byte with N, V, Z and C)
+    """
+    entry = _ADC[(decimal << 17) | (carry << 16) | (acc << 8) | operand]
+    return entry & 0xFF, entry >> 8
+
+
+def sbc(acc, operand, carry, decimal):
+    """
+    :return: (result, status byte with N, V, Z and C)
+    """
+    entry = _SBC[(decimal << 17) | (carry << 16) | (acc << 8) | operand]
+    return entry & 0xFF, entry >> 8
+
+
+def compare(register, operand):
+    """
+    :return: (register - operand as byte, status byte with N, Z and C)
+    """
+    entry = _CMP[(register << 8) | operand]
+    return entry & 0xFF, entry >> 8
+
+
+def lookup(table, acc, operand, carry=0, decimal=0):
+    """
+    Vectorized lookup for bulk checks.
+
+    :param acc, operand, carry, decimal: Integer arrays (or scalars) of the same shape.
+    :return: (result array, status array)
+    """
+    index = (np.asarray(acc, dtype=np.int64) << 8) | np.asarray(operand, dtype=np.int64)
+    if table is not CMP_TABLE:
+        index |= (np.asarray(decimal, dtype=np.int64) << 17) | (np.asarray(carry, dtype=np.int64) << 16)
+    entries = table[index]
+    return entries & 0xFF, entries >> 8
+
+
+def verify_tables():
+    """
+    Compare every entry with a straightforward scalar implementation.
+
+    :return: List of (table name, index) of the wrong entries.
+    """
+    errors = []
+    for name, table, subtract in (("ADC", ADC_TABLE, False), ("SBC", SBC_TABLE, True)):
+        for index in range(1 << 18):
+            acc, operand, carry, decimal = (index >> 8) & 0xFF, index & 0xFF, (index >> 16) & 1, index >> 17
+            borrow = carry ^ 1
+            if decimal:
+                if subtract:
+                    lo_nibble = (acc & 0x0F) - (operand & 0x0F) - borrow
+                    if lo_nibble < 0:
+                        lo_nibble -= 6
+                    hi_nibble = (acc >> 4) - (operand >> 4) - (lo_nibble < 0)
+                    carry_out = hi_nibble >= 0
+                    if hi_nibble < 0:
+                        hi_nibble -= 6
+                else:
+                    lo_nibble = (acc & 0x0F) + (operand & 0x0F) + carry
+                    if lo_nibble > 9:
+                        lo_nibble += 6
+                    hi_nibble = (acc >> 4) + (operand >> 4) + (lo_nibble > 0x0F)
+                    carry_out = hi_nibble > 9
+                    if hi_nibble > 9:
+                        hi_nibble += 6
+                result = ((hi_nibble << 4) | (lo_nibble & 0x0F)) & 0xFF
+                overflow = False
+            else:
+                total = acc - operand - borrow if subtract else acc + operand + carry
+                result = total & 0xFF
+                carry_out = total >= 0 if subtract else total > 0xFF
+                overflow = ((acc ^ operand) & 0x80) == 0 and ((acc ^ result) & 0x80) != 0
+            status = (result & 0x80) | (overflow << 6) | ((result == 0) << 1) | carry_out
+            if table[index] != result | (status << 8):
+                errors.append((name, index))
+    for index in range(1 << 16):
+        register, operand = index >> 8, index & 0xFF
+        result = (register - operand) & 0xFF
+        status = (result & 0x80) | ((result == 0) << 1) | (register >= operand)
+        if CMP_TABLE[index] != result | (status << 8):
+            errors.append(("CMP", index))
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reference ALU tables of ADC, SBC and the compare instructions")
+    parser.add_argument("--verify", action="store_true", help="check every entry against a scalar implementation")
+    args = parser.parse_args()
+    print(f"ADC {len(ADC_TABLE)}, SBC {len(SBC_TABLE)}, CMP {len(CMP_TABLE)} entries in {ALU_CACHE_DIR}")
+    if args.verify:
+        errors = verify_tables()
+        for name, index in errors[:20]:
+            print(f"{name} entry {index:#07x} is wrong")
+        print(f"{len(errors)} wrong entries")
@@ -0,0 +1,330 @@
+"""
+Two pass assembler for the 6502 programs of the testbench.
+
+Handles the dialect of test.65s (the Masswerk Virtual 6502 Assembler):
+ - one instruction, directive or label per line, comments start with ';'
+ - labels with or without a colon, case insensitive
+ - .ORG (or *=), .BYTE and .WORD with comma separated values
+ - numbers $FF, 0xFF, %1010, 0b1010, 0d10 and 10 (decimal)
+ - expressions LABEL+1 / LABEL-1 and the byte selectors <LABEL / >LABEL
+ - all opcodes of opcode_list, including END (0x04)
+
+Operands below $100 use zero page addressing if the opcode has it. BRK is
+assembled as one byte like Masswerk does. The result is the full 64 KiB image
+the testbench loads, unused bytes are filled with 0x00, together with a
+listing and a symbol file. Images are cached by a hash of the source, so
+assembling an unchanged program is only a file lookup.
+
+Usage: python asm6502.py test.65s [-o test.bin] [--fill 0x00]
+"""
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from opcodes import opcode_list
+
+ASM_MAGIC = b"6502ASM1"
+ASM_CACHE_DIR = os.environ.get("ASM_CACHE_DIR", ".asm_cache")
+FILL = 0x00  # fill byte of the Masswerk "Standard Binary"
+
+OPCODES = {}  # mnemonic -> addressing mode -> Opcode
+for _op in opcode_list:
+    OPCODES.setdefault(_op.name, {})[_op.addressing] = _op
+BRANCHES = frozenset(op.name for op in opcode_list if op.addressing == "rel")
+DIRECTIVES = (".ORG", ".BYTE", ".WORD")
+
+LABEL = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)\s*:\s*(.*)$")
+TERM = re.compile(r"\s*([+-])?\s*(\$[0-9A-Fa-f]+|%[01]+|[0-9A-Za-z_]+)")
+
+
+class AssemblyError(Exception):
+    pass
+
+
+def parse_number(token):
+    upper = token.upper()
+    if upper.startswith("$"):
+        return int(upper[1:], 16)
+    if upper.startswith("%"):
+        return int(upper[1:], 2)
+    if upper.startswith("0X"):
+        return int(upper[2:], 16)
+    if upper.startswith("0B"):
+        return int(upper[2:], 2)
+    if upper.startswith("0D"):
+        return int(upper[2:], 10)
+    return int(upper, 10)
+
+
+def evaluate(expression, symbols, required=True):
+    """
+    Evaluate an operand expression.
+
+    :param expression: Sum of numbers and labels, optionally prefixed with < (low byte) or > (high byte).
+    :param symbols: dict mapping upper case labels to addresses.
+    :param required: Raise for undefined labels, otherwise return None.
+    """
+    expression = expression.strip()
+    selector = None
+    if expression[:1] in ("<", ">"):
+        selector, expression = expression[0], expression[1:].strip()
+    if not expression:
+        raise AssemblyError("Missing operand")
+    value = 0
+    position = 0
+    while position < len(expression):
+        match = TERM.match(expression, position)
+        if not match or (position > 0 and match.group(1) is None):
+            raise AssemblyError(f"Invalid expression '{expression}'")
+        token = match.group(2)
+        if token[0] in "$%" or token[0].isdigit():
+            try:
+                term = parse_number(token)
+            except ValueError:
+                raise AssemblyError(f"Invalid number '{token}'") from None
+        elif token.upper() in symbols:
+            term = symbols[token.upper()]
+        elif required:
+            raise AssemblyError(f"Undefined label '{token}'")
+        else:
+            return None
+        value += -term if match.group(1) == "-" else term
+        position = match.end()
+    if selector == "<":
+        return value & 0xFF
+    if selector == ">":
+        return (value >> 8) & 0xFF
+    return value
+
+
+def split_operand(mnemonic, operand, modes):
+    """
+    Find the addressing mode of an instruction.
+
+    :return: (addressing mode, expression of the operand value or None, index suffix for zpg/abs modes)
+    """
+    compact = operand.upper().replace(" ", "")
+    if not compact:
+        return ("impl" if "impl" in modes else "acc"), None, None
+    if compact == "A" and "acc" in modes:
+        return "acc", None, None
+    if compact.startswith("#"):
+        return "imm", operand.strip()[1:], None
+    if compact.startswith("(") and compact.endswith(",X)"):
+        return "ind_x", operand.strip()[1:].rsplit(",", 1)[0], None
+    if compact.startswith("(") and compact.endswith("),Y"):
+        return "ind_y", operand.strip()[1:].rsplit(")", 1)[0], None
+    if compact.startswith("(") and compact.endswith(")"):
+        return "ind", operand.strip()[1:-1], None
+    if mnemonic in BRANCHES:
+        return "rel", operand, None
+    if compact.endswith((",X", ",Y")):
+        return None, operand.rsplit(",", 1)[0], "_" + compact[-1].lower()
+    return None, operand, ""
+
+
+def parse_line(line):
+    """:return: (label or None, statement without label and comment)"""
+    line = line.split(";", 1)[0].strip()
+    if line.startswith("*"):
+        # *=$0600 is the same as .ORG $0600
+        return None, ".ORG " + line[1:].lstrip().lstrip("=")
+    match = LABEL.match(line)
+    if match:
+        return match.group(1), match.group(2).strip()
+    parts = line.split(None, 1)
+    if parts and not parts[0].startswith(".") and parts[0].upper() not in OPCODES:
+        # Label without colon, optionally followed by a statement
+        return parts[0], parts[1].strip() if len(parts) > 1 else ""
+    return None, line
+
+
+def assemble(source, fill=FILL):
+    """
+    Assemble a program into a 64 KiB image.
+
+    :param source: Assembler source text.
+    :param fill: Value of the bytes not written by the program.
+    :return: (image, symbols, listing), symbols maps labels to addresses, listing is a
+             list of (line number, address, emitted bytes) for every source line.
+    """
+    lines = source.splitlines()
+    symbols = {}
+    zero_page = {}  # line number -> True if pass 1 chose zero page addressing
+    for final in (False, True):
+        image = bytearray([fill]) * 65536
+        written = bytearray(65536)
+        listing = []
+        pc = 0
+        for number, text in enumerate(lines, 1):
+            try:
+                label, statement = parse_line(text)
+                if label and not final:
+                    if label.upper() in symbols:
+                        raise AssemblyError(f"Duplicate label '{label}'")
+                    symbols[label.upper()] = pc
+                data = b""
+                if statement:
+                    parts = statement.split(None, 1)
+                    mnemonic = parts[0].upper()
+                    operand = parts[1] if len(parts) > 1 else ""
+                    if mnemonic == ".ORG":
+                        pc = evaluate(operand, symbols)
+                        if label and not final:
+                            symbols[label.upper()] = pc
+                    elif mnemonic in (".BYTE", ".WORD"):
+                        data = directive_data(mnemonic, operand, symbols, final)
+                    elif mnemonic in OPCODES:
+                        data = instruction_data(mnemonic, operand, pc, symbols, zero_page, number, final)
+                    else:
+                        raise AssemblyError(f"Unknown mnemonic '{parts[0]}'")
+                if final and data:
+                    if pc + len(data) > 65536:
+                        raise AssemblyError("Program exceeds the 64 KiB address space")
+                    if any(written[pc:pc + len(data)]):
+                        raise AssemblyError(f"Overlaps code or data assembled before at {pc:#06x}")
+                    image[pc:pc + len(data)] = data
+                    written[pc:pc + len(data)] = b"\x01" * len(data)
+                listing.append((number, pc, data))
+                pc += len(data)
+            except AssemblyError as error:
+                raise AssemblyError(f"Line {number}: {error} ({text.strip()})") from None
+    return image, symbols, listing
+
+
+def directive_data(mnemonic, operand, symbols, final):
+    size = 1 if mnemonic == ".BYTE" else 2
+    values = [item for item in operand.split(",")]
+    if not final:
+        # Only the size matters in pass 1
+        return bytes(size * len(values))
+    data = bytearray()
+    for item in values:
+        value = evaluate(item, symbols)
+        if not -(1 << (8 * size - 1)) <= value < (1 << (8 * size)):
+            raise AssemblyError(f"Value {value} does not fit into {mnemonic}")
+        data += (value & ((1 << (8 * size)) - 1)).to_bytes(size, "little")
+    return bytes(data)
+
+
+def instruction_data(mnemonic, operand, pc, symbols, zero_page, number, final):
+    modes = OPCODES[mnemonic]
+    mode, expression, index = split_operand(mnemonic, operand, modes)
+    if mode is None:
+        # zpg or abs, decided in pass 1 (forward references are absolute)
+        if not final:
+            value = evaluate(expression, symbols, required=False)
+            zero_page[number] = value is not None and 0 <= value <= 0xFF and "zpg" + index in modes
+        mode = ("zpg" if zero_page[number] else "abs") + index
+    if mode not in modes:
+        raise AssemblyError(f"{mnemonic} has no addressing mode {mode}")
+    op = modes[mode]
+    # Masswerk assembles BRK as a single byte
+    size = 1 if mode in ("impl", "acc") else op.bytes
+    if not final or size == 1:
+        return bytes([op.opcode]) + bytes(size - 1)
+
+    value = evaluate(expression, symbols)
+    if mode == "rel":
+        value -= pc + 2
+        if not -128 <= value <= 127:
+            raise AssemblyError(f"Branch target out of range ({value} bytes)")
+        value &= 0xFF
+    elif size == 2 and not -128 <= value <= 0xFF:
+        raise AssemblyError(f"Operand {value:#x} does not fit into one byte")
+    elif size == 3 and not 0 <= value <= 0xFFFF:
+        raise AssemblyError(f"Operand {value:#x} does not fit into two bytes")
+    return bytes([op.opcode]) + (value & ((1 << (8 * (size - 1))) - 1)).to_bytes(size - 1, "little")
+
+
+def format_listing(source, listing):
+    lines = source.splitlines()
+    result = []
+    for number, address, data in listing:
+        text = lines[number - 1].rstrip()
+        # Long .BYTE/.WORD lines are continued on the next listing lines
+        for offset in range(0, max(len(data), 1), 4):
+            chunk = " ".join(f"{byte:02X}" for byte in data[offset:offset + 4])
+            column = f"{address + offset:04X}  {chunk:<12}" if data else " " * 18
+            result.append(f"{column}{number:5d}  {text}" if offset == 0 else column.rstrip())
+    return "\n".join(result) + "\n"
+
+
+def format_symbols(symbols):
+    entries = sorted(symbols.items(), key=lambda item: (item[1], item[0]))
+    return "".join(f"{name} = ${address:04X}\n" for name, address in entries)
+
+
+def assembly_key(source, fill=FILL):
+    """
+    Hash identifying an assembled program.
+
+    :return: Hex digest over the source, the fill byte, the opcode_list metadata and the assembler source.
+    """
+    digest = hashlib.sha256()
+    digest.update(ASM_MAGIC)
+    digest.update(source.encode())
+    digest.update(bytes([fill]))
+    for op in opcode_list:
+        digest.update(repr((op.opcode, op.name, op.addressing, op.bytes)).encode())
+    with open(__file__, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()[:32]
+
+
+def assemble_file(path, cache_dir=ASM_CACHE_DIR, fill=FILL):
+    """
+    Return the path of the cached image of a source file, assembling it if needed.
+
+    The cache entry also holds the listing (.lst) and symbol file (.sym) next to
+    the image, all named like the source. The name is part of the entry, so
+    sources with the same content but different names get entries of their own.
+
+    :param path: Assembler source (.65s).
+    :param cache_dir: Directory holding the assembled programs.
+    :param fill: Value of the bytes not written by the program.
+    """
+    with open(path) as f:
+        source = f.read()
+    stem = os.path.splitext(os.path.basename(path))[0]
+    entry = os.path.join(cache_dir, f"{stem}-{assembly_key(source, fill)}")
+    image_path = os.path.join(entry, stem + ".bin")
+    if not os.path.exists(image_path):
+        image, symbols, listing = assemble(source, fill)
+        # Parallel runs may assemble the same program, the entry appears atomically
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cache_dir, prefix=os.path.basename(entry) + ".", suffix=".tmp")
+        with open(os.path.join(tmp, stem + ".bin"), "wb") as f:
+            f.write(image)
+        with open(os.path.join(tmp, stem + ".lst"), "w") as f:
+            f.write(format_listing(source, listing))
+        with open(os.path.join(tmp, stem + ".sym"), "w") as f:
+            f.write(format_symbols(symbols))
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp)
+            if not os.path.exists(image_path):
+                raise
+    return image_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assemble a 6502 program into a 64 KiB image")
+    parser.add_argument("source")
+    parser.add_argument("-o", "--output", help="image, the listing (.lst) and symbols (.sym) are written next to it "
+                                               "(default: source name with .bin)")
+    parser.add_argument("--fill", type=lambda value: int(value, 0), default=FILL, help="value of unused bytes")
+    args = parser.parse_args()
+    try:
+        cached = assemble_file(args.source, fill=args.fill)
+    except AssemblyError as error:
+        sys.exit(f"{args.source}: {error}")
+    output = args.output or os.path.splitext(args.source)[0] + ".bin"
+    for ext in (".bin", ".lst", ".sym"):
+        shutil.copyfile(os.path.splitext(cached)[0] + ext, os.path.splitext(output)[0] + ext)
+    print(f"{args.source}: {output}")
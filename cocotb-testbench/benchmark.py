@@ -0,0 +1,174 @@
+"""
+Benchmark suite of 6502 kernels.
+
+Runs the prebuilt kernels in benchmarks/ (sources next to them as .65s) through
+the cocotb testbench and reports for every kernel the simulated cycles, the
+retired instructions, the CPI (and the speedup over the original 6502, see
+cpi.py) and the wall-clock instructions/second of the testbench. Results are
+saved as JSON; --compare prints the change against an earlier results file,
+so regressions of the RTL state machine (cycles) and of the Python harness
+(instructions/second) show up.
+
+With --model the kernels are run on the golden model instead of the
+simulator (same cycles, instructions/second of the model).
+
+Usage: python benchmark.py [-o benchmark_results.json] [--compare OLD.json] [--model] [-j JOBS] [KERNEL...]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cpi import model_stats
+from golden_model import InvalidOpcode
+from regress import TB_DIR, build_simulation, run_batch
+
+BENCHMARK_DIR = os.path.join(TB_DIR, "benchmarks")
+SIM = os.environ.get("SIM", "icarus")
+
+
+class KernelFailed(Exception):
+    pass
+
+
+def find_kernels(names):
+    """
+    :param names: Kernel names (file names without .bin), all kernels if empty.
+    :return: dict mapping kernel name to the path of its image.
+    """
+    available = sorted(name[:-4] for name in os.listdir(BENCHMARK_DIR) if name.endswith(".bin"))
+    for name in names:
+        if name not in available:
+            raise ValueError(f"Unknown kernel {name}, available: {', '.join(available)}")
+    return {name: os.path.join(BENCHMARK_DIR, name + ".bin") for name in (names or available)}
+
+
+def result_entry(cpi_report, seconds):
+    return {
+        "instructions": cpi_report["instructions"],
+        "cycles": cpi_report["cycles"],
+        "cpi": cpi_report["cpi"],
+        "nmos_cpi": cpi_report["nmos_cpi"],
+        "speedup": cpi_report["speedup"],
+        "seconds": round(seconds, 3),
+        "instructions_per_second": round(cpi_report["instructions"] / seconds, 1) if seconds > 0 else 0.0,
+    }
+
+
+def run_kernel_model(program):
+    """
+    :raises KernelFailed: If the kernel runs into its failure marker (or another invalid opcode).
+    """
+    start = time.perf_counter()
+    try:
+        report = model_stats(program).report()
+    except InvalidOpcode as e:
+        raise KernelFailed(f"{os.path.basename(program)} failed on the golden model: {e}") from None
+    return result_entry(report, time.perf_counter() - start)
+
+
+def run_kernel_simulation(program, work_dir, env):
+    """
+    :raises KernelFailed: If the simulation failed, its results are not used.
+    """
+    run = run_batch([program], work_dir, env)
+    if run["failed"]:
+        raise KernelFailed(f"{os.path.basename(program)} failed (see {run['log']})")
+    program_dir = os.path.dirname(run["results"])
+    with open(os.path.join(program_dir, "cpi_report.json")) as f:
+        report = json.load(f)
+    with open(os.path.join(program_dir, "sim_speed.json")) as f:
+        speed = json.load(f)[SIM]
+    return result_entry(report, speed["seconds"])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=TB_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_results(results, previous=None):
+    lines = [f"{'kernel':<10}{'instructions':>13}{'cycles':>10}{'CPI':>7}{'speedup':>9}{'instr/s':>12}"]
+    for name, entry in results["kernels"].items():
+        line = (f"{name:<10}{entry['instructions']:>13}{entry['cycles']:>10}{entry['cpi']:>7}"
+                f"{entry['speedup']:>9}{entry['instructions_per_second']:>12.0f}")
+        old = previous["kernels"].get(name) if previous else None
+        if old:
+            line += f"   cycles {entry['cycles'] - old['cycles']:+d}"
+            if old["instructions_per_second"]:
+                change = entry["instructions_per_second"] / old["instructions_per_second"] - 1
+                line += f", instr/s {change * 100:+.1f}%"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the 6502 benchmark kernels")
+    parser.add_argument("kernels", nargs="*", help="kernels to run (default: all)")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="results file")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--model", action="store_true", help="run on the golden model instead of the simulator")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="kernels simulated in parallel (more than 1 distorts instructions/s)")
+    parser.add_argument("--work-dir", default="benchmark_build", help="root of the per-kernel working directories")
+    args = parser.parse_args()
+
+    kernels = find_kernels(args.kernels)
+    failed = []
+    if args.model:
+        backend = "golden_model"
+        entries = {}
+        for name, program in kernels.items():
+            try:
+                entries[name] = run_kernel_model(program)
+            except KernelFailed as e:
+                failed.append(name)
+                print(e)
+    else:
+        backend = SIM
+        work_dir = os.path.abspath(args.work_dir)
+        env = dict(os.environ, TRACE_CACHE_DIR=os.path.join(work_dir, ".trace_cache"), REPLAY="0")
+        os.makedirs(work_dir, exist_ok=True)
+        if build_simulation(work_dir, env) != 0:
+            print(f"Compilation failed (see {os.path.join(work_dir, 'build.log')})")
+            return 1
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            futures = {name: pool.submit(run_kernel_simulation, program, work_dir, env)
+                       for name, program in kernels.items()}
+            entries = {}
+            for name, future in futures.items():
+                try:
+                    entries[name] = future.result()
+                except KernelFailed as e:
+                    failed.append(name)
+                    print(e)
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "backend": backend,
+        "kernels": entries,
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print(format_results(results, previous))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if failed:
+        print(f"Failed kernels (not in the results): {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
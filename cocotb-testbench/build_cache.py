@@ -0,0 +1,149 @@
+"""
+Content-addressed cache of the compiled simulation.
+
+An entry is keyed by a hash of the Verilog sources, the compile flags, the
+simulator (and its binary) and the cocotb version. It holds a snapshot of the
+sources and serves as SIM_BUILD, so make only compiles an entry once: runs
+that only change the program and all parallel runs of regress.py reuse the
+compiled image (sim.vvp of Icarus, Vtop of Verilator). Every run of make
+that builds or reuses an entry counts a hit (image already built) or miss in
+stats.log of the cache, looking an entry up is not counted.
+
+Usage:
+    python build_cache.py entry --sim SIM --flags FLAGS SOURCE...   (used by the Makefile)
+    python build_cache.py record --sim SIM ENTRY                    (used by the Makefile before building)
+    python build_cache.py stats
+    python build_cache.py clean
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+from importlib.metadata import PackageNotFoundError, version
+
+TB_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("BUILD_CACHE_DIR", os.path.join(TB_DIR, "build_cache"))
+STATS_FILE = "stats.log"
+
+# Compiled image inside SIM_BUILD, see the cocotb makefile of each simulator
+SIM_IMAGES = {"icarus": "sim.vvp", "verilator": "Vtop"}
+SIM_COMMANDS = {"icarus": "iverilog", "verilator": "verilator"}
+
+
+def cache_key(sim, flags, sources):
+    """
+    :param sim: Simulator name.
+    :param flags: Compile flags as one string.
+    :param sources: Paths of the Verilog sources.
+    :return: Hex digest identifying the compiled simulation.
+    """
+    digest = hashlib.sha256()
+    command = shutil.which(SIM_COMMANDS.get(sim, sim))
+    # A reinstalled simulator has another binary
+    tool = f"{command}:{os.stat(command).st_mtime_ns}" if command else "missing"
+    try:
+        cocotb_version = version("cocotb")
+    except PackageNotFoundError:
+        cocotb_version = "unknown"
+    for part in (sim, tool, cocotb_version, " ".join(flags.split())):
+        digest.update(part.encode() + b"\0")
+    for source in sources:
+        digest.update(os.path.basename(source).encode() + b"\0")
+        with open(source, "rb") as f:
+            digest.update(f.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def prepare_entry(cache_dir, sim, flags, sources):
+    """
+    Look up the entry of a simulation, create it with a snapshot of the sources if it is new.
+
+    :return: (entry directory, True if the compiled image exists already)
+    """
+    key = cache_key(sim, flags, sources)
+    entry = os.path.join(cache_dir, f"{sim}-{key[:16]}")
+    if not os.path.isdir(entry):
+        # Parallel runs may create the same entry, only the first rename wins
+        tmp = f"{entry}.tmp{os.getpid()}"
+        os.makedirs(os.path.join(tmp, "src"))
+        for source in sources:
+            shutil.copy2(source, os.path.join(tmp, "src", os.path.basename(source)))
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp)
+    return entry, image_exists(entry, sim)
+
+
+def image_exists(entry, sim):
+    return os.path.exists(os.path.join(entry, SIM_IMAGES.get(sim, "")))
+
+
+def record(cache_dir, entry, hit):
+    # One short line per lookup, appends of parallel runs do not interleave
+    with open(os.path.join(cache_dir, STATS_FILE), "a") as f:
+        f.write(f"{'hit' if hit else 'miss'} {os.path.basename(entry)}\n")
+
+
+def read_stats(cache_dir=CACHE_DIR):
+    """
+    :return: dict with the number of hits and misses and the hits/misses of every entry.
+    """
+    stats = {"hits": 0, "misses": 0, "entries": {}}
+    path = os.path.join(cache_dir, STATS_FILE)
+    if not os.path.exists(path):
+        return stats
+    with open(path) as f:
+        for line in f:
+            result, entry = line.split()
+            counts = stats["entries"].setdefault(entry, [0, 0])
+            if result == "hit":
+                stats["hits"] += 1
+                counts[0] += 1
+            else:
+                stats["misses"] += 1
+                counts[1] += 1
+    return stats
+
+
+def format_stats(stats):
+    lookups = stats["hits"] + stats["misses"]
+    lines = [f"Build cache: {stats['hits']} hits, {stats['misses']} misses"
+             + (f" ({stats['hits'] / lookups:.0%} hit rate)" if lookups else "")]
+    for entry, (hits, misses) in sorted(stats["entries"].items()):
+        lines.append(f"  {entry}: {hits} hits, {misses} misses")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache of compiled simulations")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    entry_parser = commands.add_parser("entry", help="print the entry directory and hit/miss")
+    entry_parser.add_argument("--sim", required=True)
+    entry_parser.add_argument("--flags", default="")
+    entry_parser.add_argument("sources", nargs="+")
+    record_parser = commands.add_parser("record", help="count a hit or miss of an entry that is built or reused")
+    record_parser.add_argument("--sim", required=True)
+    record_parser.add_argument("entry")
+    commands.add_parser("stats", help="print the hits and misses")
+    commands.add_parser("clean", help="remove all entries")
+    args = parser.parse_args()
+
+    if args.command == "entry":
+        os.makedirs(args.cache_dir, exist_ok=True)
+        entry, hit = prepare_entry(os.path.abspath(args.cache_dir), args.sim, args.flags, args.sources)
+        print(entry, "hit" if hit else "miss")
+    elif args.command == "record":
+        record(args.cache_dir, args.entry, image_exists(args.entry, args.sim))
+    elif args.command == "stats":
+        print(format_stats(read_stats(args.cache_dir)))
+    elif args.command == "clean":
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
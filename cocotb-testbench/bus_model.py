@@ -0,0 +1,104 @@
+import time
+
+import cocotb
+from cocotb.triggers import Event, FallingEdge
+
+from bus_trace import ST_DECODE
+from trace_log import TRACE_NONE, TraceLog
+
+
+class BusModel:
+    """
+    External memory of the CPU, running as a persistent coroutine.
+
+    Once per clock cycle, on the falling edge when addr/RW/data_out are
+    stable, the bus model serves reads from and captures writes into the
+    Memory object. Whenever the CPU is about to decode an opcode (state ==
+    ST_DECODE) an instruction boundary is signalled, so the instruction
+    checker does not need to know how many cycles an instruction takes.
+    Bus cycles are recorded in the TraceLog if its level includes cycles
+    and streamed into the BusTraceWriter if one is given (see bus_trace.py).
+    With `profile` set before start() the time spent in the callbacks is
+    summed up in `busy` (see profiler.py).
+    """
+
+    def __init__(self, dut, mem, trace=None, bus_trace=None):
+        self.mem = mem
+        self.trace = trace if trace is not None else TraceLog(TRACE_NONE)
+        self.bus_trace = bus_trace
+        # Handles are looked up once
+        self.dut = dut
+        self.clk = dut.clk
+        self.addr = dut.addr
+        self.RW = dut.RW
+        self.data_in = dut.data_in
+        self.data_out = dut.data_out
+        self.state = dut.state
+        self.cycle = 0  # falling edges seen since start()
+        self.instruction_start = Event()
+        self.wake_cycle = 0  # instruction boundaries before this cycle are not signalled
+        self.task = None
+        self.profile = False
+        self.busy = 0.0  # seconds spent serving bus cycles, only counted with profile
+
+    def start(self):
+        self.task = cocotb.start_soon(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.kill()
+            self.task = None
+
+    async def run(self):
+        mem = self.mem
+        addr = self.addr
+        RW = self.RW
+        data_in = self.data_in
+        data_out = self.data_out
+        state = self.state
+        falling_edge = FallingEdge(self.clk)
+        bus_trace = self.bus_trace
+        profile = self.profile
+        perf_counter = time.perf_counter
+        while True:
+            await falling_edge
+            if profile:
+                start = perf_counter()
+            self.cycle += 1
+
+            address = addr.value.integer
+            rw = RW.value
+            value = 0
+            # If CPU is reading
+            if rw == 1:
+                value = mem[address]
+                data_in.value = value
+            # If CPU is writing, store data_out into mem
+            elif rw == 0:
+                value = data_out.value.integer
+                mem[address] = value
+
+            if self.trace.cycles:
+                self.trace.cycle(self.cycle, state.value.integer, address, 1 if rw == 1 else 0, value)
+            if bus_trace is not None:
+                bus_trace.append(self.cycle, address, 1 if rw == 1 else 0, value, state.value.integer)
+
+            if state.value == ST_DECODE and self.cycle >= self.wake_cycle:
+                self.instruction_start.set()
+            if profile:
+                self.busy += perf_counter() - start
+
+    async def next_instruction(self, at_cycle=0):
+        """
+        Wait until the CPU is about to decode the next opcode.
+
+        At that point the previous instruction has completed and all its
+        writes have been captured.
+
+        :param at_cycle: Skip all instruction boundaries before this cycle (fast-forward without waking up the caller).
+        :return: The current cycle count.
+        """
+        self.wake_cycle = at_cycle
+        self.instruction_start.clear()
+        await self.instruction_start.wait()
+        return self.cycle
@@ -0,0 +1,192 @@
+"""
+Binary trace of all bus transactions.
+
+The bus model appends one fixed-width record per clock cycle:
+    cycle (u32), addr (u16), RW (u8, 1 = read), data (u8), state (u8, CPU state machine)
+Records are packed into a preallocated buffer and written in chunks. The
+file is read back memory-mapped as a NumPy structured array, so queries
+over millions of cycles are vectorized and only touch the pages they need.
+
+    trace = open_bus_trace("bus_trace.bin")
+    stack_writes = writes(trace, 0x0000, 0x00FF)
+    fetches = len(opcode_fetches(trace))
+
+Usage:
+    python bus_trace.py summary bus_trace.bin
+    python bus_trace.py writes bus_trace.bin [--range 0x0000-0x00FF]
+    python bus_trace.py diff a.bin b.bin
+"""
+import argparse
+import os
+import struct
+
+import numpy as np
+
+ST_DECODE = 0x01  # `ST_DECODE in include.v, the opcode is read in this state
+
+MAGIC = b"6502BUS1"
+# magic, record size
+HEADER = struct.Struct("<8sH6x")
+RECORD = struct.Struct("<IHBBB")
+RECORD_DTYPE = np.dtype([("cycle", "<u4"), ("addr", "<u2"), ("rw", "u1"), ("data", "u1"), ("state", "u1")])
+CHUNK_RECORDS = 1 << 16
+# Fields compared by diff, the cycle numbers of two runs may start at different values
+COMPARED_FIELDS = ["addr", "rw", "data", "state"]
+
+
+class BusTraceError(Exception):
+    pass
+
+
+class BusTraceWriter:
+    """
+    Appends bus transactions to a trace file.
+
+    :param path: Trace file, overwritten.
+    :param chunk_records: Records buffered before they are written.
+    """
+
+    def __init__(self, path, chunk_records=CHUNK_RECORDS):
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, RECORD.size))
+        self.buffer = bytearray(RECORD.size * chunk_records)
+        self.offset = 0
+        self.pack_into = RECORD.pack_into
+
+    def append(self, cycle, addr, rw, data, state):
+        self.pack_into(self.buffer, self.offset, cycle, addr, rw, data, state)
+        self.offset += RECORD.size
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.file.write(memoryview(self.buffer)[:self.offset])
+        self.offset = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+def open_bus_trace(path):
+    """
+    Map a trace file into memory.
+
+    :return: Read-only structured array (RECORD_DTYPE) of all records, backed by the file.
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise BusTraceError(f"{path} is not a bus trace")
+    magic, record_size = HEADER.unpack(header)
+    if magic != MAGIC or record_size != RECORD_DTYPE.itemsize:
+        raise BusTraceError(f"{path} is not a bus trace of this version")
+    # A file that is still written can end in a partial record
+    count = (os.path.getsize(path) - HEADER.size) // record_size
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+
+
+def iter_chunks(path, chunk_records=1 << 20):
+    """
+    :return: Generator of consecutive slices of the trace with at most chunk_records records.
+    """
+    trace = open_bus_trace(path)
+    for start in range(0, len(trace), chunk_records):
+        yield trace[start:start + chunk_records]
+
+
+def reads(trace, first=0x0000, last=0xFFFF):
+    addr = trace["addr"]
+    return trace[(trace["rw"] == 1) & (addr >= first) & (addr <= last)]
+
+
+def writes(trace, first=0x0000, last=0xFFFF):
+    addr = trace["addr"]
+    return trace[(trace["rw"] == 0) & (addr >= first) & (addr <= last)]
+
+
+def opcode_fetches(trace):
+    return trace[(trace["state"] == ST_DECODE) & (trace["rw"] == 1)]
+
+
+def page_histogram(trace):
+    """
+    :return: Accesses per 256 byte page, array of 256 counts.
+    """
+    return np.bincount(trace["addr"] >> 8, minlength=256)
+
+
+def address_histogram(trace):
+    """
+    :return: Accesses per address, array of 65536 counts.
+    """
+    return np.bincount(trace["addr"], minlength=65536)
+
+
+def first_difference(a, b):
+    """
+    Compare two traces record by record (addr, RW, data and state, not the cycle number).
+
+    :return: Index of the first differing record, None if the traces are equal.
+        If one trace is a prefix of the other, the length of the shorter one.
+    """
+    length = min(len(a), len(b))
+    differs = np.zeros(length, dtype=bool)
+    for field in COMPARED_FIELDS:
+        differs |= a[field][:length] != b[field][:length]
+    index = np.flatnonzero(differs)
+    if len(index):
+        return int(index[0])
+    return None if len(a) == len(b) else length
+
+
+def format_records(records):
+    return "\n".join(
+        f"cycle {record['cycle']:8d}: state={record['state']:2d} addr={record['addr']:04x} "
+        f"{'R' if record['rw'] == 1 else 'W'} data={record['data']:02x}"
+        for record in records
+    )
+
+
+def parse_range(text):
+    first, _, last = text.partition("-")
+    return int(first, 0), int(last or first, 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query binary bus traces")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_parser = commands.add_parser("summary", help="cycles, reads, writes, fetches and the busiest pages")
+    summary_parser.add_argument("trace")
+    writes_parser = commands.add_parser("writes", help="print the writes to an address range")
+    writes_parser.add_argument("trace")
+    writes_parser.add_argument("--range", default="0x0000-0xFFFF", help="FIRST-LAST")
+    diff_parser = commands.add_parser("diff", help="find the first differing bus cycle of two traces")
+    diff_parser.add_argument("a")
+    diff_parser.add_argument("b")
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        trace = open_bus_trace(args.trace)
+        write_count = int((trace["rw"] == 0).sum())
+        print(f"{len(trace)} cycles, {len(trace) - write_count} reads, {write_count} writes, "
+              f"{len(opcode_fetches(trace))} opcode fetches")
+        pages = page_histogram(trace)
+        for page in np.argsort(pages)[::-1][:8]:
+            if pages[page]:
+                print(f"  page {page:02x}: {pages[page]} accesses")
+    elif args.command == "writes":
+        print(format_records(writes(open_bus_trace(args.trace), *parse_range(args.range))))
+    else:
+        a, b = open_bus_trace(args.a), open_bus_trace(args.b)
+        index = first_difference(a, b)
+        if index is None:
+            print(f"Traces are equal ({len(a)} cycles)")
+        else:
+            print(f"First difference at record {index}:")
+            print(f"  {args.a}: {format_records(a[index:index + 1]) or 'end of trace'}")
+            print(f"  {args.b}: {format_records(b[index:index + 1]) or 'end of trace'}")
@@ -0,0 +1,231 @@
+"""
+Cycles per instruction of this design compared with the original NMOS 6502.
+
+The testbench counts the cycles every retired instruction took, grouped by
+opcode, and computes the cycles the same instruction would have taken on the
+original 6502 (including the page crossing penalties of indexed reads and
+taken branches). Taken and not taken branches are counted separately.
+
+The same report can be produced without a simulator by running the program
+on the golden model, which has the cycle counts of the RTL.
+
+Usage: python cpi.py [-o cpi_report.json] [test.bin]
+"""
+import argparse
+import json
+import os
+
+from golden_model import CPUModel, InvalidOpcode, load_program
+from opcodes import BRANCH_CONDITIONS, opcode_list
+
+_READ = {"imm": 2, "zpg": 3, "zpg_x": 4, "abs": 4, "abs_x": 4, "abs_y": 4, "ind_x": 6, "ind_y": 5}
+_READ_MODIFY_WRITE = {"acc": 2, "zpg": 5, "zpg_x": 6, "abs": 6, "abs_x": 7}
+
+# Cycles of the original NMOS 6502 without penalties, by name and addressing mode
+NMOS_TIMINGS = {
+    "ADC": _READ, "AND": _READ, "CMP": _READ, "EOR": _READ, "LDA": _READ, "ORA": _READ, "SBC": _READ,
+    "STA": {"zpg": 3, "zpg_x": 4, "abs": 4, "abs_x": 5, "abs_y": 5, "ind_x": 6, "ind_y": 6},
+    "ASL": _READ_MODIFY_WRITE, "LSR": _READ_MODIFY_WRITE, "ROL": _READ_MODIFY_WRITE, "ROR": _READ_MODIFY_WRITE,
+    "DEC": _READ_MODIFY_WRITE, "INC": _READ_MODIFY_WRITE,
+    "BIT": {"zpg": 3, "abs": 4},
+    "CPX": {"imm": 2, "zpg": 3, "abs": 4},
+    "CPY": {"imm": 2, "zpg": 3, "abs": 4},
+    "LDX": {"imm": 2, "zpg": 3, "zpg_y": 4, "abs": 4, "abs_y": 4},
+    "LDY": {"imm": 2, "zpg": 3, "zpg_x": 4, "abs": 4, "abs_x": 4},
+    "STX": {"zpg": 3, "zpg_y": 4, "abs": 4},
+    "STY": {"zpg": 3, "zpg_x": 4, "abs": 4},
+    "JMP": {"abs": 3, "ind": 5},
+    "JSR": {"abs": 6},
+    "RTS": {"impl": 6},
+    "RTI": {"impl": 6},
+    "BRK": {"impl": 7},
+    "PHA": {"impl": 3},
+    "PHP": {"impl": 3},
+    "PLA": {"impl": 4},
+    "PLP": {"impl": 4},
+}
+# Everything else (transfers, flag instructions, INX/DEX/..., NOP) takes 2 cycles, branches 2 if not taken
+NMOS_DEFAULT = {"impl": 2, "rel": 2}
+
+# Indexed reads take one more cycle when the indexed address is in another page than the base address
+PAGE_PENALTY_NAMES = ("ADC", "AND", "CMP", "EOR", "LDA", "LDX", "LDY", "ORA", "SBC")
+PAGE_PENALTY_MODES = ("abs_x", "abs_y", "ind_y")
+
+
+def build_nmos_table():
+    """
+    :return: (list of 256 NMOS base cycle counts, None for opcodes without one (END), list of 256 page penalty flags)
+    """
+    cycles = [None] * 256
+    page_penalty = [False] * 256
+    for op in opcode_list:
+        if op.name == "END":
+            continue
+        cycles[op.opcode] = NMOS_TIMINGS.get(op.name, NMOS_DEFAULT)[op.addressing]
+        page_penalty[op.opcode] = op.name in PAGE_PENALTY_NAMES and op.addressing in PAGE_PENALTY_MODES
+    return cycles, page_penalty
+
+
+NMOS_CYCLES, NMOS_PAGE_PENALTY = build_nmos_table()
+OPCODES = {op.opcode: op for op in opcode_list}
+
+
+def nmos_cycles(op, mem, opcode_addr, regs, taken):
+    """
+    Cycles an instruction takes on the original 6502.
+
+    :param op: Opcode of the instruction.
+    :param mem: Memory before the instruction.
+    :param opcode_addr: Address of the opcode.
+    :param regs: Registers before the instruction (dict with X and Y).
+    :param taken: True for a taken branch.
+    """
+    cycles = NMOS_CYCLES[op.opcode]
+    if op.addressing == "rel":
+        if taken:
+            # +1 for the taken branch, +1 if the target is in another page than the next instruction
+            offset = mem[(opcode_addr + 1) & 0xFFFF]
+            next_addr = (opcode_addr + 2) & 0xFFFF
+            target = (next_addr + offset - (0x100 if offset & 0x80 else 0)) & 0xFFFF
+            cycles += 1 + ((next_addr ^ target) > 0xFF)
+    elif NMOS_PAGE_PENALTY[op.opcode]:
+        if op.addressing == "ind_y":
+            pointer = mem[(opcode_addr + 1) & 0xFFFF]
+            base = mem[pointer] | (mem[(pointer + 1) & 0xFF] << 8)
+            index = regs["Y"]
+        else:
+            base = mem[(opcode_addr + 1) & 0xFFFF] | (mem[(opcode_addr + 2) & 0xFFFF] << 8)
+            index = regs["X"] if op.addressing == "abs_x" else regs["Y"]
+        cycles += (base & 0xFF) + index > 0xFF
+    return cycles
+
+
+class CPIStats:
+    """
+    Cycle counts of the retired instructions of one workload.
+
+    Counters are kept in preallocated lists indexed by opcode:
+    [instructions, cycles, NMOS cycles].
+    """
+
+    def __init__(self, workload):
+        self.workload = workload
+        self.counts = [[0, 0, 0] for _ in range(256)]
+        # Conditional branches: [instructions, cycles, NMOS cycles]
+        self.branches = {"taken": [0, 0, 0], "not_taken": [0, 0, 0]}
+
+    def add(self, op, cycles, nmos, taken=None):
+        """
+        Count one retired instruction.
+
+        :param op: Opcode of the instruction.
+        :param cycles: Cycles it took on this design (without reset cycles).
+        :param nmos: Cycles it takes on the original 6502.
+        :param taken: For conditional branches whether the branch was taken, None otherwise.
+        """
+        counts = self.counts[op.opcode]
+        counts[0] += 1
+        counts[1] += cycles
+        counts[2] += nmos
+        if taken is not None:
+            counts = self.branches["taken" if taken else "not_taken"]
+            counts[0] += 1
+            counts[1] += cycles
+            counts[2] += nmos
+
+    def report(self):
+        """
+        :return: dict with totals, CPI and speedup overall, per opcode and for taken / not taken branches.
+        """
+        def summary(instructions, cycles, nmos):
+            return {
+                "instructions": instructions,
+                "cycles": cycles,
+                "nmos_cycles": nmos,
+                "cpi": round(cycles / instructions, 3) if instructions else 0.0,
+                "nmos_cpi": round(nmos / instructions, 3) if instructions else 0.0,
+                "speedup": round(nmos / cycles, 3) if cycles else 0.0,
+            }
+
+        opcodes = []
+        totals = [0, 0, 0]
+        for op in opcode_list:
+            counts = self.counts[op.opcode]
+            if counts[0] == 0:
+                continue
+            opcodes.append(dict(opcode=f"{op.opcode:#04x}", name=op.name, addressing=op.addressing, **summary(*counts)))
+            for i in range(3):
+                totals[i] += counts[i]
+        report = {"workload": self.workload}
+        report.update(summary(*totals))
+        report["branches"] = {kind: summary(*counts) for kind, counts in self.branches.items()}
+        report["opcodes"] = opcodes
+        return report
+
+
+def format_report(report):
+    lines = [
+        f"Workload {report['workload']}: {report['instructions']} instructions, {report['cycles']} cycles, "
+        f"CPI {report['cpi']} (NMOS 6502: {report['nmos_cycles']} cycles, CPI {report['nmos_cpi']}), "
+        f"speedup {report['speedup']}x",
+        f"{'opcode':<18}{'count':>10}{'cycles':>10}{'CPI':>7}{'NMOS CPI':>10}{'speedup':>9}",
+    ]
+    rows = [(f"{entry['name']} {entry['addressing']}", entry) for entry in report["opcodes"]]
+    rows += [(f"branch {kind}", entry) for kind, entry in report["branches"].items()]
+    for name, entry in rows:
+        lines.append(
+            f"{name:<18}{entry['instructions']:>10}{entry['cycles']:>10}{entry['cpi']:>7}"
+            f"{entry['nmos_cpi']:>10}{entry['speedup']:>9}"
+        )
+    return "\n".join(lines)
+
+
+def write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def model_stats(program, max_instructions=10_000_000):
+    """
+    Count the cycles of a program on the golden model.
+
+    :param program: Path of the program image.
+    :param max_instructions: Abort programs that do not reach END.
+    :return: CPIStats of the program.
+    :raises InvalidOpcode: If the program runs into an invalid opcode (e.g. a failure marker).
+    """
+    model = CPUModel(load_program(program))
+    stats = CPIStats(os.path.basename(program))
+    mem = model.mem
+    while True:
+        if model.instructions >= max_instructions:
+            raise RuntimeError(f"Program did not reach END within {max_instructions} instructions")
+        opcode_addr = model.PC
+        op = OPCODES.get(mem[opcode_addr])
+        if op is None:
+            # The kernels mark a wrong result with an invalid opcode, it must not pass as the end
+            raise InvalidOpcode(f"Invalid opcode {hex(mem[opcode_addr])} found at address {opcode_addr}")
+        if op.name == "END":
+            break
+        regs = model.state()
+        taken = None
+        if op.name in BRANCH_CONDITIONS:
+            flag, value = BRANCH_CONDITIONS[op.name]
+            taken = regs[flag] == value
+        # Operands are read before the instruction can change memory
+        nmos = nmos_cycles(op, mem, opcode_addr, regs, taken)
+        reset = model.pending_cycles
+        cycles = model.step() - reset
+        stats.add(op, cycles, nmos, taken)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPI of a program compared with the original 6502")
+    parser.add_argument("program", nargs="?", default="test.bin")
+    parser.add_argument("-o", "--output", help="write the report as JSON")
+    args = parser.parse_args()
+    report = model_stats(args.program).report()
+    print(format_report(report))
+    if args.output:
+        write_report(report, args.output)
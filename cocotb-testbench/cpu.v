@@ -14,25 +14,48 @@ module CPU (
 
     // External Memory Interface
     output reg [15:0]  addr,
+`ifdef SPLIT_DATA_BUS
+    // Separate data ports for simulators without tri-state resolution (Verilator)
+    input  wire [7:0]  data_in,
+    output reg [7:0]   data_out,
+`else
     inout wire [7:0]   data,   // Shared data bus
+`endif
     output reg [1:0]   RW, // 1 = read, 0 = write
 
     // Debug:
-    output reg[4:0] state
+    output reg[4:0] state,
+    output wire [54:0] snapshot // {PC, ACC, SP, X, Y, N, V, B, D, I, Z, C} for reading all registers at once
 
 );
-// Initialize outputs to known values at time zero.
+`ifdef WAVE_DUMP
+// Waveform capture, switched on and off by the testbench through wave_dump_enable (see WAVE_MODE in the Makefile)
+reg wave_dump_enable = 1'b0;
 initial begin
+`ifdef WAVE_FST
+    $dumpfile("wave_output.fst");
+`else
     $dumpfile("wave_output.vcd");
+`endif
     $dumpvars(0,CPU);
+    $dumpoff;
 end
+always @(wave_dump_enable) begin
+    if (wave_dump_enable)
+        $dumpon;
+    else
+        $dumpoff;
+end
+`endif
 
+`ifndef SPLIT_DATA_BUS
 // Registers for storing values (if needed for later processing)
 reg [7:0] data_out; // Data to drive the bus when writing
 wire [7:0] data_in;
 assign data_in = data;
 // Tri-state assignment: drive the bus when writing; otherwise, high impedance.
 assign data = ~RW ? data_out : 8'bz; // Drive when writing, high-Z otherwise
+`endif
 
 // Internal registers
 reg [7:0] SP; // Stack Pointer
@@ -55,6 +78,8 @@ reg C;  // Carry flag
 
 // reg [4:0] state;
 
+assign snapshot = {PC, ACC, SP, X, Y, N, V, B, D, I, Z, C};
+
 reg [7:0] INTERNAL_ALU_A;
 reg [7:0] INTERNAL_ALU_B;
 reg [8:0] INTERNAL_ALU_TMP_OUT;
@@ -0,0 +1,154 @@
+"""
+Expected instruction traces generated offline with the golden model.
+
+A trace holds one record per executed instruction: the address of the
+opcode, the registers and flags after the instruction, the number of cycles
+it took and the memory writes it did. Traces are cached on disk and keyed by
+a hash of the program binary, the opcode_list metadata and the sources of the
+golden model (golden_model.py and the ALU tables of alu_tables.py), so a
+changed binary or model regenerates its trace automatically.
+
+Usage: python expected_trace.py [test.bin]
+"""
+import hashlib
+import os
+import struct
+import sys
+from collections import namedtuple
+
+import alu_tables
+import golden_model
+from golden_model import CPUModel
+from loader import load_image
+from opcodes import opcode_list
+
+TRACE_MAGIC = b"6502TRC1"
+TRACE_CACHE_DIR = os.environ.get("TRACE_CACHE_DIR", ".trace_cache")
+# Sources defining the semantics of the golden model, a change regenerates all traces
+MODEL_MODULES = (golden_model, alu_tables)
+
+# opcode_addr, PC, ACC, X, Y, SP, status, cycles, number of writes (followed by address, value per write)
+RECORD = struct.Struct("<HHBBBBBBB")
+WRITE = struct.Struct("<HB")
+
+TraceRecord = namedtuple("TraceRecord", "opcode_addr pc acc x y sp status cycles writes")
+
+
+def pack_status(state):
+    # Flags packed like the 6502 status register, B is stored in bit 4
+    return (
+        (state["N"] << 7) | (state["V"] << 6) | (state["B"] << 4) |
+        (state["D"] << 3) | (state["I"] << 2) | (state["Z"] << 1) | state["C"]
+    )
+
+
+def unpack_status(status):
+    return {
+        "N": (status >> 7) & 1,
+        "V": (status >> 6) & 1,
+        "B": (status >> 4) & 1,
+        "D": (status >> 3) & 1,
+        "I": (status >> 2) & 1,
+        "Z": (status >> 1) & 1,
+        "C": status & 1,
+    }
+
+
+def trace_key(binary_data):
+    """
+    Hash identifying the trace of a program.
+
+    :param binary_data: The program image.
+    :return: Hex digest over the image, the opcode_list metadata and the sources of the golden model.
+    """
+    digest = hashlib.sha256()
+    digest.update(TRACE_MAGIC)
+    digest.update(bytes(binary_data))
+    for op in opcode_list:
+        digest.update(repr((op.opcode, op.name, op.addressing, op.bytes, op.cycles,
+                            op.affected_flags, op.affected_regs)).encode())
+    for module in MODEL_MODULES:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:32]
+
+
+def generate_trace(binary_data, path, max_instructions=10_000_000):
+    """
+    Run a program on the golden model and write its trace.
+
+    :param binary_data: The program image, loaded at address 0.
+    :param path: File the trace is written to.
+    :param max_instructions: Abort programs that do not reach END.
+    :return: Number of records written.
+    """
+    mem = bytearray([0xFF]) * 65536
+    mem[:len(binary_data)] = binary_data
+    model = CPUModel(mem)
+    pack_record = RECORD.pack
+    pack_write = WRITE.pack
+    chunks = [TRACE_MAGIC]
+    while not model.halted:
+        if model.instructions >= max_instructions:
+            raise RuntimeError(f"Program did not reach END within {max_instructions} instructions")
+        opcode_addr = model.PC
+        cycles = model.step()
+        chunks.append(pack_record(
+            opcode_addr, model.PC, model.ACC, model.X, model.Y, model.SP,
+            pack_status(model.state()), cycles, len(model.writes),
+        ))
+        for address, value in model.writes:
+            chunks.append(pack_write(address, value))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b"".join(chunks))
+    os.replace(tmp_path, path)  # atomic, parallel runs may generate the same trace
+    return model.instructions
+
+
+def trace_for(binary_data, cache_dir=TRACE_CACHE_DIR):
+    """
+    Return the path of the cached trace for a program, generating it if needed.
+
+    :param binary_data: The program image.
+    :param cache_dir: Directory holding the cached traces.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, trace_key(binary_data) + ".trace")
+    if not os.path.exists(path):
+        generate_trace(binary_data, path)
+    return path
+
+
+def read_trace(path):
+    """
+    Stream the records of a trace file.
+
+    :param path: Trace file written by generate_trace.
+    :return: Generator of TraceRecord, writes is a tuple of (address, value).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(f"{path} is not a trace file")
+    unpack_record = RECORD.unpack_from
+    unpack_write = WRITE.unpack_from
+    record_size = RECORD.size
+    write_size = WRITE.size
+    offset = len(TRACE_MAGIC)
+    while offset < len(data):
+        fields = unpack_record(data, offset)
+        offset += record_size
+        writes = []
+        for _ in range(fields[-1]):
+            writes.append(unpack_write(data, offset))
+            offset += write_size
+        yield TraceRecord(*fields[:-1], tuple(writes))
+
+
+if __name__ == "__main__":
+    program = sys.argv[1] if len(sys.argv) > 1 else "test.bin"
+    trace_path = trace_for(load_image(program))
+    records = sum(1 for _ in read_trace(trace_path))
+    print(f"{program}: {records} records in {trace_path}")
@@ -0,0 +1,478 @@
+"""
+Reference model of the 6502 implemented in cpu.v.
+
+Executes programs instruction by instruction without an HDL simulator and
+follows the same semantics the validators in test_cpu.py expect, including
+the reduced cycle counts from opcode_list:
+ - the stack lives in page zero (the 8 bit SP is used as address)
+ - RTS and RTI read the stack at the 16 bit address SP + 1, so with SP = 0xFF
+   they read 0x0100 instead of wrapping to 0x0000 (PLA/PLP wrap), SP itself wraps
+ - BRK and PHP push the status register with bits 5 and 4 set
+ - V is always cleared by ADC/SBC in decimal mode
+ - taken branches need one extra cycle, the first instruction after a reset three
+
+Usage: python golden_model.py [test.bin]
+"""
+import sys
+import time
+
+from alu_tables import adc, compare, sbc
+from loader import load_image
+from opcodes import BRANCH_CONDITIONS, opcode_list
+
+# Cycles between the release of reset_n and the first instruction (ST_RESET -> ST_FETCH_OPERAND_LOW -> ST_FETCH_OPERAND_HIGH)
+RESET_CYCLES = 3
+
+
+# Instructions that set PC themselves
+CONTROL_FLOW = ("JMP", "JSR", "RTS", "BRK", "RTI")
+
+
+class InvalidOpcode(Exception):
+    pass
+
+
+class CPUModel:
+    """
+    Instruction level model of the CPU.
+
+    Registers and flags are plain integer attributes. mem is a 64 KiB
+    bytearray (or anything indexable that behaves like one). The writes of
+    the last executed instruction are kept in `writes` as (address, value).
+    """
+
+    def __init__(self, mem=None):
+        self.mem = bytearray([0xFF]) * 65536 if mem is None else mem
+        self.writes = []
+        self.table = self._build_table()
+        self.reset()
+
+    def reset(self):
+        # Same values the RTL assigns while reset_n is low, PC is loaded from the reset vector
+        self.PC = (self.mem[0xFFFD] << 8) | self.mem[0xFFFC]
+        self.SP = 0xFF
+        self.ACC = 0
+        self.X = 0
+        self.Y = 0
+        self.N = self.V = self.B = self.D = self.I = self.Z = self.C = 0
+        self.pending_cycles = RESET_CYCLES
+        self.cycles = 0
+        self.instructions = 0
+        self.halted = False
+
+    def state(self):
+        """Registers and flags with the same keys the testbench uses for the DUT signals."""
+        return {
+            "PC": self.PC,
+            "ACC": self.ACC,
+            "SP": self.SP,
+            "X": self.X,
+            "Y": self.Y,
+            "N": self.N,
+            "V": self.V,
+            "B": self.B,
+            "D": self.D,
+            "I": self.I,
+            "Z": self.Z,
+            "C": self.C,
+        }
+
+    def status_byte(self):
+        # Status register as pushed by BRK and PHP (bits 5 and 4 always set)
+        return (
+            (self.N << 7) | (self.V << 6) | 0x30 | (self.D << 3) | (self.I << 2) | (self.Z << 1) | self.C
+        )
+
+    def step(self):
+        """
+        Execute one instruction.
+
+        :return: Number of clock cycles the instruction took on the DUT.
+        """
+        self.writes.clear()
+        opcode = self.mem[self.PC]
+        handler = self.table[opcode]
+        if handler is None:
+            raise InvalidOpcode(f"Invalid opcode {hex(opcode)} found at address {self.PC}")
+        cycles = handler() + self.pending_cycles
+        self.pending_cycles = 0
+        self.cycles += cycles
+        self.instructions += 1
+        return cycles
+
+    def run(self, max_instructions=None):
+        """
+        Execute instructions until the END opcode (0x04) is reached.
+
+        :param max_instructions: Stop after this many instructions (None for no limit).
+        :return: Number of executed instructions.
+        """
+        start = self.instructions
+        step = self.step
+        while not self.halted:
+            if max_instructions is not None and self.instructions - start >= max_instructions:
+                break
+            step()
+        return self.instructions - start
+
+    # ########## Memory access ##########
+
+    def write(self, address, value):
+        self.mem[address] = value
+        self.writes.append((address, value))
+
+    def push(self, value):
+        self.write(self.SP, value)
+        self.SP = (self.SP - 1) & 0xFF
+
+    def pull(self):
+        self.SP = (self.SP + 1) & 0xFF
+        return self.mem[self.SP]
+
+    def pull_return(self):
+        # RTS and RTI address the stack with SP + 1 before SP is incremented (addr <= SP + 1 in cpu.v),
+        # the 16 bit sum does not wrap to page zero
+        address = self.SP + 1
+        self.SP = address & 0xFF
+        return self.mem[address]
+
+    # ########## Addressing modes ##########
+    # Return the effective address, PC points to the opcode
+
+    def addr_imm(self):
+        return self.PC + 1
+
+    def addr_zpg(self):
+        return self.mem[self.PC + 1]
+
+    def addr_zpg_x(self):
+        return (self.mem[self.PC + 1] + self.X) & 0xFF
+
+    def addr_zpg_y(self):
+        return (self.mem[self.PC + 1] + self.Y) & 0xFF
+
+    def addr_abs(self):
+        mem = self.mem
+        return (mem[self.PC + 2] << 8) | mem[self.PC + 1]
+
+    def addr_abs_x(self):
+        return (self.addr_abs() + self.X) & 0xFFFF
+
+    def addr_abs_y(self):
+        return (self.addr_abs() + self.Y) & 0xFFFF
+
+    def addr_ind_x(self):
+        mem = self.mem
+        zpg_addr = (mem[self.PC + 1] + self.X) & 0xFF
+        return (mem[zpg_addr + 1] << 8) | mem[zpg_addr]
+
+    def addr_ind_y(self):
+        mem = self.mem
+        zpg_addr = mem[self.PC + 1]
+        return (((mem[zpg_addr + 1] << 8) | mem[zpg_addr]) + self.Y) & 0xFFFF
+
+    # ########## Instructions ##########
+    # Every instruction gets the effective address (None for impl/acc) and the opcode metadata,
+    # updates PC and returns the number of cycles
+
+    def set_nz(self, value):
+        self.N = value >> 7
+        self.Z = int(value == 0)
+
+    def op_lda(self, address, op):
+        self.ACC = self.mem[address]
+        self.set_nz(self.ACC)
+
+    def op_ldx(self, address, op):
+        self.X = self.mem[address]
+        self.set_nz(self.X)
+
+    def op_ldy(self, address, op):
+        self.Y = self.mem[address]
+        self.set_nz(self.Y)
+
+    def op_sta(self, address, op):
+        self.write(address, self.ACC)
+
+    def op_stx(self, address, op):
+        self.write(address, self.X)
+
+    def op_sty(self, address, op):
+        self.write(address, self.Y)
+
+    def op_ora(self, address, op):
+        self.ACC |= self.mem[address]
+        self.set_nz(self.ACC)
+
+    def op_and(self, address, op):
+        self.ACC &= self.mem[address]
+        self.set_nz(self.ACC)
+
+    def op_eor(self, address, op):
+        self.ACC ^= self.mem[address]
+        self.set_nz(self.ACC)
+
+    def set_arithmetic(self, result, status):
+        # Result and flags of a reference ALU table entry (see alu_tables.py)
+        self.ACC = result
+        self.N = status >> 7
+        self.V = (status >> 6) & 1
+        self.Z = (status >> 1) & 1
+        self.C = status & 1
+
+    def op_adc(self, address, op):
+        self.set_arithmetic(*adc(self.ACC, self.mem[address], self.C, self.D))
+
+    def op_sbc(self, address, op):
+        self.set_arithmetic(*sbc(self.ACC, self.mem[address], self.C, self.D))
+
+    def compare(self, register, address):
+        _, status = compare(register, self.mem[address])
+        self.N = status >> 7
+        self.Z = (status >> 1) & 1
+        self.C = status & 1
+
+    def op_cmp(self, address, op):
+        self.compare(self.ACC, address)
+
+    def op_cpx(self, address, op):
+        self.compare(self.X, address)
+
+    def op_cpy(self, address, op):
+        self.compare(self.Y, address)
+
+    def op_bit(self, address, op):
+        operand = self.mem[address]
+        self.N = operand >> 7
+        self.V = (operand >> 6) & 1
+        self.Z = int((self.ACC & operand) == 0)
+
+    def op_inc(self, address, op):
+        value = (self.mem[address] + 1) & 0xFF
+        self.write(address, value)
+        self.set_nz(value)
+
+    def op_dec(self, address, op):
+        value = (self.mem[address] - 1) & 0xFF
+        self.write(address, value)
+        self.set_nz(value)
+
+    def shift(self, address, shift):
+        # ASL/ROL/LSR/ROR on the accumulator (address None) or memory
+        value = self.ACC if address is None else self.mem[address]
+        value, self.C = shift(value, self.C)
+        if address is None:
+            self.ACC = value
+        else:
+            self.write(address, value)
+        self.set_nz(value)
+
+    def op_asl(self, address, op):
+        self.shift(address, lambda value, carry: ((value << 1) & 0xFF, value >> 7))
+
+    def op_rol(self, address, op):
+        self.shift(address, lambda value, carry: (((value << 1) & 0xFF) | carry, value >> 7))
+
+    def op_lsr(self, address, op):
+        self.shift(address, lambda value, carry: (value >> 1, value & 1))
+
+    def op_ror(self, address, op):
+        self.shift(address, lambda value, carry: ((value >> 1) | (carry << 7), value & 1))
+
+    def op_inx(self, address, op):
+        self.X = (self.X + 1) & 0xFF
+        self.set_nz(self.X)
+
+    def op_iny(self, address, op):
+        self.Y = (self.Y + 1) & 0xFF
+        self.set_nz(self.Y)
+
+    def op_dex(self, address, op):
+        self.X = (self.X - 1) & 0xFF
+        self.set_nz(self.X)
+
+    def op_dey(self, address, op):
+        self.Y = (self.Y - 1) & 0xFF
+        self.set_nz(self.Y)
+
+    def op_tax(self, address, op):
+        self.X = self.ACC
+        self.set_nz(self.X)
+
+    def op_tay(self, address, op):
+        self.Y = self.ACC
+        self.set_nz(self.Y)
+
+    def op_txa(self, address, op):
+        self.ACC = self.X
+        self.set_nz(self.ACC)
+
+    def op_tya(self, address, op):
+        self.ACC = self.Y
+        self.set_nz(self.ACC)
+
+    def op_tsx(self, address, op):
+        self.X = self.SP
+        self.set_nz(self.X)
+
+    def op_txs(self, address, op):
+        self.SP = self.X
+
+    def op_sec(self, address, op):
+        self.C = 1
+
+    def op_clc(self, address, op):
+        self.C = 0
+
+    def op_sei(self, address, op):
+        self.I = 1
+
+    def op_cli(self, address, op):
+        self.I = 0
+
+    def op_sed(self, address, op):
+        self.D = 1
+
+    def op_cld(self, address, op):
+        self.D = 0
+
+    def op_clv(self, address, op):
+        self.V = 0
+
+    def op_pha(self, address, op):
+        self.push(self.ACC)
+
+    def op_php(self, address, op):
+        self.push(self.status_byte())
+
+    def op_pla(self, address, op):
+        self.ACC = self.pull()
+        self.set_nz(self.ACC)
+
+    def set_status(self, status):
+        # B is not stored in the status register and keeps its value
+        self.N = (status >> 7) & 1
+        self.V = (status >> 6) & 1
+        self.D = (status >> 3) & 1
+        self.I = (status >> 2) & 1
+        self.Z = (status >> 1) & 1
+        self.C = status & 1
+
+    def op_plp(self, address, op):
+        self.set_status(self.pull())
+
+    # Control flow instructions set PC themselves and return the number of cycles
+
+    def op_jmp(self, address, op):
+        if op.addressing == "ind":
+            mem = self.mem
+            address = (mem[address + 1] << 8) | mem[address]
+        self.PC = address
+        return op.cycles
+
+    def op_jsr(self, address, op):
+        return_addr = self.PC + 2
+        self.push(return_addr >> 8)
+        self.push(return_addr & 0xFF)
+        self.PC = address
+        return op.cycles
+
+    def op_rts(self, address, op):
+        low = self.pull_return()
+        high = self.pull_return()
+        self.PC = (((high << 8) | low) + 1) & 0xFFFF
+        return op.cycles
+
+    def op_brk(self, address, op):
+        return_addr = self.PC + 2
+        self.push(return_addr >> 8)
+        self.push(return_addr & 0xFF)
+        self.push(self.status_byte())
+        self.I = 1
+        self.PC = (self.mem[0xFFFF] << 8) | self.mem[0xFFFE]
+        return op.cycles
+
+    def op_rti(self, address, op):
+        self.set_status(self.pull_return())
+        low = self.pull_return()
+        high = self.pull_return()
+        self.PC = (high << 8) | low
+        return op.cycles
+
+    def op_nop(self, address, op):
+        pass
+
+    def op_end(self, address, op):
+        self.halted = True
+
+    def _branch(self, op):
+        flag, value = BRANCH_CONDITIONS[op.name]
+
+        def handler():
+            if getattr(self, flag) == value:
+                offset = self.mem[self.PC + 1]
+                if offset > 127:
+                    offset -= 256
+                self.PC = (self.PC + 2 + offset) & 0xFFFF
+                return op.cycles + 1  # taken branches need one extra cycle
+            self.PC = (self.PC + 2) & 0xFFFF
+            return op.cycles
+        return handler
+
+    def _build_table(self):
+        # opcode byte -> handler without arguments that executes the instruction and returns its cycles
+        addressing = {
+            "impl": None,
+            "acc": None,
+            "imm": self.addr_imm,
+            "zpg": self.addr_zpg,
+            "zpg_x": self.addr_zpg_x,
+            "zpg_y": self.addr_zpg_y,
+            "abs": self.addr_abs,
+            "abs_x": self.addr_abs_x,
+            "abs_y": self.addr_abs_y,
+            "ind": self.addr_abs,
+            "ind_x": self.addr_ind_x,
+            "ind_y": self.addr_ind_y,
+        }
+        table = [None] * 256
+        for op in opcode_list:
+            if op.addressing == "rel":
+                table[op.opcode] = self._branch(op)
+            else:
+                table[op.opcode] = self._handler(op, addressing[op.addressing], getattr(self, "op_" + op.name.lower()))
+        return table
+
+    def _handler(self, op, resolve, execute):
+        cycles = op.cycles
+        length = op.bytes
+
+        if op.name in CONTROL_FLOW:
+            def handler():
+                return execute(resolve() if resolve is not None else None, op)
+        elif resolve is None:
+            def handler():
+                execute(None, op)
+                self.PC = (self.PC + length) & 0xFFFF
+                return cycles
+        else:
+            def handler():
+                execute(resolve(), op)
+                self.PC = (self.PC + length) & 0xFFFF
+                return cycles
+        return handler
+
+
+def load_program(path):
+    """Return a 64 KiB memory image of the program at `path` (flat binary loaded at address 0, see loader.py)."""
+    return load_image(path)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "test.bin"
+    model = CPUModel(load_program(path))
+    start = time.perf_counter()
+    model.run()
+    elapsed = time.perf_counter() - start
+    print(f"{path}: {model.instructions} instructions, {model.cycles} cycles, "
+          f"{model.instructions / max(elapsed, 1e-9):.0f} instructions/s")
@@ -0,0 +1,294 @@
+"""
+Compare a logic analyzer capture of the FPGA with the simulated bus trace.
+
+fpga-test/top.v puts the 1 MHz CPU clock on gp[0], the data bus on gp[8:1]
+and RW on gp[9]. A capture of these pins is sampled on the falling clock
+edges (where the bus model of the testbench samples the bus), aligned with
+a bus trace of the simulation (BUS_TRACE_FILE, see bus_trace.py) of the
+same program, and compared cycle by cycle. The first diverging cycle is
+reported with the address the simulation accessed.
+
+Captures:
+    .csv    one row per sample or per change, optional time column and a header line
+            (sigrok-cli and most analyzer exports; lines starting with ';' or '#' are skipped)
+    .vcd    value changes, a vector takes one channel per bit (bit 0 first)
+    .sr     sigrok session (zip with metadata and logic-1-N sample chunks)
+Channels are numbered in the order of the file (CSV columns without the time
+column, bits of the VCD variables, sigrok probes). The defaults expect analyzer channel N
+on gp[N]: --clk 0, --data 1 (D0, D1..D7 on the next 7 channels), --rw 9.
+
+The simulated trace is recorded with the unpacked program (fpga-test/test.bin,
+not test_fpga.bin). Accesses outside of the RAM windows of the FPGA (see
+fpga-test/memmap.py) read 0 there.
+
+Usage:
+    make PROGRAM=../fpga-test/test.bin BUS_TRACE_FILE=fpga_bus.bin
+    python la_compare.py compare capture.csv fpga_bus.bin
+    python la_compare.py synth fpga_bus.bin -o capture.csv   (capture as the analyzer would record it)
+"""
+import argparse
+import configparser
+import os
+import re
+import sys
+import zipfile
+
+import numpy as np
+
+from bus_trace import open_bus_trace
+
+ALIGN_CYCLES = 32  # cycles of the simulation searched for in the capture
+
+
+class CaptureFormatError(Exception):
+    pass
+
+
+def load_csv(path):
+    """
+    :return: (times or None, samples as uint8 array (rows, channels))
+    """
+    header = None
+    skip = 0
+    with open(path) as f:
+        for line in f:
+            stripped = line.strip()
+            if not stripped or stripped[0] in ";#":
+                skip += 1
+                continue
+            if re.search(r"[A-Za-z]", stripped.split(",")[0] + stripped.split(",")[-1]):
+                header = [name.strip().lower() for name in stripped.split(",")]
+                skip += 1
+            break
+    table = np.loadtxt(path, delimiter=",", comments=(";", "#"), skiprows=skip, ndmin=2, dtype=np.float64)
+    times = None
+    if header is not None and header[0].startswith("time"):
+        times = table[:, 0]
+        table = table[:, 1:]
+    return times, table.astype(np.uint8)
+
+
+def load_vcd(path):
+    """
+    Read the value changes of all variables and expand them into one row per change time.
+
+    A variable of N bits (e.g. a gp[9:0] bus) takes N channels, bit 0 first.
+    The values x and z read as 0, real variables are ignored.
+
+    :return: (times, samples as uint8 array (rows, channels))
+    """
+    with open(path) as f:
+        text = f.read()
+    definitions, _, body = text.partition("$enddefinitions")
+    widths = {}
+    for kind, width, identifier in re.findall(r"\$var\s+(\S+)\s+(\d+)\s+(\S+)\s+\S+.*?\$end", definitions, re.S):
+        if not kind.startswith("real") and identifier not in widths:
+            widths[identifier] = int(width)
+    if not widths:
+        raise CaptureFormatError(f"{path} has no logic signals")
+    body = re.sub(r"\$comment.*?\$end", " ", body.partition("$end")[2], flags=re.S)
+    tokens = np.array(body.split())
+    if not len(tokens):
+        raise CaptureFormatError(f"{path} has no value changes")
+    first = tokens.astype("U1")
+    # Vector (bVALUE ID) and real (rVALUE ID) changes take two tokens, the ID may start with b or r as well:
+    # in a run of such tokens every second one starts a change
+    index = np.arange(len(tokens))
+    is_pair = np.isin(first, ["b", "B", "r", "R"])
+    run_start = np.maximum.accumulate(np.where(is_pair & ~np.concatenate(([False], is_pair[:-1])), index, 0))
+    is_change = is_pair & ((index - run_start) % 2 == 0)
+    is_vector = is_change & np.isin(first, ["b", "B"])
+    is_identifier = np.concatenate(([False], is_vector[:-1]))
+    is_value = np.concatenate(([False], is_change[:-1]))
+    is_scalar = np.isin(first, list("01xXzZ")) & ~is_value
+    # Time of every token: the last #time before it
+    is_time = (first == "#") & ~is_value
+    time_values = np.concatenate(([0], np.char.lstrip(tokens[is_time], "#").astype(np.int64)))
+    token_times = time_values[np.maximum.accumulate(np.where(is_time, np.cumsum(is_time), 0))]
+    # Variable of every change: scalar changes are VALUE and ID in one token, vector changes are taken at their ID
+    positions = np.flatnonzero(is_scalar | is_identifier)
+    scalar = is_scalar[positions]
+    keys, key_index = np.unique(np.char.add(np.where(scalar, "s", "v"), tokens[positions]), return_inverse=True)
+    variable = {identifier: number for number, identifier in enumerate(widths)}
+    key_variable = np.array([variable.get(key[2:] if key[0] == "s" else key[1:], -1) for key in keys], dtype=np.int64)
+    change_variable = key_variable[key_index]
+    change_values = np.where(scalar, first[positions], np.char.lstrip(tokens[np.maximum(positions - 1, 0)], "bB"))
+    change_times = token_times[positions]
+    times = np.unique(change_times[change_variable >= 0])
+    samples = np.zeros((len(times), sum(widths.values())), dtype=np.uint8)
+    channel = 0
+    for number, width in enumerate(widths.values()):
+        selected = change_variable == number
+        if selected.any():
+            changes = change_values[selected]
+            # Left-extend short values with 0 and keep the last width digits, bit 0 first
+            digits = max(width, int(np.char.str_len(changes).max()))
+            padded = np.char.rjust(changes, digits, "0").astype(f"S{digits}")
+            bits = (padded.view(np.uint8).reshape(-1, digits)[:, digits - width:] == ord("1"))[:, ::-1]
+            # Value of the variable at every change time: its last change at or before it
+            position = np.searchsorted(change_times[selected], times, side="right") - 1
+            samples[:, channel:channel + width] = np.where(position[:, None] >= 0, bits[np.maximum(position, 0)], 0)
+        channel += width
+    return times.astype(np.float64), samples
+
+
+def load_sigrok(path):
+    """
+    :return: (times, samples as uint8 array (rows, channels))
+    """
+    with zipfile.ZipFile(path) as archive:
+        metadata = configparser.ConfigParser()
+        metadata.read_string(archive.read("metadata").decode())
+        device = metadata["device 1"]
+        channels = int(device["total probes"])
+        unitsize = int(device.get("unitsize", "1"))
+        chunks = sorted((name for name in archive.namelist() if name.startswith("logic-1")),
+                        key=lambda name: int(name.rsplit("-", 1)[1]) if name.count("-") == 2 else 0)
+        raw = b"".join(archive.read(name) for name in chunks)
+    words = np.frombuffer(raw, dtype=np.uint8).reshape(-1, unitsize)
+    bits = np.unpackbits(words, axis=1, bitorder="little")[:, :channels]
+    rate = device.get("samplerate")
+    times = None
+    if rate:
+        value, unit = re.fullmatch(r"\s*([\d.]+)\s*([kMG]?)Hz\s*", rate).groups()
+        times = np.arange(len(bits)) / (float(value) * {"": 1, "k": 1e3, "M": 1e6, "G": 1e9}[unit])
+    return times, bits
+
+
+def load_capture(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".vcd":
+        return load_vcd(path)
+    if ext == ".sr":
+        return load_sigrok(path)
+    return load_csv(path)
+
+
+def sample_bus(samples, clk=0, data=1, rw=9, edge="falling"):
+    """
+    Sample data bus and RW on every clock edge.
+
+    :param samples: uint8 array (rows, channels).
+    :param clk: Channel of the clock.
+    :param data: Channel of D0, D1..D7 follow.
+    :param rw: Channel of RW.
+    :return: (row of every edge, bus values RW << 8 | data)
+    """
+    clock = samples[:, clk]
+    if edge == "falling":
+        rows = np.flatnonzero((clock[:-1] == 1) & (clock[1:] == 0)) + 1
+    else:
+        rows = np.flatnonzero((clock[:-1] == 0) & (clock[1:] == 1)) + 1
+    weights = (1 << np.arange(8)).astype(np.uint16)
+    values = samples[rows, data:data + 8].astype(np.uint16) @ weights
+    return rows, values | (samples[rows, rw].astype(np.uint16) << 8)
+
+
+def trace_bus(trace):
+    """:return: Bus values RW << 8 | data of a simulated trace."""
+    return (trace["rw"].astype(np.uint16) << 8) | trace["data"]
+
+
+def find_sequence(values, pattern):
+    """
+    :return: Index of the first occurrence of pattern in values, None if there is none.
+    """
+    if len(pattern) == 0 or len(values) < len(pattern):
+        return None
+    candidates = np.flatnonzero(values[:len(values) - len(pattern) + 1] == pattern[0])
+    for offset in range(1, len(pattern)):
+        candidates = candidates[values[candidates + offset] == pattern[offset]]
+    return int(candidates[0]) if len(candidates) else None
+
+
+def align(captured, simulated, cycles=ALIGN_CYCLES):
+    """
+    :return: Offset of simulated cycle 0 in the captured cycles (negative if the capture starts later), None
+        if the traces cannot be aligned.
+    """
+    offset = find_sequence(captured, simulated[:cycles])
+    if offset is not None:
+        return offset
+    offset = find_sequence(simulated, captured[:cycles])
+    return None if offset is None else -offset
+
+
+def compare(captured, simulated, offset):
+    """
+    :return: (simulated index of the first diverging cycle or None, number of compared cycles)
+    """
+    sim_start = max(0, -offset)
+    cap_start = sim_start + offset
+    length = min(len(simulated) - sim_start, len(captured) - cap_start)
+    differs = np.flatnonzero(captured[cap_start:cap_start + length] != simulated[sim_start:sim_start + length])
+    return (sim_start + int(differs[0]) if len(differs) else None), length
+
+
+def synthesize_capture(trace, path, samples_per_cycle=4):
+    """
+    Write the CSV a logic analyzer would record of the simulated bus (clock high in the first half of a cycle).
+    """
+    half = samples_per_cycle // 2
+    cycles = len(trace)
+    clock = np.tile(np.r_[np.ones(half, np.uint8), np.zeros(samples_per_cycle - half, np.uint8)], cycles)
+    rows = np.repeat(np.arange(cycles), samples_per_cycle)
+    data_bits = (trace["data"][rows, None] >> np.arange(8)) & 1
+    table = np.column_stack([clock, data_bits, trace["rw"][rows]]).astype(np.uint8)
+    times = np.arange(len(table)) * (1e-6 / samples_per_cycle)
+    header = "Time [s]," + ",".join(f"gp{channel}" for channel in range(10))
+    with open(path, "w") as f:
+        f.write(header + "\n")
+        np.savetxt(f, np.column_stack([times, table]), delimiter=",", fmt=["%.9f"] + ["%d"] * 10)
+
+
+def format_cycle(value):
+    return f"{'R' if value >> 8 else 'W'} data={value & 0xFF:02x}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a logic analyzer capture with the simulated bus trace")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compare_parser = commands.add_parser("compare", help="report the first diverging cycle")
+    compare_parser.add_argument("capture", help="logic analyzer export (.csv, .vcd, .sr)")
+    compare_parser.add_argument("trace", help="bus trace of the simulation (BUS_TRACE_FILE)")
+    compare_parser.add_argument("--clk", type=int, default=0, help="channel of the clock")
+    compare_parser.add_argument("--data", type=int, default=1, help="channel of D0, D1..D7 follow")
+    compare_parser.add_argument("--rw", type=int, default=9, help="channel of RW")
+    compare_parser.add_argument("--edge", choices=("falling", "rising"), default="falling")
+    compare_parser.add_argument("--offset", type=int, help="captured cycle of simulated cycle 0 (default: search)")
+    synth_parser = commands.add_parser("synth", help="write a capture of a simulated trace")
+    synth_parser.add_argument("trace")
+    synth_parser.add_argument("-o", "--output", required=True)
+    synth_parser.add_argument("--samples-per-cycle", type=int, default=4)
+    args = parser.parse_args()
+
+    trace = open_bus_trace(args.trace)
+    if args.command == "synth":
+        synthesize_capture(trace, args.output, args.samples_per_cycle)
+        return 0
+
+    times, samples = load_capture(args.capture)
+    rows, captured = sample_bus(samples, args.clk, args.data, args.rw, args.edge)
+    simulated = trace_bus(trace)
+    print(f"{args.capture}: {len(samples)} samples, {len(captured)} clock cycles; "
+          f"{args.trace}: {len(simulated)} cycles")
+    offset = args.offset if args.offset is not None else align(captured, simulated)
+    if offset is None:
+        print(f"The first {ALIGN_CYCLES} cycles of the simulation do not appear in the capture (or vice versa)")
+        return 1
+    index, length = compare(captured, simulated, offset)
+    print(f"Simulated cycle {trace['cycle'][max(0, -offset)]} is captured cycle {max(0, offset)}, "
+          f"{length} cycles compared")
+    if index is None:
+        print("No difference")
+        return 0
+    captured_index = index + offset
+    when = f" at {times[rows[captured_index]]:.9g}" if times is not None else ""
+    print(f"First difference in simulated cycle {trace['cycle'][index]} (addr {trace['addr'][index]:04x}, "
+          f"state {trace['state'][index]}), captured cycle {captured_index}{when}:")
+    print(f"  expected {format_cycle(simulated[index])}, captured {format_cycle(captured[captured_index])}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Program image loader.
+
+Programs are loaded into a 64 KiB image from one of these formats:
+    .bin          flat binary loaded at address 0, memory-mapped and copied in one go
+    .hex / .ihx   Intel HEX, only the data records are loaded over the fill byte (always 0x00)
+    .seg          segment records (start address, length, data) with the fill byte in the header
+
+Flat binaries of the assembler are 64 KiB, mostly padding. Intel HEX and
+segment files only store the used regions, which keeps large program corpora
+small (see `python loader.py convert`).
+
+Usage:
+    python loader.py convert test.bin test.seg [--fill 0x00]
+    python loader.py info test.seg
+"""
+import argparse
+import mmap
+import os
+import re
+import struct
+import sys
+
+IMAGE_SIZE = 65536
+FILL = 0xFF  # value of the bytes not loaded from a flat binary (as in Memory)
+SEGMENT_FILL = 0x00  # default fill of segmented formats, the fill byte of the assembler
+PROGRAM_EXTENSIONS = (".bin", ".hex", ".ihx", ".seg")
+
+SEGMENT_MAGIC = b"6502SEG1"
+# magic, fill byte, number of segments
+SEGMENT_HEADER = struct.Struct("<8sBH")
+# start address, length (followed by the data)
+SEGMENT_RECORD = struct.Struct("<HI")
+
+
+class ImageFormatError(Exception):
+    pass
+
+
+def load_image(path, fill=None):
+    """
+    Load a program into a new 64 KiB image.
+
+    :param path: Program file, the format is selected by its extension.
+    :param fill: Value of the bytes not defined by the program, default of the format if None.
+    :return: bytearray of 65536 bytes.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".hex", ".ihx"):
+        return load_intel_hex(path, SEGMENT_FILL if fill is None else fill)
+    if ext == ".seg":
+        return load_segments(path, fill)
+    return load_flat(path, FILL if fill is None else fill)
+
+
+def load_flat(path, fill=FILL):
+    image = bytearray([fill]) * IMAGE_SIZE
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > IMAGE_SIZE:
+            raise ImageFormatError(f"{path} is larger than 64 KiB")
+        if size:
+            # Parallel runs of the same program share the pages of the mapping
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                image[:size] = mapped
+    return image
+
+
+def load_intel_hex(path, fill=SEGMENT_FILL):
+    image = bytearray([fill]) * IMAGE_SIZE
+    base = 0
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                if not line.startswith(":"):
+                    raise ValueError("missing ':'")
+                record = bytes.fromhex(line[1:])
+            except ValueError as error:
+                raise ImageFormatError(f"{path}:{number}: invalid record ({error})") from None
+            if len(record) < 5 or len(record) != record[0] + 5:
+                raise ImageFormatError(f"{path}:{number}: wrong record length")
+            if sum(record) & 0xFF:
+                raise ImageFormatError(f"{path}:{number}: wrong checksum")
+            length, address, record_type = record[0], (record[1] << 8) | record[2], record[3]
+            data = record[4:4 + length]
+            if record_type == 0x00:
+                start = base + address
+                if start + length > IMAGE_SIZE:
+                    raise ImageFormatError(f"{path}:{number}: data beyond 64 KiB")
+                image[start:start + length] = data
+            elif record_type == 0x01:
+                break
+            elif record_type == 0x02:
+                base = int.from_bytes(data, "big") << 4
+            elif record_type == 0x04:
+                base = int.from_bytes(data, "big") << 16
+            # 0x03 and 0x05 (start address) do not matter, the CPU starts at the reset vector
+    return image
+
+
+def load_segments(path, fill=None):
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < SEGMENT_HEADER.size or not data.startswith(SEGMENT_MAGIC):
+        raise ImageFormatError(f"{path} is not a segment file")
+    _, stored_fill, count = SEGMENT_HEADER.unpack_from(data)
+    image = bytearray([stored_fill if fill is None else fill]) * IMAGE_SIZE
+    offset = SEGMENT_HEADER.size
+    for _ in range(count):
+        start, length = SEGMENT_RECORD.unpack_from(data, offset)
+        offset += SEGMENT_RECORD.size
+        if start + length > IMAGE_SIZE or offset + length > len(data):
+            raise ImageFormatError(f"{path}: segment at {start:#06x} is truncated or beyond 64 KiB")
+        image[start:start + length] = data[offset:offset + length]
+        offset += length
+    return image
+
+
+def find_segments(image, fill, min_gap=16):
+    """
+    Find the regions of an image that differ from the fill byte.
+
+    :param min_gap: Runs of fill bytes shorter than this stay inside a segment (fewer records).
+    :return: List of (start, end) with end exclusive.
+    """
+    segments = []
+    position = 0
+    # Runs of at least min_gap fill bytes separate the segments
+    for gap in re.finditer(re.escape(bytes([fill])) + b"{%d,}" % min_gap, image):
+        if gap.start() > position:
+            segments.append((position, gap.start()))
+        position = gap.end()
+    if position < len(image):
+        segments.append((position, len(image)))
+    return segments
+
+
+def write_segments(image, path, fill=SEGMENT_FILL):
+    segments = find_segments(image, fill)
+    with open(path, "wb") as f:
+        f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, fill, len(segments)))
+        for start, end in segments:
+            f.write(SEGMENT_RECORD.pack(start, end - start))
+            f.write(image[start:end])
+    return segments
+
+
+def write_intel_hex(image, path, fill=SEGMENT_FILL, record_size=16):
+    # Intel HEX has no place for the fill byte, loaders fill the gaps with SEGMENT_FILL
+    if fill != SEGMENT_FILL:
+        raise ImageFormatError(f"Intel HEX can only leave out {SEGMENT_FILL:#04x} bytes, not {fill:#04x} "
+                               f"(use .seg to store another fill byte)")
+    segments = find_segments(image, fill)
+    with open(path, "w") as f:
+        for start, end in segments:
+            for address in range(start, end, record_size):
+                data = bytes(image[address:min(address + record_size, end)])
+                record = bytes([len(data), address >> 8, address & 0xFF, 0x00]) + data
+                f.write(f":{record.hex().upper()}{(-sum(record)) & 0xFF:02X}\n")
+        f.write(":00000001FF\n")
+    return segments
+
+
+def write_image(image, path, fill=SEGMENT_FILL):
+    """Write an image in the format selected by the extension of path."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".hex", ".ihx"):
+        write_intel_hex(image, path, fill)
+    elif ext == ".seg":
+        write_segments(image, path, fill)
+    else:
+        with open(path, "wb") as f:
+            f.write(image)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert and inspect program images")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="convert between .bin, .hex and .seg")
+    convert.add_argument("input")
+    convert.add_argument("output")
+    convert.add_argument("--fill", type=lambda value: int(value, 0), default=SEGMENT_FILL,
+                         help="fill byte left out of segmented outputs (only 0x00 for Intel HEX)")
+    info = commands.add_parser("info", help="print the used regions of a program")
+    info.add_argument("input")
+    info.add_argument("--fill", type=lambda value: int(value, 0), default=SEGMENT_FILL)
+    args = parser.parse_args()
+
+    image = load_image(args.input)
+    if args.command == "convert":
+        try:
+            write_image(image, args.output, args.fill)
+        except ImageFormatError as error:
+            sys.exit(f"{args.output}: {error}")
+        print(f"{args.input} ({os.path.getsize(args.input)} bytes) -> {args.output} "
+              f"({os.path.getsize(args.output)} bytes)")
+    else:
+        for start, end in find_segments(image, args.fill):
+            print(f"{start:#06x}-{end - 1:#06x} ({end - start} bytes)")
@@ -0,0 +1,90 @@
+class Memory:
+    """
+    64 KiB memory image used by the testbench to emulate the external RAM.
+
+    The image is backed by a bytearray. The first write of an address records
+    its old value in an undo log which is cleared at the start of each
+    instruction. The state of the memory before the current instruction and
+    the addresses it wrote are derived from that log, so the image never has
+    to be copied.
+    """
+
+    def __init__(self, size=65536, fill=0xFF):
+        self.data = bytearray([fill]) * size
+        self.undo = {}  # address -> value before the first write of the current instruction
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, address):
+        return self.data[address]
+
+    def __setitem__(self, address, value):
+        if address not in self.undo:
+            self.undo[address] = self.data[address]
+        self.data[address] = value
+
+    def load(self, binary_data, offset=0):
+        """
+        Copy a program image into memory without journaling it.
+
+        :param binary_data: bytes-like object with the image.
+        :param offset: Address the first byte is loaded to.
+        """
+        self.data[offset:offset + len(binary_data)] = binary_data
+
+    def begin_instruction(self):
+        """Forget the writes of the previous instruction."""
+        self.undo.clear()
+
+    def touched(self):
+        """Addresses written since the start of the current instruction."""
+        return self.undo.keys()
+
+    def previous(self):
+        """Live view of the memory as it was before the current instruction."""
+        return MemoryOverlay(self, self.undo)
+
+
+class MemoryOverlay:
+    """
+    Read-only base memory with a sparse set of overridden addresses.
+
+    Assigning to an overlay only changes the overlay, never the base. This is
+    used to build the expected memory of an instruction on top of the
+    previous memory without copying it.
+    """
+
+    def __init__(self, base, overrides=None):
+        self.base = base
+        self.overrides = {} if overrides is None else overrides
+
+    def __len__(self):
+        return len(self.base)
+
+    def __getitem__(self, address):
+        if address in self.overrides:
+            return self.overrides[address]
+        return self.base[address]
+
+    def __setitem__(self, address, value):
+        self.overrides[address] = value
+
+    def overlay(self):
+        """Return a new, empty overlay on top of this one."""
+        return MemoryOverlay(self)
+
+    def expected_writes(self):
+        """
+        Writes this overlay expects on top of the memory before the instruction.
+
+        The view returned by Memory.previous() expects no writes, every overlay
+        stacked on top of it adds its overridden addresses.
+
+        :return: dict mapping address to expected value.
+        """
+        if not isinstance(self.base, MemoryOverlay):
+            return {}
+        writes = self.base.expected_writes()
+        writes.update(self.overrides)
+        return writes
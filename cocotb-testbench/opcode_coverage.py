@@ -0,0 +1,321 @@
+"""
+Functional coverage of the executed instructions.
+
+Every retired instruction is sampled as an outcome code, a byte with one bit
+per coverage point:
+    C_in        carry before the instruction (ADC, SBC, ROL, ROR)
+    D           decimal mode (ADC, SBC)
+    C_out, N, Z, V   flags after the instruction (the flags the opcode affects)
+    taken       branch taken (conditional branches)
+    page_cross  indexed address or branch target in another page (abs_x, abs_y, ind_y, rel)
+Bits that do not apply to an opcode (see opcode_list) are masked out, the
+code then increments one counter of a preallocated 256 x 256 array
+(opcode x outcome code). Every coverage point has two bins (seen 0, seen 1),
+an opcode also counts as a bin of its own (executed).
+
+Coverage files of parallel runs are merged by adding their counters.
+
+Usage:
+    python opcode_coverage.py report FILE... [--rank] [-o report.json]
+    python opcode_coverage.py merge -o merged.npz FILE...
+    python opcode_coverage.py model PROGRAM... [-o coverage.npz]   (golden model, without a simulator)
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from golden_model import CPUModel, InvalidOpcode, load_program
+from opcodes import BRANCH_CONDITIONS, opcode_list
+
+COVERAGE_POINTS = ("C_in", "D", "C_out", "N", "Z", "V", "taken", "page_cross")
+C_IN, DECIMAL, C_OUT, N_OUT, Z_OUT, V_OUT, TAKEN, PAGE_CROSS = (1 << bit for bit in range(len(COVERAGE_POINTS)))
+
+CARRY_IN_NAMES = ("ADC", "SBC", "ROL", "ROR")
+DECIMAL_NAMES = ("ADC", "SBC")
+# Flag instructions always set the same value, the other value of the flag can never be covered
+FLAG_NAMES = ("SEC", "CLC", "SEI", "CLI", "SED", "CLD", "CLV")
+PAGE_CROSS_MODES = ("abs_x", "abs_y", "ind_y", "rel")
+OPCODES = {op.opcode: op for op in opcode_list}
+
+
+def build_point_masks():
+    """
+    :return: List of 256 outcome masks with the coverage points that apply to each opcode.
+    """
+    masks = [0] * 256
+    for op in opcode_list:
+        if op.name == "END":
+            continue
+        mask = 0
+        if op.name in CARRY_IN_NAMES:
+            mask |= C_IN
+        if op.name in DECIMAL_NAMES:
+            mask |= DECIMAL
+        if op.name not in FLAG_NAMES:
+            for flag, point in (("C", C_OUT), ("N", N_OUT), ("Z", Z_OUT), ("V", V_OUT)):
+                if flag in op.affected_flags:
+                    mask |= point
+        if op.name in BRANCH_CONDITIONS:
+            mask |= TAKEN
+        if op.addressing in PAGE_CROSS_MODES:
+            mask |= PAGE_CROSS
+        masks[op.opcode] = mask
+    return masks
+
+
+POINT_MASKS = build_point_masks()
+
+
+def applicable_bins():
+    """
+    :return: bool array (256 opcodes, 1 + 2 bins per coverage point) of the bins that can be covered.
+    """
+    applicable = np.zeros((256, 1 + 2 * len(COVERAGE_POINTS)), dtype=bool)
+    for op in opcode_list:
+        if op.name == "END":
+            continue
+        applicable[op.opcode, 0] = True
+        for bit in range(len(COVERAGE_POINTS)):
+            if POINT_MASKS[op.opcode] >> bit & 1:
+                applicable[op.opcode, 1 + 2 * bit:3 + 2 * bit] = True
+    return applicable
+
+
+APPLICABLE_BINS = applicable_bins()
+
+
+def page_crossed(op, mem, opcode_addr, regs):
+    """
+    :param mem: Memory before the instruction.
+    :param regs: Registers before the instruction.
+    :return: True if the indexed address (or the branch target) is in another page than its base,
+        False for addressing modes without page crossing.
+    """
+    if not POINT_MASKS[op.opcode] & PAGE_CROSS:
+        return False
+    addressing = op.addressing
+    if addressing == "rel":
+        offset = mem[(opcode_addr + 1) & 0xFFFF]
+        next_addr = (opcode_addr + 2) & 0xFFFF
+        target = (next_addr + offset - (0x100 if offset & 0x80 else 0)) & 0xFFFF
+        return (next_addr ^ target) > 0xFF
+    if addressing == "ind_y":
+        # Only the low byte of the pointer decides, the pointer is in page zero
+        low = mem[mem[(opcode_addr + 1) & 0xFFFF]]
+        return low + regs["Y"] > 0xFF
+    low = mem[(opcode_addr + 1) & 0xFFFF]
+    return low + regs["X" if addressing == "abs_x" else "Y"] > 0xFF
+
+
+class CoverageCollector:
+    """
+    Outcome counters of the retired instructions of one workload.
+
+    counts[opcode, outcome code] is the number of times the opcode retired with that outcome.
+    """
+
+    def __init__(self, workload, counts=None):
+        self.workload = workload
+        self.counts = np.zeros((256, 256), dtype=np.uint64) if counts is None else counts
+
+    def sample(self, op, before, after, taken=None, crossed=False):
+        """
+        Count one retired instruction.
+
+        :param op: Opcode of the instruction.
+        :param before: Registers and flags before the instruction.
+        :param after: Registers and flags after the instruction.
+        :param taken: For conditional branches whether the branch was taken, None otherwise.
+        :param crossed: Result of page_crossed for the instruction.
+        """
+        code = (
+            before["C"] | (before["D"] << 1) | (after["C"] << 2) | (after["N"] << 3) |
+            (after["Z"] << 4) | (after["V"] << 5) | (TAKEN if taken else 0) | (PAGE_CROSS if crossed else 0)
+        )
+        self.counts[op.opcode, code & POINT_MASKS[op.opcode]] += 1
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def save(self, path):
+        # np.savez appends .npz to other names
+        with open(path, "wb") as f:
+            np.savez(f, counts=self.counts, points=np.array(COVERAGE_POINTS), workload=np.array(self.workload))
+
+
+def load_coverage(path):
+    """
+    :return: CoverageCollector with the counters stored in path.
+    """
+    with np.load(path) as data:
+        points = tuple(data["points"].tolist())
+        if points != COVERAGE_POINTS:
+            raise ValueError(f"{path} has the coverage points {points}, expected {COVERAGE_POINTS}")
+        return CoverageCollector(str(data["workload"]), data["counts"].astype(np.uint64))
+
+
+def merge_files(paths, workload="merged"):
+    merged = CoverageCollector(workload)
+    for path in paths:
+        merged.merge(load_coverage(path))
+    return merged
+
+
+def covered_bins(counts):
+    """
+    :param counts: Outcome counters (256 x 256).
+    :return: bool array of the covered bins, same shape as APPLICABLE_BINS.
+    """
+    seen = counts > 0
+    covered = np.zeros(APPLICABLE_BINS.shape, dtype=bool)
+    covered[:, 0] = seen.any(axis=1)
+    codes = np.arange(256)
+    for bit in range(len(COVERAGE_POINTS)):
+        is_set = (codes >> bit & 1).astype(bool)
+        covered[:, 1 + 2 * bit] = seen[:, ~is_set].any(axis=1)
+        covered[:, 2 + 2 * bit] = seen[:, is_set].any(axis=1)
+    return covered & APPLICABLE_BINS
+
+
+def bin_name(column):
+    if column == 0:
+        return "executed"
+    bit, value = divmod(column - 1, 2)
+    return f"{COVERAGE_POINTS[bit]}={value}"
+
+
+def coverage_report(collector):
+    """
+    :return: dict with the number of bins, the covered bins and the holes per opcode.
+    """
+    covered = covered_bins(collector.counts)
+    executed = collector.counts.sum(axis=1)
+    opcodes = []
+    for op in opcode_list:
+        if op.name == "END":
+            continue
+        row = op.opcode
+        holes = [bin_name(column) for column in np.flatnonzero(APPLICABLE_BINS[row] & ~covered[row])]
+        opcodes.append({
+            "opcode": f"{op.opcode:#04x}",
+            "name": op.name,
+            "addressing": op.addressing,
+            "instructions": int(executed[row]),
+            "bins": int(APPLICABLE_BINS[row].sum()),
+            "covered": int(covered[row].sum()),
+            "holes": holes,
+        })
+    bins = int(APPLICABLE_BINS.sum())
+    hits = int(covered.sum())
+    return {
+        "workload": collector.workload,
+        "bins": bins,
+        "covered": hits,
+        "coverage": round(hits / bins, 4),
+        "opcodes": opcodes,
+    }
+
+
+def format_report(report):
+    lines = [f"Coverage of {report['workload']}: {report['covered']}/{report['bins']} bins "
+             f"({report['coverage']:.1%})"]
+    for entry in report["opcodes"]:
+        if entry["instructions"] == 0:
+            lines.append(f"  {entry['name']} {entry['addressing']:<6} not executed")
+        elif entry["holes"]:
+            lines.append(f"  {entry['name']} {entry['addressing']:<6} missing {', '.join(entry['holes'])}")
+    return "\n".join(lines)
+
+
+def rank_files(paths):
+    """
+    Order coverage files by the bins they add (greedy set cover).
+
+    :return: (list of (path, bins added) of the useful files, list of the redundant files)
+    """
+    remaining = {path: covered_bins(load_coverage(path).counts) for path in paths}
+    covered = np.zeros(APPLICABLE_BINS.shape, dtype=bool)
+    ranked = []
+    while remaining:
+        path, bins = max(remaining.items(), key=lambda item: int((item[1] & ~covered).sum()))
+        added = int((bins & ~covered).sum())
+        if added == 0:
+            break
+        ranked.append((path, added))
+        covered |= bins
+        del remaining[path]
+    return ranked, sorted(remaining)
+
+
+def model_coverage(program, max_instructions=10_000_000):
+    """
+    Collect the coverage of a program on the golden model.
+
+    :param program: Path of the program image.
+    :param max_instructions: Abort programs that do not reach END.
+    :return: CoverageCollector of the program.
+    :raises InvalidOpcode: If the program runs into an invalid opcode (e.g. a failure marker).
+    """
+    model = CPUModel(load_program(program))
+    collector = CoverageCollector(os.path.basename(program))
+    mem = model.mem
+    while True:
+        if model.instructions >= max_instructions:
+            raise RuntimeError(f"Program did not reach END within {max_instructions} instructions")
+        opcode_addr = model.PC
+        op = OPCODES.get(mem[opcode_addr])
+        if op is None:
+            # The kernels mark a wrong result with an invalid opcode, it must not pass as the end
+            raise InvalidOpcode(f"Invalid opcode {hex(mem[opcode_addr])} found at address {opcode_addr}")
+        if op.name == "END":
+            break
+        before = model.state()
+        taken = None
+        if op.name in BRANCH_CONDITIONS:
+            flag, value = BRANCH_CONDITIONS[op.name]
+            taken = before[flag] == value
+        # Operands are read before the instruction can change memory
+        crossed = page_crossed(op, mem, opcode_addr, before)
+        model.step()
+        collector.sample(op, before, model.state(), taken, crossed)
+    return collector
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Functional coverage of the executed instructions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_parser = commands.add_parser("report", help="merge coverage files and list the holes")
+    report_parser.add_argument("files", nargs="+")
+    report_parser.add_argument("--rank", action="store_true", help="order the files by the bins they add")
+    report_parser.add_argument("-o", "--output", help="write the report as JSON")
+    merge_parser = commands.add_parser("merge", help="merge coverage files into one")
+    merge_parser.add_argument("files", nargs="+")
+    merge_parser.add_argument("-o", "--output", required=True)
+    model_parser = commands.add_parser("model", help="collect the coverage of programs on the golden model")
+    model_parser.add_argument("programs", nargs="+")
+    model_parser.add_argument("-o", "--output", help="write the merged coverage file")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        merge_files(args.files).save(args.output)
+    elif args.command == "model":
+        collector = CoverageCollector(", ".join(os.path.basename(program) for program in args.programs))
+        for program in args.programs:
+            collector.merge(model_coverage(program))
+        if args.output:
+            collector.save(args.output)
+        print(format_report(coverage_report(collector)))
+    else:
+        report = coverage_report(merge_files(args.files, ", ".join(args.files)))
+        print(format_report(report))
+        if args.rank:
+            ranked, redundant = rank_files(args.files)
+            for path, added in ranked:
+                print(f"{path}: +{added} bins")
+            if redundant:
+                print(f"Redundant: {', '.join(redundant)}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,360 @@
+class Opcode:
+    """
+    Immutable description of a single opcode.
+
+    Instances are shared by the dispatch table, so they are kept compact
+    (__slots__) and cannot be modified after construction.
+    """
+    __slots__ = ("opcode", "name", "addressing", "bytes", "cycles", "affected_flags", "affected_regs")
+
+    def __init__(self, opcode, name, addressing, bytes, cycles, affected_flags, affected_regs):
+        set_field = super().__setattr__
+        set_field("opcode", opcode)  # opcode hex value
+        set_field("name", name)  # name of the opcode
+        set_field("addressing", addressing)  # addressing mode
+        set_field("bytes", bytes)  # number of bytes the opcode uses in memory
+        set_field("cycles", cycles)  # number of cycles the opcode takes
+        set_field("affected_flags", tuple(affected_flags))  # flags affected by the opcode
+        set_field("affected_regs", tuple(affected_regs))  # registers affected by the opcode
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"Opcode is immutable, cannot set {key}")
+
+    def __repr__(self):
+        return f"{self.name} {self.addressing} ({hex(self.opcode)})"
+
+
+# Create an array of OpcodeInfo objects
+# opcode, name, addressing_mode, length (in bytes), cycles, affected_flags, affected_regs
+opcode_list = [
+    # LDA
+    Opcode(0xA9, "LDA", "imm", 2, 2, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0xA5, "LDA", "zpg", 2, 3, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0xB5, "LDA", "zpg_x", 2, 3, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0xAD, "LDA", "abs", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0xBD, "LDA", "abs_x", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0xB9, "LDA", "abs_y", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0xA1, "LDA", "ind_x", 2, 5, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0xB1, "LDA", "ind_y", 2, 5, ["N", "Z"], ["PC", "ACC"]),
+    # STA
+    Opcode(0x85, "STA", "zpg", 2, 3, [], ["PC"]),
+    Opcode(0x95, "STA", "zpg_x", 2, 3, [], ["PC"]),
+    Opcode(0x8D, "STA", "abs", 3, 4, [], ["PC"]),
+    Opcode(0x9D, "STA", "abs_x", 3, 4, [], ["PC"]), # reduced cycles (normally always 5, now always 4) TODO: paper: verwunderlich warum hier keine variable Ausführungszeit
+    Opcode(0x99, "STA", "abs_y", 3, 4, [], ["PC"]),
+    Opcode(0x81, "STA", "ind_x", 2, 5, [], ["PC"]), # reduced cycles (normally always 6, now always 5)
+    Opcode(0x91, "STA", "ind_y", 2, 5, [], ["PC"]), # reduced cycles (normally always 6, now always 5)
+    # ADC
+    Opcode(0x69, "ADC", "imm", 2, 2, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0x65, "ADC", "zpg", 2, 3, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0x75, "ADC", "zpg_x", 2, 3, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0x6D, "ADC", "abs", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0x7D, "ADC", "abs_x", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0x79, "ADC", "abs_y", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0x61, "ADC", "ind_x", 2, 5, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0x71, "ADC", "ind_y", 2, 5, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    # SBC
+    Opcode(0xE9, "SBC", "imm", 2, 2, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0xE5, "SBC", "zpg", 2, 3, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0xF5, "SBC", "zpg_x", 2, 3, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0xED, "SBC", "abs", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0xFD, "SBC", "abs_x", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0xF9, "SBC", "abs_y", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0xE1, "SBC", "ind_x", 2, 5, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    Opcode(0xF1, "SBC", "ind_y", 2, 5, ["N", "Z", "C", "V"], ["PC", "ACC"]),
+    # ORA
+    Opcode(0x09, "ORA", "imm", 2, 2, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x05, "ORA", "zpg", 2, 3, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x15, "ORA", "zpg_x", 2, 3, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x0D, "ORA", "abs", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x1D, "ORA", "abs_x", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x19, "ORA", "abs_y", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x01, "ORA", "ind_x", 2, 5, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x11, "ORA", "ind_y", 2, 5, ["N", "Z"], ["PC", "ACC"]),
+    # AND
+    Opcode(0x29, "AND", "imm", 2, 2, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x25, "AND", "zpg", 2, 3, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x35, "AND", "zpg_x", 2, 3, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x2D, "AND", "abs", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x3D, "AND", "abs_x", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x39, "AND", "abs_y", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x21, "AND", "ind_x", 2, 5, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x31, "AND", "ind_y", 2, 5, ["N", "Z"], ["PC", "ACC"]),
+    # EOR
+    Opcode(0x49, "EOR", "imm", 2, 2, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x45, "EOR", "zpg", 2, 3, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x55, "EOR", "zpg_x", 2, 3, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x4D, "EOR", "abs", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x5D, "EOR", "abs_x", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x59, "EOR", "abs_y", 3, 4, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x41, "EOR", "ind_x", 2, 5, ["N", "Z"], ["PC", "ACC"]),
+    Opcode(0x51, "EOR", "ind_y", 2, 5, ["N", "Z"], ["PC", "ACC"]),
+    # CMP
+    Opcode(0xC9, "CMP", "imm", 2, 2, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xC5, "CMP", "zpg", 2, 3, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xD5, "CMP", "zpg_x", 2, 3, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xCD, "CMP", "abs", 3, 4, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xDD, "CMP", "abs_x", 3, 4, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xD9, "CMP", "abs_y", 3, 4, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xC1, "CMP", "ind_x", 2, 5, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xD1, "CMP", "ind_y", 2, 5, ["N", "Z", "C"], ["PC"]),
+    # Compare Registers
+    Opcode(0xC0, "CPY", "imm", 2, 2, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xC4, "CPY", "zpg", 2, 3, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xCC, "CPY", "abs", 3, 4, ["N", "Z", "C"], ["PC"]),
+    #
+    Opcode(0xE0, "CPX", "imm", 2, 2, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xE4, "CPX", "zpg", 2, 3, ["N", "Z", "C"], ["PC"]),
+    Opcode(0xEC, "CPX", "abs", 3, 4, ["N", "Z", "C"], ["PC"]),
+    # Load Registers
+    Opcode(0xA0, "LDY", "imm", 2, 2, ["N", "Z"], ["PC", "Y"]),
+    Opcode(0xA4, "LDY", "zpg", 2, 3, ["N", "Z"], ["PC", "Y"]),
+    Opcode(0xB4, "LDY", "zpg_x", 2, 3, ["N", "Z"], ["PC", "Y"]),
+    Opcode(0xAC, "LDY", "abs", 3, 4, ["N", "Z"], ["PC", "Y"]),
+    Opcode(0xBC, "LDY", "abs_x", 3, 4, ["N", "Z"], ["PC", "Y"]),
+    Opcode(0xA2, "LDX", "imm", 2, 2, ["N", "Z"], ["PC", "X"]),
+    Opcode(0xA6, "LDX", "zpg", 2, 3, ["N", "Z"], ["PC", "X"]),
+    Opcode(0xB6, "LDX", "zpg_y", 2, 3, ["N", "Z"], ["PC", "X"]),
+    Opcode(0xAE, "LDX", "abs", 3, 4, ["N", "Z"], ["PC", "X"]),
+    Opcode(0xBE, "LDX", "abs_y", 3, 4, ["N", "Z"], ["PC", "X"]),
+    # Store Registers
+    Opcode(0x84, "STY", "zpg", 2, 3, [], ["PC"]),
+    Opcode(0x94, "STY", "zpg_x", 2, 3, [], ["PC"]),
+    Opcode(0x8C, "STY", "abs", 3, 4, [], ["PC"]),
+    Opcode(0x86, "STX", "zpg", 2, 3, [], ["PC"]),
+    Opcode(0x96, "STX", "zpg_y", 2, 3, [], ["PC"]),
+    Opcode(0x8E, "STX", "abs", 3, 4, [], ["PC"]),
+    # Increment/Decrement
+    Opcode(0xE6, "INC", "zpg", 2, 4, ["N", "Z"], ["PC"]), # reduced cycles (4 instead of 5)
+    Opcode(0xF6, "INC", "zpg_x", 2, 4, ["N", "Z"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
+    Opcode(0xEE, "INC", "abs", 3, 5, ["N", "Z"], ["PC"]), # reduced by 1
+    Opcode(0xFE, "INC", "abs_x", 3, 5, ["N", "Z"], ["PC"]), # reduced by 2
+    #
+    Opcode(0xC6, "DEC", "zpg", 2, 4, ["N", "Z"], ["PC"]), # reduced cycles (4 instead of 5)
+    Opcode(0xD6, "DEC", "zpg_x", 2, 4, ["N", "Z"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
+    Opcode(0xCE, "DEC", "abs", 3, 5, ["N", "Z"], ["PC"]), # reduced by 1
+    Opcode(0xDE, "DEC", "abs_x", 3, 5, ["N", "Z"], ["PC"]), # reduced by 2
+    # Arithmetic Shift Left
+    Opcode(0x0A, "ASL", "acc", 1, 1, ["N", "Z", "C"], ["PC", "ACC"]), # reduced cycles (1 instead of 2)
+    Opcode(0x06, "ASL", "zpg", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced cycles (4 instead of 5)
+    Opcode(0x16, "ASL", "zpg_x", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
+    Opcode(0x0E, "ASL", "abs", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 1
+    Opcode(0x1E, "ASL", "abs_x", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 2
+    # Rotate Left
+    Opcode(0x2A, "ROL", "acc", 1, 1, ["N", "Z", "C"], ["PC", "ACC"]), # reduced cycles (1 instead of 2)
+    Opcode(0x26, "ROL", "zpg", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced cycles (4 instead of 5)
+    Opcode(0x36, "ROL", "zpg_x", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
+    Opcode(0x2E, "ROL", "abs", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 1
+    Opcode(0x3E, "ROL", "abs_x", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 2
+    # Logical Shift Right
+    Opcode(0x4A, "LSR", "acc", 1, 1, ["N", "Z", "C"], ["PC", "ACC"]), # reduced cycles (1 instead of 2)
+    Opcode(0x46, "LSR", "zpg", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced cycles (4 instead of 5)
+    Opcode(0x56, "LSR", "zpg_x", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
+    Opcode(0x4E, "LSR", "abs", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 1
+    Opcode(0x5E, "LSR", "abs_x", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 2
+    # Rotate Right
+    Opcode(0x6A, "ROR", "acc", 1, 1, ["N", "Z", "C"], ["PC", "ACC"]), # reduced cycles (1 instead of 2)
+    Opcode(0x66, "ROR", "zpg", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced cycles (4 instead of 5)
+    Opcode(0x76, "ROR", "zpg_x", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
+    Opcode(0x6E, "ROR", "abs", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 1
+    Opcode(0x7E, "ROR", "abs_x", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 2
+    # Set/Clear Flags
+    # TODO: make sure that flags are also handled correctly
+    Opcode(0x38, "SEC", "impl", 1, 1, ["C"], ["PC"]),  # cycles 2->1
+    Opcode(0x18, "CLC", "impl", 1, 1, ["C"], ["PC"]),  # cycles 2->1
+    Opcode(0x78, "SEI", "impl", 1, 1, ["I"], ["PC"]),  # cycles 2->1
+    Opcode(0x58, "CLI", "impl", 1, 1, ["I"], ["PC"]),  # cycles 2->1
+    Opcode(0xF8, "SED", "impl", 1, 1, ["D"], ["PC"]),  # cycles 2->1
+    Opcode(0xD8, "CLD", "impl", 1, 1, ["D"], ["PC"]),  # cycles 2->1
+    Opcode(0xB8, "CLV", "impl", 1, 1, ["V"], ["PC"]),  # cycles 2->1
+    # Increment Register
+    Opcode(0xE8, "INX", "impl", 1, 1, ["N", "Z"], ["PC", "X"]),  # reduced cycles (1 instead of 2)
+    Opcode(0xC8, "INY", "impl", 1, 1, ["N", "Z"], ["PC", "Y"]),  # reduced cycles (1 instead of 2)
+    # Decrement Register
+    Opcode(0xCA, "DEX", "impl", 1, 1, ["N", "Z"], ["PC", "X"]),  # reduced cycles (1 instead of 2)
+    Opcode(0x88, "DEY", "impl", 1, 1, ["N", "Z"], ["PC", "Y"]),  # reduced cycles (1 instead of 2)
+    # Stack
+    Opcode(0x08, "PHP", "impl", 1, 2, [], ["PC", "SP"]), # reduced cycles (2 instead of 3)
+    Opcode(0x48, "PHA", "impl", 1, 2, [], ["PC", "SP"]), # reduced cycles (2 instead of 3)
+    Opcode(0x68, "PLA", "impl", 1, 2, ["N", "Z"], ["PC", "SP", "ACC"]), # reduced cycles (2 instead of 4)
+    Opcode(0x28, "PLP", "impl", 1, 2, ["N", "V", "B", "D", "I", "Z", "C"], ["PC", "SP"]), # reduced cycles (2 instead of 4)
+    # Transfer instructions
+    Opcode(0xAA, "TAX", "impl", 1, 1, ["N", "Z"], ["PC", "X"]),  # reduced cycles (1 instead of 2)
+    Opcode(0xA8, "TAY", "impl", 1, 1, ["N", "Z"], ["PC", "Y"]),  # reduced cycles (1 instead of 2)
+    Opcode(0x8A, "TXA", "impl", 1, 1, ["N", "Z"], ["PC", "ACC"]),  # reduced cycles (1 instead of 2)
+    Opcode(0x98, "TYA", "impl", 1, 1, ["N", "Z"], ["PC", "ACC"]),  # reduced cycles (1 instead of 2)
+    Opcode(0xBA, "TSX", "impl", 1, 1, ["N", "Z"], ["PC", "X"]),  # reduced cycles (1 instead of 2)
+    Opcode(0x9A, "TXS", "impl", 1, 1, [], ["PC", "SP"]),  # reduced cycles (1 instead of 2)
+    # Jumps
+    Opcode(0x4C, "JMP", "abs", 3, 3, [], ["PC"]),
+    Opcode(0x6C, "JMP", "ind", 3, 5, [], ["PC"]), # reduced cycles to 4
+    # Interrupts
+    # TODO: on C6502 D Flag is cleared additionally
+    # TODO: set I flag (masswerk says no, most other sites say yes) -> do it
+    Opcode(0x00, "BRK", "impl", 2, 6, ["I"], ["PC", "SP"]), # reduced cycles (7 -> 6)
+    Opcode(0x40, "RTI", "impl", 1, 4, ["N", "V", "B", "D", "I", "Z", "C"], ["PC", "SP"]),
+    # Subroutines
+    Opcode(0x20, "JSR", "abs", 3, 5, [], ["PC", "SP"]),
+    Opcode(0x60, "RTS", "impl", 1, 3, [], ["PC", "SP"]), # reduced cycles (6 -> 3)
+    # Branches
+    Opcode(0x10, "BPL", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
+    Opcode(0x30, "BMI", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
+    Opcode(0x50, "BVC", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
+    Opcode(0x70, "BVS", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
+    Opcode(0x90, "BCC", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
+    Opcode(0xB0, "BCS", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
+    Opcode(0xD0, "BNE", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
+    Opcode(0xF0, "BEQ", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
+    # Bit
+    Opcode(0x24, "BIT", "zpg", 2, 3, ["N", "V", "Z"], ["PC"]),
+    Opcode(0x2C, "BIT", "abs", 3, 4, ["N", "V", "Z"], ["PC"]),
+
+
+    # NOP
+    Opcode(0xEA, "NOP", "impl", 1, 2, [], ["PC"]),
+    # Illegal instruction used in testbench to mark end of program
+    Opcode(0x04, "END", "impl", 1, 1, [], []),
+]
+
+
+# Branch instructions: flag and value for which the branch is taken
+BRANCH_CONDITIONS = {
+    "BPL": ("N", 0),
+    "BMI": ("N", 1),
+    "BVC": ("V", 0),
+    "BVS": ("V", 1),
+    "BCC": ("C", 0),
+    "BCS": ("C", 1),
+    "BNE": ("Z", 0),
+    "BEQ": ("Z", 1),
+}
+
+
+# ########## Addressing mode resolvers ##########
+# Every resolver gets the memory, the address of the opcode and the register/flag values
+# before the instruction and returns (target_addr, addressed_value).
+
+def resolve_impl(mem, opcode_addr, regs):
+    return None, None
+
+
+def resolve_acc(mem, opcode_addr, regs):
+    return None, regs["ACC"]
+
+
+def resolve_imm(mem, opcode_addr, regs):
+    target_addr = opcode_addr + 1
+    return target_addr, mem[target_addr]
+
+
+def resolve_abs(mem, opcode_addr, regs):
+    target_addr = (mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1]
+    return target_addr, mem[target_addr]
+
+
+def resolve_zpg(mem, opcode_addr, regs):
+    target_addr = mem[opcode_addr + 1]
+    return target_addr, mem[target_addr]
+
+
+def resolve_abs_x(mem, opcode_addr, regs):
+    target_addr = ((mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1] + regs["X"]) & 0xFFFF
+    return target_addr, mem[target_addr]
+
+
+def resolve_abs_y(mem, opcode_addr, regs):
+    target_addr = ((mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1] + regs["Y"]) & 0xFFFF
+    return target_addr, mem[target_addr]
+
+
+def resolve_zpg_x(mem, opcode_addr, regs):
+    target_addr = (mem[opcode_addr + 1] + regs["X"]) & 0xFF
+    return target_addr, mem[target_addr]
+
+
+def resolve_zpg_y(mem, opcode_addr, regs):
+    target_addr = (mem[opcode_addr + 1] + regs["Y"]) & 0xFF
+    return target_addr, mem[target_addr]
+
+
+def resolve_ind(mem, opcode_addr, regs):
+    # Indirect addressing (only used for JMP)
+    target_addr = (mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1]
+    return target_addr, mem[target_addr]
+
+
+def resolve_ind_x(mem, opcode_addr, regs):
+    # Indirect addressing (X-indexed): pointer is read from zero page address + X
+    zpg_addr = (mem[opcode_addr + 1] + regs["X"]) & 0xFF
+    target_addr = (mem[zpg_addr + 1] << 8) + mem[zpg_addr]
+    return target_addr, mem[target_addr]
+
+
+def resolve_ind_y(mem, opcode_addr, regs):
+    # Indirect addressing (Y-indexed): Y is added to the pointer read from the zero page
+    zpg_addr = mem[opcode_addr + 1]
+    target_addr = ((mem[zpg_addr + 1] << 8) + mem[zpg_addr] + regs["Y"]) & 0xFFFF
+    return target_addr, mem[target_addr]
+
+
+def resolve_rel(mem, opcode_addr, regs):
+    # Relative addressing: signed offset from the address of the next instruction
+    offset = mem[opcode_addr + 1]
+    if offset > 127:
+        offset = offset - 256
+    target_addr = opcode_addr + 2 + offset
+    return target_addr, mem[target_addr]
+
+
+resolvers = {
+    "impl": resolve_impl,
+    "acc": resolve_acc,
+    "imm": resolve_imm,
+    "abs": resolve_abs,
+    "zpg": resolve_zpg,
+    "abs_x": resolve_abs_x,
+    "abs_y": resolve_abs_y,
+    "zpg_x": resolve_zpg_x,
+    "zpg_y": resolve_zpg_y,
+    "ind": resolve_ind,
+    "ind_x": resolve_ind_x,
+    "ind_y": resolve_ind_y,
+    "rel": resolve_rel,
+}
+
+
+class DispatchEntry:
+    """
+    One slot of the dispatch table: opcode metadata plus the prebound
+    addressing mode resolver and validator.
+    """
+    __slots__ = ("op", "resolve", "validate", "branch")
+
+    def __init__(self, op, resolve, validate, branch=None):
+        self.op = op
+        self.resolve = resolve
+        self.validate = validate
+        self.branch = branch  # (flag, value) for which a branch is taken, None otherwise
+
+
+# Sentinel for opcodes that are not part of opcode_list
+INVALID_OPCODE = DispatchEntry(None, None, None)
+
+
+def build_dispatch_table(validators, missing_validator):
+    """
+    Compile opcode_list into a dense table indexed by the opcode byte.
+
+    :param validators: dict mapping opcode names to validator functions.
+    :param missing_validator: Validator used for opcodes without an entry in validators.
+    :return: List of 256 DispatchEntry objects, INVALID_OPCODE for illegal opcodes.
+    """
+    table = [INVALID_OPCODE] * 256
+    for op in opcode_list:
+        table[op.opcode] = DispatchEntry(
+            op,
+            resolvers[op.addressing],
+            validators.get(op.name, missing_validator),
+            BRANCH_CONDITIONS.get(op.name),
+        )
+    return table
@@ -0,0 +1,153 @@
+"""
+Wall time of the testbench split into phases.
+
+The instruction loop of test_cpu.py marks the end of every phase with a
+lap, the time since the previous lap is charged to that phase:
+    sim_wait      simulator running the CPU until the next instruction boundary
+    bus_model     BusModel callbacks serving the bus cycles (measured by the bus model itself,
+                  taken out of the wait)
+    sample        reading the registers and flags of the DUT
+    validation    validators and comparisons with the golden model / expected trace
+    bookkeeping   everything else (memory undo log, dispatch, trace log, CPI and coverage counters)
+The times of every instruction are kept in preallocated arrays (8 bytes per
+phase and instruction), the report gives totals, means and percentiles per
+phase and per opcode.
+
+Profiling is enabled with PROFILE_FILE, without it the loop only pays an
+`is not None` check per lap.
+
+Usage: python profiler.py profile.json
+"""
+import json
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from opcodes import opcode_list
+
+PHASES = ("sim_wait", "bus_model", "sample", "validation", "bookkeeping")
+SIM_WAIT, BUS_MODEL, SAMPLE, VALIDATION, BOOKKEEPING = range(len(PHASES))
+PERCENTILES = (50, 90, 99)
+
+opcode_names = {op.opcode: f"{op.name} {op.addressing}" for op in opcode_list}
+
+
+class PhaseProfiler:
+    """
+    Per-instruction times of the testbench phases.
+    """
+
+    def __init__(self, workload):
+        self.workload = workload
+        self.samples = [array("d") for _ in PHASES]
+        self.opcodes = array("B")
+        self.current = [0.0] * len(PHASES)
+        self.mark = time.perf_counter()
+        self.bus_busy = 0.0
+        self.start_time = self.mark
+
+    def start(self, bus_busy=0.0):
+        """Start the first lap (the time before is not counted)."""
+        self.mark = time.perf_counter()
+        self.start_time = self.mark
+        self.bus_busy = bus_busy
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.current[phase] += now - self.mark
+        self.mark = now
+
+    def wait_lap(self, bus_busy):
+        """
+        End a wait for the simulator.
+
+        :param bus_busy: BusModel.busy, the time the bus model spent in its callbacks so far.
+        """
+        now = time.perf_counter()
+        busy = bus_busy - self.bus_busy
+        self.current[SIM_WAIT] += now - self.mark - busy
+        self.current[BUS_MODEL] += busy
+        self.bus_busy = bus_busy
+        self.mark = now
+
+    def end_instruction(self, opcode):
+        current = self.current
+        for phase, samples in enumerate(self.samples):
+            samples.append(current[phase])
+            current[phase] = 0.0
+        self.opcodes.append(opcode)
+
+    def report(self):
+        """
+        :return: dict with the wall time and the statistics of every phase, overall and per opcode.
+        """
+        times = np.array([np.frombuffer(samples, dtype=np.float64) for samples in self.samples]).reshape(len(PHASES), -1)
+        opcodes = np.frombuffer(self.opcodes, dtype=np.uint8)
+        total = float(times.sum())
+
+        def statistics(values):
+            entry = {"total": float(values.sum()), "mean": float(values.mean()) if len(values) else 0.0}
+            for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES) if len(values) else
+                                         [0.0] * len(PERCENTILES)):
+                entry[f"p{percentile}"] = float(value)
+            entry["max"] = float(values.max()) if len(values) else 0.0
+            return entry
+
+        phases = {}
+        for phase, name in enumerate(PHASES):
+            entry = statistics(times[phase])
+            entry["share"] = round(entry["total"] / total, 4) if total else 0.0
+            phases[name] = entry
+
+        per_opcode = []
+        for opcode in np.unique(opcodes):
+            selected = times[:, opcodes == opcode]
+            entry = {"opcode": f"{opcode:#04x}", "name": opcode_names.get(int(opcode), "?"),
+                     "instructions": int(selected.shape[1]), "instruction": statistics(selected.sum(axis=0))}
+            entry.update({name: statistics(selected[phase]) for phase, name in enumerate(PHASES)})
+            per_opcode.append(entry)
+        per_opcode.sort(key=lambda entry: entry["instruction"]["total"], reverse=True)
+
+        return {
+            "workload": self.workload,
+            "instructions": len(opcodes),
+            "wall_time": time.perf_counter() - self.start_time,
+            "profiled_time": total,
+            "instruction": statistics(times.sum(axis=0)),
+            "phases": phases,
+            "opcodes": per_opcode,
+        }
+
+
+def format_report(report, opcodes=10):
+    """
+    :param opcodes: Number of opcodes (most time first) that are listed.
+    """
+    lines = [
+        f"Profile of {report['workload']}: {report['instructions']} instructions in {report['wall_time']:.2f}s "
+        f"({report['profiled_time']:.2f}s in the instruction loop, "
+        f"mean {report['instruction']['mean'] * 1e6:.1f}us per instruction)",
+        f"{'phase':<14}{'total s':>10}{'share':>8}{'mean us':>10}{'p50 us':>9}{'p90 us':>9}{'p99 us':>9}",
+    ]
+    for name, entry in report["phases"].items():
+        lines.append(
+            f"{name:<14}{entry['total']:>10.3f}{entry['share']:>8.1%}{entry['mean'] * 1e6:>10.1f}"
+            f"{entry['p50'] * 1e6:>9.1f}{entry['p90'] * 1e6:>9.1f}{entry['p99'] * 1e6:>9.1f}"
+        )
+    lines.append(f"{'opcode':<14}{'count':>10}{'total s':>10}" + "".join(f"{name:>12}" for name in PHASES))
+    for entry in report["opcodes"][:opcodes]:
+        lines.append(f"{entry['name']:<14}{entry['instructions']:>10}{entry['instruction']['total']:>10.3f}"
+                     + "".join(f"{entry[name]['mean'] * 1e6:>10.1f}us" for name in PHASES))
+    return "\n".join(lines)
+
+
+def write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1] if len(sys.argv) > 1 else "profile.json") as f:
+        print(format_report(json.load(f), opcodes=256))
@@ -0,0 +1,440 @@
+"""
+Constrained-random programs for fuzzing the CPU.
+
+Every program is a random stream of the legal opcodes in opcode_list. The
+stream is generated in lockstep with the golden model: before an instruction
+is chosen its operands are resolved against the current registers, so the
+effective addresses are under control although the register values are
+random. This keeps every program runnable on the testbench:
+ - writes only go to the data area (page zero and 0x0100-0x05FF), never to code
+ - reads only come from the data area and the vector page
+ - all jumps and taken branches go forward to fresh code, skipped bytes are
+   filled with the invalid opcode 0x02
+ - JSR calls a fresh subroutine that returns with RTS, BRK enters a handler
+   that only contains RTI
+ - the stack stays within 0xF0-0x0F of page zero; JSR and BRK frames never
+   cross the 0x00/0xFF wrap, RTS and RTI of cpu.v read the stack at the
+   unwrapped SP + 1 (0x0100 for SP = 0xFF, see golden_model.py)
+
+Besides plain random instructions the generator inserts scenarios that are
+rare in random streams:
+    zp_wrap     zpg_x/zpg_y/ind_x operands that wrap around page zero
+    page_cross  abs_x/abs_y/ind_y accesses that cross a page
+    bcd         ADC/SBC with valid BCD operands in decimal mode
+    stack_wrap  PHA/PHP/PLA/PLP across the 0x00/0xFF boundary of the stack (they wrap)
+
+Programs start at 0x0600 (reset vector) and end with END (0x04). Every image
+is executed again on a fresh golden model after it was generated, which has
+to reach END in the same state.
+
+Usage: python randprog.py [-n COUNT] [--seed SEED] [--instructions N] [-j JOBS] [-o DIR] [--format bin|seg]
+                          [--scenarios LIST]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from golden_model import CPUModel
+from loader import write_image
+from opcodes import BRANCH_CONDITIONS, opcode_list
+
+START = 0x0600
+MAIN_END = 0xE000  # main instruction stream: START to MAIN_END
+SUB_END = 0xF800  # subroutines: MAIN_END to SUB_END
+JUMP_TABLE = 0xFE00  # pointers of JMP ind
+HANDLER = 0xFF00  # BRK/IRQ/NMI handler (RTI)
+MARGIN = 0x100  # space kept free at the end of a code area for the last jump
+
+FILL = 0x02  # invalid opcode, marks bytes that must never be executed
+END_OPCODE = 0x04
+
+DATA_END = 0x0600  # page zero and the data pages end here
+POINTERS = range(0x10, 0x3F)  # pointer area for ind_x/ind_y, never written
+STACK_WINDOW = frozenset((0xF0 + i) & 0xFF for i in range(0x20))
+WRITABLE_ZPG = frozenset(range(0x40, 0xF0)) | STACK_WINDOW
+
+WRITABLE_ZPG_LIST = sorted(WRITABLE_ZPG)
+
+SCENARIOS = ("zp_wrap", "page_cross", "bcd", "stack_wrap")
+
+OPS = {(op.name, op.addressing): op for op in opcode_list}
+STORES = ("STA", "STX", "STY")
+READ_MODIFY_WRITE = ("ASL", "LSR", "ROL", "ROR", "INC", "DEC")
+# Only emitted by the generator itself
+SPECIAL = ("END", "RTS", "RTI")
+# Index register of the indexed addressing modes
+INDEX = {"zpg_x": "X", "abs_x": "X", "ind_x": "X", "zpg_y": "Y", "abs_y": "Y", "ind_y": "Y"}
+
+
+def bcd(value):
+    return ((value // 10) << 4) | (value % 10)
+
+
+class ProgramGenerator:
+    """
+    Generates one random program.
+
+    :param seed: Seed of the random generator, the same seed gives the same program.
+    :param scenarios: Names of the enabled scenarios.
+    :param scenario_rate: Probability that the next instruction starts a scenario.
+    """
+
+    def __init__(self, seed, scenarios=SCENARIOS, scenario_rate=0.2):
+        self.rng = rng = random.Random(seed)
+        self.scenarios = [getattr(self, "scenario_" + name) for name in scenarios]
+        self.scenario_rate = scenario_rate
+        self.pool = [op for op in opcode_list if op.name not in SPECIAL]
+
+        image = bytearray([FILL]) * 65536
+        image[:DATA_END] = rng.randbytes(DATA_END)
+        for pointer in range(POINTERS.start, POINTERS.stop, 2):
+            # Pointers into the data pages, with room for Y
+            image[pointer] = rng.randrange(0x100)
+            image[pointer + 1] = rng.randrange(0x01, 0x05)
+        image[HANDLER] = OPS["RTI", "impl"].opcode
+        for vector, target in ((0xFFFA, HANDLER), (0xFFFC, START), (0xFFFE, HANDLER)):
+            image[vector] = target & 0xFF
+            image[vector + 1] = target >> 8
+        self.image = image
+        self.model = CPUModel(bytearray(image))
+        # 1 for every byte that holds generated code
+        self.code = bytearray(65536)
+        self.code[HANDLER] = 1
+
+        self.queue = deque()  # (op, operand) of a started scenario, operand None if resolved when emitted
+        self.jump_table = JUMP_TABLE
+        self.sub_cursor = MAIN_END
+        self.frame = None  # SP inside the current subroutine after JSR, None outside of subroutines
+        self.protected = set()  # stack bytes holding the return address of the current subroutine
+        self.sub_remaining = 0
+
+    def generate(self, instructions):
+        """
+        :param instructions: Number of instructions to execute before END.
+        :return: The 64 KiB program image.
+        """
+        model = self.model
+        while model.instructions < instructions:
+            pc = model.PC
+            if not self.code[pc]:
+                limit = MAIN_END if pc < MAIN_END else SUB_END
+                if pc > limit - MARGIN:
+                    break
+                self.emit_next(pc)
+            model.step()
+        while self.code[model.PC]:
+            model.step()
+        self.emit(model.PC, OPS["END", "impl"], b"")
+        return self.image
+
+    def emit(self, pc, op, operand):
+        data = bytes([op.opcode]) + operand
+        end = pc + len(data)
+        self.image[pc:end] = data
+        self.model.mem[pc:end] = data
+        self.code[pc:end] = b"\x01" * len(data)
+
+    def emit_next(self, pc):
+        while self.queue:
+            op, operand = self.queue.popleft()
+            if operand is None:
+                operand = self.operand(op, pc, prefer=True)
+            if operand is not None:
+                self.emit(pc, op, operand)
+                return
+        instructions = self.choose(pc)
+        op, operand = instructions[0]
+        self.emit(pc, op, operand)
+        self.queue.extend(instructions[1:])
+
+    def choose(self, pc):
+        """:return: list of (op, operand), the first one resolved."""
+        rng = self.rng
+        if self.frame is not None:
+            self.sub_remaining -= 1
+            if self.sub_remaining <= 0:
+                if self.model.SP != self.frame:
+                    # Pull what the subroutine pushed before returning
+                    return [(OPS["PLA", "impl"], b"")]
+                self.frame = None
+                self.protected.clear()
+                self.sub_cursor = pc + 1
+                return [(OPS["RTS", "impl"], b"")]
+
+        if self.scenarios and rng.random() < self.scenario_rate:
+            instructions = rng.choice(self.scenarios)()
+            if instructions:
+                op, operand = instructions[0]
+                if operand is None:
+                    operand = self.operand(op, pc, prefer=True)
+                if operand is not None:
+                    return [(op, operand)] + instructions[1:]
+
+        for _ in range(16):
+            op = rng.choice(self.pool)
+            operand = self.operand(op, pc)
+            if operand is not None:
+                return [(op, operand)]
+        return [(OPS["NOP", "impl"], b"")]
+
+    # ########## Operands ##########
+
+    def operand(self, op, pc, prefer=False):
+        """
+        Resolve the operand bytes of an instruction at pc.
+
+        :param prefer: Prefer operands that wrap around page zero or cross a page.
+        :return: Operand bytes, None if the instruction cannot be used in the current state.
+        """
+        model = self.model
+        name, addressing = op.name, op.addressing
+        if addressing == "rel":
+            flag, value = BRANCH_CONDITIONS[name]
+            if getattr(model, flag) == value:
+                return bytes([self.gap()])
+            # Not taken, any offset is fine
+            return bytes([self.rng.randrange(0x100)])
+        if name == "JMP":
+            target = pc + 3 + self.gap()
+            if addressing == "abs":
+                return target.to_bytes(2, "little")
+            if self.jump_table + 2 > HANDLER:
+                return None
+            pointer = self.jump_table
+            self.jump_table += 2
+            self.image[pointer:pointer + 2] = self.model.mem[pointer:pointer + 2] = target.to_bytes(2, "little")
+            return pointer.to_bytes(2, "little")
+        if name == "JSR":
+            if self.frame is not None or not self.can_push_frame(2) or self.sub_cursor > SUB_END - 0x1000:
+                return None
+            self.frame = (model.SP - 2) & 0xFF
+            self.protected = {model.SP, (model.SP - 1) & 0xFF}
+            self.sub_remaining = self.rng.randint(2, 24)
+            return self.sub_cursor.to_bytes(2, "little")
+        if name == "BRK":
+            # RTI returns behind the padding byte
+            return bytes([FILL]) if self.can_push_frame(3) else None
+        if name in ("PHA", "PHP"):
+            return b"" if self.can_push(1) else None
+        if name in ("PLA", "PLP"):
+            return b"" if self.can_pull() else None
+        if name == "TXS":
+            return b"" if self.frame is None and model.X in STACK_WINDOW else None
+        if addressing in ("impl", "acc"):
+            return b""
+        if addressing == "imm":
+            return bytes([self.rng.randrange(0x100)])
+
+        write = name in STORES or name in READ_MODIFY_WRITE
+        index = getattr(model, INDEX[addressing]) if addressing in INDEX else 0
+        if addressing == "zpg":
+            target = self.pick_zpg(write)
+            return None if target is None else bytes([target])
+        if addressing in ("zpg_x", "zpg_y"):
+            for _ in range(8):
+                target = self.pick_zpg(write)
+                # The operand wraps if the target is below the index
+                if target is not None and (not prefer or target < index or index == 0):
+                    return bytes([(target - index) & 0xFF])
+            return None
+        if addressing == "abs":
+            return self.pick_address(write).to_bytes(2, "little")
+        if addressing in ("abs_x", "abs_y"):
+            for _ in range(8):
+                target = self.pick_address(write)
+                # The base crosses a page if the low byte of the target is below the index
+                if not prefer or (target & 0xFF) < index or index == 0:
+                    return ((target - index) & 0xFFFF).to_bytes(2, "little")
+            return None
+        if addressing == "ind_x":
+            # The pointer location wraps if it is below X
+            location = self.pick_pointer(write, lambda pointer: pointer, lambda location: location < index, prefer)
+            return None if location is None else bytes([(location - index) & 0xFF])
+        if addressing == "ind_y":
+            mem = model.mem
+            location = self.pick_pointer(write, lambda pointer: (pointer + index) & 0xFFFF,
+                                         lambda location: mem[location] + index > 0xFF, prefer)
+            return None if location is None else bytes([location])
+        raise ValueError(f"Unknown addressing mode {addressing}")
+
+    def gap(self):
+        # Bytes skipped by a jump or taken branch, mostly short, sometimes into another page
+        if self.rng.random() < 0.9:
+            return self.rng.randrange(0x10)
+        return self.rng.randrange(0x80)
+
+    def can_push(self, count):
+        sp = self.model.SP
+        return all((sp - i) & 0xFF in STACK_WINDOW for i in range(count))
+
+    def can_push_frame(self, count):
+        # RTS/RTI pull the frame without wrapping the address, SP must not pass 0xFF while they pull it
+        return self.can_push(count) and self.model.SP >= count
+
+    def can_pull(self):
+        address = (self.model.SP + 1) & 0xFF
+        return address in STACK_WINDOW and address not in self.protected
+
+    def writable(self, address):
+        if address < 0x100:
+            return address in WRITABLE_ZPG and address not in self.protected
+        return address < DATA_END
+
+    def readable(self, address):
+        return address < DATA_END or address >= HANDLER
+
+    def pick_zpg(self, write):
+        if not write:
+            return self.rng.randrange(0x100)
+        for _ in range(8):
+            target = self.rng.choice(WRITABLE_ZPG_LIST)
+            if target not in self.protected:
+                return target
+        return None
+
+    def pick_address(self, write):
+        rng = self.rng
+        if write:
+            return rng.randrange(0x0100, DATA_END)
+        if rng.random() < 0.1:
+            # Handler and vectors are fixed from the start
+            return rng.randrange(HANDLER, 0x10000)
+        return rng.randrange(DATA_END)
+
+    def pick_pointer(self, write, target_of, preferred, prefer):
+        """
+        Choose a pointer of the pointer area whose target can be accessed.
+
+        :param target_of: Function of the pointer value returning the effective address.
+        :param preferred: Function of the pointer location, True if it wraps / crosses a page.
+        :return: Location of the pointer, None if no pointer fits.
+        """
+        mem = self.model.mem
+        candidates = list(POINTERS)
+        self.rng.shuffle(candidates)
+        fallback = None
+        for location in candidates:
+            target = target_of(mem[location] | (mem[location + 1] << 8))
+            if not (self.writable(target) if write else self.readable(target)):
+                continue
+            if not prefer or preferred(location):
+                return location
+            if fallback is None:
+                fallback = location
+        return fallback
+
+    # ########## Scenarios ##########
+    # Return a list of (op, operand), operand None to resolve it with prefer=True when emitted
+
+    def indexed_scenario(self, modes):
+        rng = self.rng
+        op = rng.choice([op for op in self.pool if op.addressing in modes])
+        register = INDEX[op.addressing]
+        if getattr(self.model, register) == 0:
+            # The index must not be zero to wrap or cross a page
+            return [(OPS["LD" + register, "imm"], bytes([rng.randrange(0x80, 0x100)])), (op, None)]
+        return [(op, None)]
+
+    def scenario_zp_wrap(self):
+        return self.indexed_scenario(("zpg_x", "zpg_y", "ind_x"))
+
+    def scenario_page_cross(self):
+        return self.indexed_scenario(("abs_x", "abs_y", "ind_y"))
+
+    def scenario_bcd(self):
+        rng = self.rng
+        carry = OPS[rng.choice(("SEC", "CLC")), "impl"]
+        operation = OPS[rng.choice(("ADC", "SBC")), "imm"]
+        return [
+            (OPS["SED", "impl"], b""),
+            (carry, b""),
+            (OPS["LDA", "imm"], bytes([bcd(rng.randrange(100))])),
+            (operation, bytes([bcd(rng.randrange(100))])),
+            (OPS["CLD", "impl"], b""),
+        ]
+
+    def scenario_stack_wrap(self):
+        if self.frame is not None:
+            return None
+        rng = self.rng
+        # Close to the wrap of SP, the window leaves room for the pushes and pulls below
+        instructions = [(OPS["LDX", "imm"], bytes([rng.choice((0x00, 0x01, 0x02, 0xFF, 0xFE))])),
+                        (OPS["TXS", "impl"], b"")]
+        for _ in range(6):
+            instructions.append((OPS[rng.choice(("PHA", "PHP", "PLA", "PLP")), "impl"], b""))
+        return instructions
+
+
+
+def check_program(image, expected, max_instructions):
+    """
+    Run a generated image on a fresh golden model.
+
+    :param image: Program image.
+    :param expected: Model that generated the image, stopped in front of END.
+    :param max_instructions: Abort programs that do not reach END.
+    """
+    model = CPUModel(bytearray(image))
+    mem = model.mem
+    while mem[model.PC] != END_OPCODE:
+        if model.instructions >= max_instructions:
+            raise RuntimeError(f"Program did not reach END within {max_instructions} instructions")
+        model.step()
+    if model.state() != expected.state() or model.cycles != expected.cycles or mem != expected.mem:
+        raise RuntimeError("Program does not reach END in the state it was generated for")
+
+
+def generate_program(seed, instructions, output_dir, scenarios=SCENARIOS, image_format="bin"):
+    """
+    Generate, check and save one program.
+
+    :param image_format: "bin" (64 KiB flat image) or "seg" (only the used regions, see loader.py).
+    :return: (path, executed instructions, cycles)
+    """
+    generator = ProgramGenerator(seed, scenarios)
+    image = generator.generate(instructions)
+    model = generator.model
+    check_program(image, model, model.instructions + 1)
+    path = os.path.join(output_dir, f"random_{seed:06d}.{image_format}")
+    write_image(image, path, FILL)
+    return path, model.instructions, model.cycles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate constrained-random test programs")
+    parser.add_argument("-n", "--count", type=int, default=100, help="number of programs")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first program, the others count up")
+    parser.add_argument("--instructions", type=int, default=1000, help="instructions executed by every program")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="programs generated in parallel")
+    parser.add_argument("-o", "--output", default="random_programs", help="directory of the images")
+    parser.add_argument("--format", choices=("bin", "seg"), default="bin",
+                        help="flat 64 KiB images or segment files with only the used regions")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma separated scenarios, empty for plain random streams ({', '.join(SCENARIOS)})")
+    args = parser.parse_args()
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"Unknown scenario {name}")
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    seeds = range(args.seed, args.seed + args.count)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(generate_program, seeds, [args.instructions] * args.count,
+                                [args.output] * args.count, [scenarios] * args.count,
+                                [args.format] * args.count, chunksize=8))
+    elapsed = time.perf_counter() - start
+    instructions = sum(result[1] for result in results)
+    print(f"{len(results)} programs with {instructions} instructions written to {args.output} "
+          f"in {elapsed:.1f}s ({instructions / max(elapsed, 1e-9):.0f} instructions/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+Parallel regression runner for the cocotb testbench.
+
+Every program is simulated by its own simulator process in its own working
+directory (results.xml, waves and log never collide). The JUnit results of all
+programs are merged into one report with per-program timing. The simulation is
+compiled once before the parallel runs start, all runs share it through the
+build cache (see build_cache.py). The coverage files of all runs are merged
+into <work-dir>/opcode_coverage.npz (see opcode_coverage.py).
+
+Programs are given as images (.bin, .hex, .seg), as .65s sources (assembled with asm6502.py)
+or as directories containing either. In directories a prebuilt .bin is used
+instead of the source of the same name.
+
+Usage: python regress.py [-j JOBS] [-o regress.xml] [--work-dir DIR] PROGRAM_OR_DIR...
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from asm6502 import assemble_file
+from build_cache import CACHE_DIR, format_stats, read_stats
+from loader import PROGRAM_EXTENSIONS
+from opcode_coverage import coverage_report, merge_files
+
+TB_DIR = os.path.dirname(os.path.abspath(__file__))
+MAKEFILE = os.path.join(TB_DIR, "Makefile")
+
+
+def collect_programs(paths):
+    """
+    Resolve the command line arguments into program images.
+
+    :param paths: Program images (see loader.py), .65s files or directories.
+    :return: Sorted list of absolute image paths, sources are replaced by their cached image.
+    """
+    programs = set()
+    for path in paths:
+        if os.path.isdir(path):
+            names = os.listdir(path)
+            candidates = [os.path.join(path, name) for name in names if name.endswith(PROGRAM_EXTENSIONS) or
+                          (name.endswith(".65s") and name[:-4] + ".bin" not in names)]
+        else:
+            candidates = [path]
+        for candidate in candidates:
+            ext = os.path.splitext(candidate)[1]
+            if ext == ".65s":
+                candidate = assemble_file(candidate)
+            elif ext not in PROGRAM_EXTENSIONS:
+                raise ValueError(f"Unknown program type {candidate}")
+            programs.add(os.path.abspath(candidate))
+    return sorted(programs)
+
+
+def program_name(program):
+    return os.path.splitext(os.path.basename(program))[0]
+
+
+def build_simulation(work_dir, env):
+    """
+    Compile the simulation into the build cache, so the parallel runs do not compile it at the same time.
+
+    :return: Return code of make, the log is written to work_dir/build.log.
+    """
+    with open(os.path.join(work_dir, "build.log"), "w") as f:
+        return subprocess.call(
+            ["make", "-f", MAKEFILE, "--no-print-directory", "build"],
+            cwd=work_dir, env=env, stdout=f, stderr=subprocess.STDOUT,
+        )
+
+
+def run_batch(programs, work_dir, env):
+    """
+    Simulate one or several programs one after another in one simulator process, in an isolated working directory.
+
+    The startup of the simulator is paid once for the whole batch, every
+    program is a test of its own in the results file.
+
+    :param programs: Absolute paths of the program images.
+    :param work_dir: Root directory, the batch gets its own subdirectory.
+    :param env: Environment of the simulator process.
+    :return: dict with name, programs, returncode, wall time, results file, log file and whether it failed.
+    """
+    name = program_name(programs[0])
+    if len(programs) == 1:
+        env = dict(env, PROGRAM=programs[0])
+    else:
+        name = f"batch_{name}"
+        env = dict(env, PROGRAMS=os.pathsep.join(programs))
+    program_dir = os.path.join(work_dir, name)
+    os.makedirs(program_dir, exist_ok=True)
+    results = os.path.join(program_dir, "results.xml")
+    log = os.path.join(program_dir, "sim.log")
+    if os.path.exists(results):
+        os.remove(results)
+    # Outputs of an earlier run must not be mistaken for the ones of this run
+    for pattern in ("opcode_coverage*.npz", "cpi_report*.json", "sim_speed*.json"):
+        for stale in glob.glob(os.path.join(program_dir, pattern)):
+            os.remove(stale)
+
+    env = dict(env, COCOTB_RESULTS_FILE=results)
+    start = time.perf_counter()
+    with open(log, "w") as f:
+        returncode = subprocess.call(
+            ["make", "-f", MAKEFILE, "--no-print-directory"],
+            cwd=program_dir, env=env, stdout=f, stderr=subprocess.STDOUT,
+        )
+    tests, failures, errors = count_results(results)
+    return {
+        "name": name,
+        "program": os.pathsep.join(programs),
+        "returncode": returncode,
+        "time": time.perf_counter() - start,
+        "results": results,
+        "log": log,
+        # cocotb exits with 0 even if tests fail, only the results file tells
+        "failed": returncode != 0 or tests == 0 or failures + errors > 0,
+    }
+
+
+def count_results(results):
+    """
+    :param results: JUnit file written by cocotb.
+    :return: (tests, failures, errors), all 0 if the file does not exist.
+    """
+    if not os.path.exists(results):
+        return 0, 0, 0
+    tests = failures = errors = 0
+    for testcase in ET.parse(results).getroot().iter("testcase"):
+        tests += 1
+        if testcase.find("failure") is not None:
+            failures += 1
+        if testcase.find("error") is not None:
+            errors += 1
+    return tests, failures, errors
+
+
+def log_tail(path, lines=20):
+    with open(path, errors="replace") as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def merge_results(runs, report):
+    """
+    Merge the JUnit files of all runs into one report.
+
+    Every program becomes a testsuite, its time is the wall time of the whole
+    simulator process (build and simulation). Runs without results file are
+    reported as an error with the end of their log.
+
+    :param runs: Return values of run_batch.
+    :param report: Path of the merged JUnit file.
+    :return: (tests, failures, errors)
+    """
+    root = ET.Element("testsuites", name="regress")
+    total_tests = total_failures = total_errors = 0
+    for run in sorted(runs, key=lambda run: run["name"]):
+        suite = ET.SubElement(root, "testsuite", name=run["name"], package=run["program"])
+        tests = failures = errors = 0
+        if os.path.exists(run["results"]):
+            for testcase in ET.parse(run["results"]).getroot().iter("testcase"):
+                testcase.set("classname", f"{run['name']}.{testcase.get('classname', '')}")
+                suite.append(testcase)
+                tests += 1
+                if testcase.find("failure") is not None:
+                    failures += 1
+                if testcase.find("error") is not None:
+                    errors += 1
+        if tests == 0 or (run["returncode"] != 0 and failures + errors == 0):
+            testcase = ET.SubElement(suite, "testcase", name="simulation",
+                                     classname=run["name"], time=f"{run['time']:.3f}")
+            error = ET.SubElement(testcase, "error", message=f"Simulator exited with {run['returncode']}")
+            error.text = log_tail(run["log"])
+            tests += 1
+            errors += 1
+        suite.set("tests", str(tests))
+        suite.set("failures", str(failures))
+        suite.set("errors", str(errors))
+        suite.set("time", f"{run['time']:.3f}")
+        total_tests += tests
+        total_failures += failures
+        total_errors += errors
+
+    root.set("tests", str(total_tests))
+    root.set("failures", str(total_failures))
+    root.set("errors", str(total_errors))
+    ET.ElementTree(root).write(report, encoding="utf-8", xml_declaration=True)
+    return total_tests, total_failures, total_errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the CPU testbench on many programs in parallel")
+    parser.add_argument("programs", nargs="+", help="program images, .65s sources or directories")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="simulator processes run in parallel")
+    parser.add_argument("-o", "--output", default="regress.xml", help="merged JUnit report")
+    parser.add_argument("--work-dir", default="regress_build", help="root of the per-program working directories")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="programs run one after another by the same simulator process (amortizes the startup)")
+    args = parser.parse_args()
+
+    programs = collect_programs(args.programs)
+    names = [program_name(program) for program in programs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        parser.error(f"Programs must have unique names: {', '.join(sorted(duplicates))}")
+
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    # Expected traces are shared between all runs. Failures are not replayed, replay.py reruns them one at a time.
+    env = dict(os.environ, TRACE_CACHE_DIR=os.path.join(work_dir, ".trace_cache"), REPLAY="0")
+
+    start = time.perf_counter()
+    cache_dir = env.get("BUILD_CACHE_DIR", CACHE_DIR)
+    stats_before = read_stats(cache_dir)
+    if build_simulation(work_dir, env) != 0:
+        # Every run would compile the same entry again and fail the same way
+        print(f"Compilation failed (see {os.path.join(work_dir, 'build.log')})")
+        return 1
+    runs = []
+    # The threads only wait for the simulator processes, they do no work themselves
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        batches = [programs[i:i + args.batch] for i in range(0, len(programs), args.batch)]
+        futures = [pool.submit(run_batch, batch, work_dir, env) for batch in batches]
+        for future in as_completed(futures):
+            run = future.result()
+            status = f"FAILED (see {run['log']})" if run["failed"] else "OK"
+            print(f"{run['name']}: {run['time']:.1f}s {status}")
+            runs.append(run)
+    wall_time = time.perf_counter() - start
+
+    tests, failures, errors = merge_results(runs, args.output)
+    serial_time = sum(run["time"] for run in runs)
+    print(f"{len(programs)} programs in {len(runs)} simulations, {tests} tests, {failures} failures, {errors} errors "
+          f"in {wall_time:.1f}s ({serial_time:.1f}s serial, {args.jobs} jobs)")
+    stats = read_stats(cache_dir)
+    print(format_stats({"hits": stats["hits"] - stats_before["hits"],
+                        "misses": stats["misses"] - stats_before["misses"], "entries": {}}))
+    coverage_files = sorted(path for run in runs
+                            for path in glob.glob(os.path.join(os.path.dirname(run["results"]), "opcode_coverage*.npz")))
+    if coverage_files:
+        coverage = merge_files(coverage_files, f"{len(programs)} programs")
+        coverage.save(os.path.join(work_dir, "opcode_coverage.npz"))
+        report = coverage_report(coverage)
+        print(f"Coverage: {report['covered']}/{report['bins']} bins ({report['coverage']:.1%}), "
+              f"python opcode_coverage.py report {os.path.join(work_dir, 'opcode_coverage.npz')} lists the holes")
+    print(f"Report written to {args.output}")
+    return 0 if failures == 0 and errors == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Failure-triggered replay of the instructions before a mismatch.
+
+During a normal run test_cpu.py keeps checkpoints (instruction index, cycle
+and opcode address) of the last REPLAY_INSTRUCTIONS instructions. When a
+check fails it writes them to failure.json. The replay simulates the same
+program again without checks up to the oldest checkpoint, then runs the
+window up to the failing instruction with waveforms and the per-cycle bus
+trace enabled. The cost of a replay therefore depends on the window, not on
+everything executed before it.
+
+The Makefile starts the replay automatically after a failing run (REPLAY=0
+disables it).
+
+Usage: python replay.py [failure.json]
+"""
+import json
+import os
+import subprocess
+import sys
+
+TB_DIR = os.path.dirname(os.path.abspath(__file__))
+MAKEFILE = os.path.join(TB_DIR, "Makefile")
+FAILURE_FILE = "failure.json"
+
+
+def write_failure(path, program, instruction, cycle, opcode_addr, message, checkpoints):
+    """
+    Record a failing instruction and the checkpoint the replay starts from.
+
+    :param path: File to write.
+    :param program: Path of the program image.
+    :param instruction: Index of the failing instruction.
+    :param cycle: Bus cycle at which the failing instruction started.
+    :param opcode_addr: Address of the failing opcode.
+    :param message: Assertion message.
+    :param checkpoints: (instruction, cycle, opcode_addr) of the last instructions, oldest first.
+    """
+    first = checkpoints[0] if checkpoints else (instruction, cycle, opcode_addr)
+    failure = {
+        "program": os.path.abspath(program),
+        "instruction": instruction,
+        "cycle": cycle,
+        "opcode_addr": opcode_addr,
+        "message": message,
+        "window": {"instruction": first[0], "cycle": first[1], "opcode_addr": first[2]},
+    }
+    with open(path, "w") as f:
+        json.dump(failure, f, indent=2)
+
+
+def read_failure(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def replay(failure_path, work_dir="replay", wave_format="fst"):
+    """
+    Re-simulate the window before a failure with waveforms and cycle trace.
+
+    :param failure_path: failure.json written by the failing run.
+    :param work_dir: Directory of the replay (waves and log).
+    :param wave_format: "vcd" or "fst".
+    :return: Return code of the simulator.
+    """
+    failure_path = os.path.abspath(failure_path)
+    failure = read_failure(failure_path)
+    window = failure["window"]
+    os.makedirs(work_dir, exist_ok=True)
+    # Stale results of an earlier replay must not be mistaken for this one
+    for name in ("results.xml", FAILURE_FILE):
+        if os.path.exists(os.path.join(work_dir, name)):
+            os.remove(os.path.join(work_dir, name))
+
+    # The replay must not inherit the variables of a make that started it
+    env = {k: v for k, v in os.environ.items() if k not in ("MAKEFLAGS", "MFLAGS", "MAKELEVEL")}
+    env["REPLAY_FILE"] = failure_path
+    variables = {
+        "PROGRAM": failure["program"],
+        "PROGRAMS": "",
+        "REPLAY": "0",
+        "WAVE_MODE": "window",
+        "WAVE_FORMAT": wave_format,
+        "WAVE_WINDOW": f"{window['instruction']}:{failure['instruction']}",
+        "SIM": os.environ.get("SIM", "icarus"),
+        "COCOTB_RESULTS_FILE": "results.xml",
+    }
+    log = os.path.join(work_dir, "replay.log")
+    print(f"Replaying instructions {window['instruction']} to {failure['instruction']} "
+          f"(cycle {window['cycle']}, opcode at {hex(window['opcode_addr'])}) of {failure['program']}")
+    with open(log, "w") as f:
+        returncode = subprocess.call(
+            ["make", "-f", MAKEFILE, "--no-print-directory"] + [f"{k}={v}" for k, v in variables.items()],
+            cwd=work_dir, env=env, stdout=f, stderr=subprocess.STDOUT,
+        )
+    print(f"Replay log: {log}, waveform: {os.path.join(work_dir, 'wave_output.' + wave_format)}")
+    return returncode
+
+
+if __name__ == "__main__":
+    replay(sys.argv[1] if len(sys.argv) > 1 else FAILURE_FILE)
@@ -1,220 +1,75 @@
+import json
+import os
+import time
+from collections import deque
+
 import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import RisingEdge, ReadOnly, ReadWrite  # Import ReadOnly
-from cocotb.triggers import Timer
 
 import numpy as np
 
-import copy
-
-DEBUG = False
-
-
-class Opcode:
-    def __init__(self, opcode, name, addressing, bytes, cycles, affected_flags, affected_regs):
-        self.opcode = opcode  # opcode hex value
-        self.name = name  # name of the opcode
-        self.addressing = addressing  # addressing mode
-        self.bytes = bytes  # number of bytes the opcode uses in memory
-        self.cycles = cycles  # number of cycles the opcode takes
-        self.affected_flags = affected_flags  # flags affected by the opcode
-        self.affected_regs = affected_regs  # registers affected by the opcode
-
-    def __repr__(self):
-        return f"{self.name} {self.addressing} ({hex(self.opcode)})"
-
-
-# Create an array of OpcodeInfo objects
-# opcode, name, addressing_mode, length (in bytes), cycles, affected_flags, affected_regs
-opcode_list = [
-    # LDA
-    Opcode(0xA9, "LDA", "imm", 2, 2, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0xA5, "LDA", "zpg", 2, 3, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0xB5, "LDA", "zpg_x", 2, 3, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0xAD, "LDA", "abs", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0xBD, "LDA", "abs_x", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0xB9, "LDA", "abs_y", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0xA1, "LDA", "ind_x", 2, 5, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0xB1, "LDA", "ind_y", 2, 5, ["N", "Z"], ["PC", "ACC"]),
-    # STA
-    Opcode(0x85, "STA", "zpg", 2, 3, [], ["PC"]),
-    Opcode(0x95, "STA", "zpg_x", 2, 3, [], ["PC"]),
-    Opcode(0x8D, "STA", "abs", 3, 4, [], ["PC"]),
-    Opcode(0x9D, "STA", "abs_x", 3, 4, [], ["PC"]), # reduced cycles (normally always 5, now always 4) TODO: paper: verwunderlich warum hier keine variable Ausführungszeit
-    Opcode(0x99, "STA", "abs_y", 3, 4, [], ["PC"]),
-    Opcode(0x81, "STA", "ind_x", 2, 5, [], ["PC"]), # reduced cycles (normally always 6, now always 5)
-    Opcode(0x91, "STA", "ind_y", 2, 5, [], ["PC"]), # reduced cycles (normally always 6, now always 5)
-    # ADC
-    Opcode(0x69, "ADC", "imm", 2, 2, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0x65, "ADC", "zpg", 2, 3, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0x75, "ADC", "zpg_x", 2, 3, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0x6D, "ADC", "abs", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0x7D, "ADC", "abs_x", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0x79, "ADC", "abs_y", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0x61, "ADC", "ind_x", 2, 5, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0x71, "ADC", "ind_y", 2, 5, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    # SBC
-    Opcode(0xE9, "SBC", "imm", 2, 2, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0xE5, "SBC", "zpg", 2, 3, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0xF5, "SBC", "zpg_x", 2, 3, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0xED, "SBC", "abs", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0xFD, "SBC", "abs_x", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0xF9, "SBC", "abs_y", 3, 4, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0xE1, "SBC", "ind_x", 2, 5, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    Opcode(0xF1, "SBC", "ind_y", 2, 5, ["N", "Z", "C", "V"], ["PC", "ACC"]),
-    # ORA
-    Opcode(0x09, "ORA", "imm", 2, 2, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x05, "ORA", "zpg", 2, 3, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x15, "ORA", "zpg_x", 2, 3, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x0D, "ORA", "abs", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x1D, "ORA", "abs_x", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x19, "ORA", "abs_y", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x01, "ORA", "ind_x", 2, 5, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x11, "ORA", "ind_y", 2, 5, ["N", "Z"], ["PC", "ACC"]),
-    # AND
-    Opcode(0x29, "AND", "imm", 2, 2, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x25, "AND", "zpg", 2, 3, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x35, "AND", "zpg_x", 2, 3, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x2D, "AND", "abs", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x3D, "AND", "abs_x", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x39, "AND", "abs_y", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x21, "AND", "ind_x", 2, 5, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x31, "AND", "ind_y", 2, 5, ["N", "Z"], ["PC", "ACC"]),
-    # EOR
-    Opcode(0x49, "EOR", "imm", 2, 2, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x45, "EOR", "zpg", 2, 3, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x55, "EOR", "zpg_x", 2, 3, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x4D, "EOR", "abs", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x5D, "EOR", "abs_x", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x59, "EOR", "abs_y", 3, 4, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x41, "EOR", "ind_x", 2, 5, ["N", "Z"], ["PC", "ACC"]),
-    Opcode(0x51, "EOR", "ind_y", 2, 5, ["N", "Z"], ["PC", "ACC"]),
-    # CMP
-    Opcode(0xC9, "CMP", "imm", 2, 2, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xC5, "CMP", "zpg", 2, 3, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xD5, "CMP", "zpg_x", 2, 3, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xCD, "CMP", "abs", 3, 4, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xDD, "CMP", "abs_x", 3, 4, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xD9, "CMP", "abs_y", 3, 4, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xC1, "CMP", "ind_x", 2, 5, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xD1, "CMP", "ind_y", 2, 5, ["N", "Z", "C"], ["PC"]),
-    # Compare Registers
-    Opcode(0xC0, "CPY", "imm", 2, 2, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xC4, "CPY", "zpg", 2, 3, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xCC, "CPY", "abs", 3, 4, ["N", "Z", "C"], ["PC"]),
-    #
-    Opcode(0xE0, "CPX", "imm", 2, 2, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xE4, "CPX", "zpg", 2, 3, ["N", "Z", "C"], ["PC"]),
-    Opcode(0xEC, "CPX", "abs", 3, 4, ["N", "Z", "C"], ["PC"]),
-    # Load Registers
-    Opcode(0xA0, "LDY", "imm", 2, 2, ["N", "Z"], ["PC", "Y"]),
-    Opcode(0xA4, "LDY", "zpg", 2, 3, ["N", "Z"], ["PC", "Y"]),
-    Opcode(0xB4, "LDY", "zpg_x", 2, 3, ["N", "Z"], ["PC", "Y"]),
-    Opcode(0xAC, "LDY", "abs", 3, 4, ["N", "Z"], ["PC", "Y"]),
-    Opcode(0xBC, "LDY", "abs_x", 3, 4, ["N", "Z"], ["PC", "Y"]),
-    Opcode(0xA2, "LDX", "imm", 2, 2, ["N", "Z"], ["PC", "X"]),
-    Opcode(0xA6, "LDX", "zpg", 2, 3, ["N", "Z"], ["PC", "X"]),
-    Opcode(0xB6, "LDX", "zpg_y", 2, 3, ["N", "Z"], ["PC", "X"]),
-    Opcode(0xAE, "LDX", "abs", 3, 4, ["N", "Z"], ["PC", "X"]),
-    Opcode(0xBE, "LDX", "abs_y", 3, 4, ["N", "Z"], ["PC", "X"]),
-    # Store Registers
-    Opcode(0x84, "STY", "zpg", 2, 3, [], ["PC"]),
-    Opcode(0x94, "STY", "zpg_x", 2, 3, [], ["PC"]),
-    Opcode(0x8C, "STY", "abs", 3, 4, [], ["PC"]),
-    Opcode(0x86, "STX", "zpg", 2, 3, [], ["PC"]),
-    Opcode(0x96, "STX", "zpg_y", 2, 3, [], ["PC"]),
-    Opcode(0x8E, "STX", "abs", 3, 4, [], ["PC"]),
-    # Increment/Decrement
-    Opcode(0xE6, "INC", "zpg", 2, 4, ["N", "Z"], ["PC"]), # reduced cycles (4 instead of 5)
-    Opcode(0xF6, "INC", "zpg_x", 2, 4, ["N", "Z"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
-    Opcode(0xEE, "INC", "abs", 3, 5, ["N", "Z"], ["PC"]), # reduced by 1
-    Opcode(0xFE, "INC", "abs_x", 3, 5, ["N", "Z"], ["PC"]), # reduced by 2
-    #
-    Opcode(0xC6, "DEC", "zpg", 2, 4, ["N", "Z"], ["PC"]), # reduced cycles (4 instead of 5)
-    Opcode(0xD6, "DEC", "zpg_x", 2, 4, ["N", "Z"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
-    Opcode(0xCE, "DEC", "abs", 3, 5, ["N", "Z"], ["PC"]), # reduced by 1
-    Opcode(0xDE, "DEC", "abs_x", 3, 5, ["N", "Z"], ["PC"]), # reduced by 2
-    # Arithmetic Shift Left
-    Opcode(0x0A, "ASL", "acc", 1, 1, ["N", "Z", "C"], ["PC", "ACC"]), # reduced cycles (1 instead of 2)
-    Opcode(0x06, "ASL", "zpg", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced cycles (4 instead of 5)
-    Opcode(0x16, "ASL", "zpg_x", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
-    Opcode(0x0E, "ASL", "abs", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 1
-    Opcode(0x1E, "ASL", "abs_x", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 2
-    # Rotate Left
-    Opcode(0x2A, "ROL", "acc", 1, 1, ["N", "Z", "C"], ["PC", "ACC"]), # reduced cycles (1 instead of 2)
-    Opcode(0x26, "ROL", "zpg", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced cycles (4 instead of 5)
-    Opcode(0x36, "ROL", "zpg_x", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
-    Opcode(0x2E, "ROL", "abs", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 1
-    Opcode(0x3E, "ROL", "abs_x", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 2
-    # Logical Shift Right
-    Opcode(0x4A, "LSR", "acc", 1, 1, ["N", "Z", "C"], ["PC", "ACC"]), # reduced cycles (1 instead of 2)
-    Opcode(0x46, "LSR", "zpg", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced cycles (4 instead of 5)
-    Opcode(0x56, "LSR", "zpg_x", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
-    Opcode(0x4E, "LSR", "abs", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 1
-    Opcode(0x5E, "LSR", "abs_x", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 2
-    # Rotate Right
-    Opcode(0x6A, "ROR", "acc", 1, 1, ["N", "Z", "C"], ["PC", "ACC"]), # reduced cycles (1 instead of 2)
-    Opcode(0x66, "ROR", "zpg", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced cycles (4 instead of 5)
-    Opcode(0x76, "ROR", "zpg_x", 2, 4, ["N", "Z", "C"], ["PC"]), # reduced by 2 (-1 just like zpg) and (-1 for auto page crossing)
-    Opcode(0x6E, "ROR", "abs", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 1
-    Opcode(0x7E, "ROR", "abs_x", 3, 5, ["N", "Z", "C"], ["PC"]), # reduced by 2
-    # Set/Clear Flags
-    # TODO: make sure that flags are also handled correctly
-    Opcode(0x38, "SEC", "impl", 1, 1, ["C"], ["PC"]),  # cycles 2->1
-    Opcode(0x18, "CLC", "impl", 1, 1, ["C"], ["PC"]),  # cycles 2->1
-    Opcode(0x78, "SEI", "impl", 1, 1, ["I"], ["PC"]),  # cycles 2->1
-    Opcode(0x58, "CLI", "impl", 1, 1, ["I"], ["PC"]),  # cycles 2->1
-    Opcode(0xF8, "SED", "impl", 1, 1, ["D"], ["PC"]),  # cycles 2->1
-    Opcode(0xD8, "CLD", "impl", 1, 1, ["D"], ["PC"]),  # cycles 2->1
-    Opcode(0xB8, "CLV", "impl", 1, 1, ["V"], ["PC"]),  # cycles 2->1
-    # Increment Register
-    Opcode(0xE8, "INX", "impl", 1, 1, ["N", "Z"], ["PC", "X"]),  # reduced cycles (1 instead of 2)
-    Opcode(0xC8, "INY", "impl", 1, 1, ["N", "Z"], ["PC", "Y"]),  # reduced cycles (1 instead of 2)
-    # Decrement Register
-    Opcode(0xCA, "DEX", "impl", 1, 1, ["N", "Z"], ["PC", "X"]),  # reduced cycles (1 instead of 2)
-    Opcode(0x88, "DEY", "impl", 1, 1, ["N", "Z"], ["PC", "Y"]),  # reduced cycles (1 instead of 2)
-    # Stack
-    Opcode(0x08, "PHP", "impl", 1, 2, [], ["PC", "SP"]), # reduced cycles (2 instead of 3)
-    Opcode(0x48, "PHA", "impl", 1, 2, [], ["PC", "SP"]), # reduced cycles (2 instead of 3)
-    Opcode(0x68, "PLA", "impl", 1, 2, ["N", "Z"], ["PC", "SP", "ACC"]), # reduced cycles (2 instead of 4)
-    Opcode(0x28, "PLP", "impl", 1, 2, ["N", "V", "B", "D", "I", "Z", "C"], ["PC", "SP"]), # reduced cycles (2 instead of 4)
-    # Transfer instructions
-    Opcode(0xAA, "TAX", "impl", 1, 1, ["N", "Z"], ["PC", "X"]),  # reduced cycles (1 instead of 2)
-    Opcode(0xA8, "TAY", "impl", 1, 1, ["N", "Z"], ["PC", "Y"]),  # reduced cycles (1 instead of 2)
-    Opcode(0x8A, "TXA", "impl", 1, 1, ["N", "Z"], ["PC", "ACC"]),  # reduced cycles (1 instead of 2)
-    Opcode(0x98, "TYA", "impl", 1, 1, ["N", "Z"], ["PC", "ACC"]),  # reduced cycles (1 instead of 2)
-    Opcode(0xBA, "TSX", "impl", 1, 1, ["N", "Z"], ["PC", "X"]),  # reduced cycles (1 instead of 2)
-    Opcode(0x9A, "TXS", "impl", 1, 1, [], ["PC", "SP"]),  # reduced cycles (1 instead of 2)
-    # Jumps
-    Opcode(0x4C, "JMP", "abs", 3, 3, [], ["PC"]),
-    Opcode(0x6C, "JMP", "ind", 3, 5, [], ["PC"]), # reduced cycles to 4
-    # Interrupts
-    # TODO: on C6502 D Flag is cleared additionally
-    # TODO: set I flag (masswerk says no, most other sites say yes) -> do it
-    Opcode(0x00, "BRK", "impl", 2, 6, ["I"], ["PC", "SP"]), # reduced cycles (7 -> 6)
-    Opcode(0x40, "RTI", "impl", 1, 4, ["N", "V", "B", "D", "I", "Z", "C"], ["PC", "SP"]),
-    # Subroutines
-    Opcode(0x20, "JSR", "abs", 3, 5, [], ["PC", "SP"]),
-    Opcode(0x60, "RTS", "impl", 1, 3, [], ["PC", "SP"]), # reduced cycles (6 -> 3)
-    # Branches
-    Opcode(0x10, "BPL", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
-    Opcode(0x30, "BMI", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
-    Opcode(0x50, "BVC", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
-    Opcode(0x70, "BVS", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
-    Opcode(0x90, "BCC", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
-    Opcode(0xB0, "BCS", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
-    Opcode(0xD0, "BNE", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
-    Opcode(0xF0, "BEQ", "rel", 2, 1, [], ["PC"]), # when not branching: reduced cycles (2 -> 1) when branching: 2 cycles (instead of 3-4)
-    # Bit
-    Opcode(0x24, "BIT", "zpg", 2, 3, ["N", "V", "Z"], ["PC"]),
-    Opcode(0x2C, "BIT", "abs", 3, 4, ["N", "V", "Z"], ["PC"]),
-
-
-    # NOP
-    Opcode(0xEA, "NOP", "impl", 1, 2, [], ["PC"]),
-    # Illegal instruction used in testbench to mark end of program
-    Opcode(0x04, "END", "impl", 1, 1, [], []),
-]
+from alu_tables import FLAG_BITS, adc, compare, sbc
+from asm6502 import assemble_file
+from bus_model import BusModel
+from bus_trace import BusTraceWriter
+from cpi import CPIStats, format_report, nmos_cycles, write_report
+from expected_trace import pack_status, read_trace, trace_for, unpack_status
+from golden_model import RESET_CYCLES, CPUModel
+from loader import PROGRAM_EXTENSIONS, load_image
+from memory import Memory
+from opcode_coverage import CoverageCollector, page_crossed
+from opcodes import BRANCH_CONDITIONS, INVALID_OPCODE, build_dispatch_table
+from profiler import BOOKKEEPING, SAMPLE, VALIDATION, PhaseProfiler
+from profiler import format_report as format_profile, write_report as write_profile
+from replay import FAILURE_FILE, read_failure, write_failure
+from trace_log import TRACE_CYCLE, TRACE_LEVELS, TraceLog
+
+# Trace of the executed instructions, buffered and printed when a check fails (see trace_log.py)
+# TRACE_LEVEL "none", "instruction" or "cycle" (adds every bus cycle)
+TRACE_LEVEL = os.environ.get("TRACE_LEVEL", "instruction")
+# Print every record when it is recorded
+TRACE_ECHO = os.environ.get("TRACE_ECHO", "0") == "1"
+# Binary file receiving all records (python trace_log.py <file> prints it)
+TRACE_FILE = os.environ.get("TRACE_FILE")
+# Binary file receiving every bus transaction (see bus_trace.py), empty to disable
+BUS_TRACE_FILE = os.environ.get("BUS_TRACE_FILE", "")
+# Program image (.bin loaded at address 0, .hex, .seg or .65s source), set by the Makefile / regress.py
+PROGRAM = os.environ.get("PROGRAM", "test.bin")
+# Several programs run one after another in the same simulation (os.pathsep separated files or directories of images),
+# every program is a test of its own. Replaces PROGRAM when set.
+PROGRAMS = os.environ.get("PROGRAMS", "")
+# "delta": compare the expected writes of an instruction with the writes seen on the bus
+# "full": additionally compare all 65536 addresses after every instruction (slow)
+MEMORY_CHECK = "delta"
+# Reference the DUT is compared with after every instruction (registers, flags, cycles and writes)
+# "trace": expected trace generated once by the golden model and cached in expected_trace.TRACE_CACHE_DIR
+# "model": step the golden model in lockstep with the DUT
+# None: validators only
+REFERENCE = "trace"
+# Run the per-opcode validators as well. The reference already checks registers, flags, cycles and writes,
+# so they are off by default when a REFERENCE is set (RUN_VALIDATORS=1 runs both, e.g. to debug the model)
+RUN_VALIDATORS = os.environ.get("RUN_VALIDATORS", "0" if REFERENCE else "1") == "1"
+# Waveform capture, set by the Makefile
+# WAVE_MODE "off": cpu.v is built without dump code, "full": dump everything,
+# "window": dump the instructions WAVE_WINDOW="first:last" (indices of executed instructions, inclusive)
+WAVE_MODE = os.environ.get("WAVE_MODE", "off")
+WAVE_WINDOW = os.environ.get("WAVE_WINDOW", "")
+# Number of instructions before a failure that are replayed with waves and cycle trace (see replay.py)
+REPLAY_INSTRUCTIONS = int(os.environ.get("REPLAY_INSTRUCTIONS", "20"))
+# failure.json of the run that is replayed, set by replay.py
+REPLAY_FILE = os.environ.get("REPLAY_FILE")
+# Cycles per instruction by opcode compared with the original 6502 (see cpi.py), empty to disable
+CPI_REPORT = os.environ.get("CPI_REPORT", "cpi_report.json")
+# Functional coverage of the executed instructions (see opcode_coverage.py), empty to disable
+COVERAGE_FILE = os.environ.get("COVERAGE_FILE", "opcode_coverage.npz")
+# Wall time of the testbench split into phases per opcode (see profiler.py), empty to disable
+PROFILE_FILE = os.environ.get("PROFILE_FILE", "")
+# Simulator selected by the Makefile (icarus or verilator), the key of the sim_speed entries
+SIM = os.environ.get("SIM", "icarus")
+# Cycles/second of the last run per simulator, one file per program (like the other per-program outputs)
+SIM_SPEED_FILE = os.environ.get("SIM_SPEED_FILE", "sim_speed.json")
+
 
 def matches_mask(value, mask):
     """
@@ -235,961 +90,956 @@ def matches_mask(value, mask):
 
     return True
 
-@cocotb.test()
-async def cpu_minimal_test(dut):
-    """
-    Test that acts as external memory for 'cpu.v'.
-    instructions are stored in a Python array. The CPU fetches them
-    via addr, data_in, R/W
-    """
-    async def runCycles(cycles):
-        for cycle in range(cycles):
-            # Wait for rising edge
-            await RisingEdge(dut.clk)
-
-            # Insert a tiny time delay to exit read-only phase
-            # so we can safely write to dut.data_in
-            await Timer(1, units="ns")
-
-            if DEBUG:
-                print(f"{op}: cycle: {cycle}, state: {dut.state.value}")
-                print(
-                    f"CPU State: PC={dut.PC.value} IR={hex(dut.IR.value)} ACC={dut.ACC.value} X={dut.X.value} Y={dut.Y.value}"
-                )
-                print(
-                    f"Status Register: N={dut.N.value} V={dut.V.value} Z={dut.Z.value} C={dut.C.value}"
-                )
-                print("")
-
-            address = dut.addr.value.integer
-
-            # If CPU is reading
-            if (dut.RW.value == 1):
-                if address < 65536:
-                    dut.data_in.value = mem[address]
-                else:
-                    dut.data_in.value = 0xFF # Return 0xFF if address is out of bounds
-            # If CPU is writing, store data_out into mem
-            elif (dut.RW.value == 0):
-                if address < 65536:
-                    mem[address] = dut.data_out.value.integer
-
-    # Create a clock (1 us period = 1MHz)
-    cocotb.start_soon(Clock(dut.clk, 1000, units="ns").start())
-
-    mem = [0xFF] * 65536
-
-    with open('test.bin', 'rb') as f:
-        binary_data = f.read()
-        for i in range(len(binary_data)):
-            mem[i] = binary_data[i]
-
-    # # Memory array for code + data
-    # mem = [0] * 65536
 
-    # # Program code
-    # mem[0] = 0xE6 # INC zpg
-    # mem[1] = 0x0A
-    # mem[2] = 0xA9  # LDA
-    # mem[3] = 0x60
-    # mem[4] = 0x06 # ASL
-    # mem[5] = 0x0A
-    # mem[0x0A] = 0x05
-
-    # STACK: mem[0100] ... mem[01FF] (growing top to bottom)
-    # $FFFA, $FFFB ... NMI (Non-Maskable Interrupt) vector
-    # $FFFC, $FFFD ... RES (Reset) vector
-    # $FFFE, $FFFF ... IRQ (Interrupt Request) vector
-
-    # Initialize signals
-    dut.reset_n.value = 0
-    dut.RDY.value = 1
+def parse_wave_window(window):
+    """
+    Parse a WAVE_WINDOW setting.
 
-    # Wait a few clock cycles with reset=0
-    for _ in range(5):
-        await RisingEdge(dut.clk)
-    did_reset = True
-    dut.reset_n.value = 1
+    :param window: "first:last" instruction indices, either side may be empty (start / end of the program).
+    :return: (first, last), last is None for no end.
+    """
+    first, sep, last = window.partition(":")
+    if not sep:
+        raise ValueError(f"WAVE_WINDOW must be first:last, got '{window}'")
+    return (int(first) if first else 0, int(last) if last else None)
+
+
+# Registers and flags sampled from the DUT, in the order they are packed into the CPU's snapshot vector (MSB first)
+STATE_FIELDS = (
+    ("PC", 16),
+    ("ACC", 8),
+    ("SP", 8),
+    ("X", 8),
+    ("Y", 8),
+    ("N", 1),
+    ("V", 1),
+    ("B", 1),
+    ("D", 1),
+    ("I", 1),
+    ("Z", 1),
+    ("C", 1),
+)
+
+
+class StateSampler:
+    """
+    Reads all registers and flags of the DUT in one pass.
 
-    # Iterate through Program code and execute every instruction and test the results
+    The signal handles are looked up once. If the CPU exposes the packed
+    `snapshot` vector, a sample is a single simulator read that is unpacked
+    in Python, otherwise every register is read from its cached handle.
+    """
 
-    print("########################### START PROGRAM ###########################")
-    mem_index = 0x0600
-    # TODO: this needs to be adjusted in the jump test cases
-    while mem_index < len(mem):
-        # Capture previous values
-        previous_values = {
-            "PC": int(dut.PC.value),
-            "ACC": int(dut.ACC.value),
-            "SP": int(dut.SP.value),
-            "X": int(dut.X.value),
-            "Y": int(dut.Y.value),
-            "N": int(dut.N.value),
-            "V": int(dut.V.value),
-            "B": int(dut.B.value),
-            "D": int(dut.D.value),
-            "I": int(dut.I.value),
-            "Z": int(dut.Z.value),
-            "C": int(dut.C.value),
-        }
-        previous_mem = copy.deepcopy(mem)
-
-        opcode_addr = mem_index
-        opcode = mem[opcode_addr]
-        nmi_addr = (mem[0xFFFB] << 8) + mem[0xFFFA]
-        res_addr = (mem[0xFFFD] << 8) + mem[0xFFFC]
-        irq_addr = (mem[0xFFFF] << 8) + mem[0xFFFE]
-
-        # Figure out addressing TODO: remove??
-        # if matches_mask(opcode, "???011??"):  # Absoulte
-        #     addressed_value = (mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1]
-        # elif matches_mask(opcode, "???001??"):  # Zero Page
-        #     addressed_value = mem[opcode_addr + 1]
-        # else:
-        #     assert False, "Invalid addressing mode"
-
-        # Get opcode from opcode_list
-        op = next((op for op in opcode_list if op.opcode == opcode), None)
-        if op is None:
-            assert False, f"Invalid opcode {hex(opcode)} found at address {opcode_addr}"
-            # print(f"Invalid opcode {hex(opcode)} found at address {opcode_addr}")
-            # continue
-
-        if op.addressing == "impl":
-            addressed_value = None
-            target_addr = None
-        elif op.addressing == "acc":
-            addressed_value = previous_values["ACC"]
-            target_addr = None
-        elif op.addressing == "imm":
-            target_addr = opcode_addr + 1
-        elif op.addressing == "abs":
-            target_addr = (mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1]
-        elif op.addressing == "zpg":
-            target_addr = mem[opcode_addr + 1]
-        elif op.addressing == "abs_x":
-            target_addr = ((mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1] + dut.X.value)
-        elif op.addressing == "abs_y":
-            target_addr = ((mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1] + dut.Y.value)
-        elif op.addressing == "zpg_x":
-            target_addr = (mem[opcode_addr + 1] + dut.X.value) & 0xFF
-        elif op.addressing == "zpg_y":
-            target_addr = (mem[opcode_addr + 1] + dut.Y.value) & 0xFF
-        elif op.addressing == "ind":
-            # Indirect addressing (only used for JMP)
-            # Get the low byte of the target address from the instruction
-            low_byte = mem[opcode_addr + 1]
-            # Get the high byte of the target address from the instruction
-            high_byte = mem[opcode_addr + 2]
-            # Combine the low and high bytes to get the target address
-            target_addr = (high_byte << 8) + low_byte
-        elif op.addressing == "ind_x":
-            # Indirect addressing (X-indexed)
-            # Get the zero page address from the instruction
-            zpg_addr = (mem[opcode_addr + 1] + dut.X.value) & 0xFF
-            # Get the low byte of the target address from the zero page
-            low_byte = mem[zpg_addr]
-            # Get the high byte of the target address from the zero page
-            high_byte = mem[zpg_addr + 1]
-            # Combine the low and high bytes to get the target address
-            target_addr = (high_byte << 8) + low_byte
-        elif op.addressing == "ind_y":
-            # Indirect addressing (Y-indexed)
-            # Get the zero page address from the instruction
-            zpg_addr = mem[opcode_addr + 1]
-            # Get the low byte of the target address from the zero page
-            low_byte = mem[zpg_addr]
-            # Get the high byte of the target address from the zero page
-            high_byte = mem[zpg_addr + 1]
-            # Combine the low and high bytes to get the target address
-            target_addr = (high_byte << 8) + low_byte + dut.Y.value
-        elif op.addressing == "rel":
-            # Relative addressing
-            # Get the relative offset from the instruction
-            offset = mem[opcode_addr + 1]
-            # Do signed conversion
-            if offset > 127:
-                offset = offset - 256
-            # if offset & 0x80:
-                # offset = -((~offset & 0xFF) + 1)
-
-            # Calculate the target address by adding the offset to the program counter
-            target_addr = opcode_addr + op.bytes + offset
-        else:
-            assert False, "Invalid addressing mode"
+    def __init__(self, dut):
+        try:
+            self.snapshot = dut.snapshot
+        except AttributeError:
+            self.snapshot = None
+        self.handles = [(name, getattr(dut, name)) for name, _ in STATE_FIELDS]
+        # (name, shift, mask) to unpack the snapshot vector
+        self.layout = []
+        shift = sum(width for _, width in STATE_FIELDS)
+        for name, width in STATE_FIELDS:
+            shift -= width
+            self.layout.append((name, shift, (1 << width) - 1))
+
+    def sample(self):
+        """
+        :return: dict mapping register/flag names to their current integer values.
+        """
+        if self.snapshot is not None:
+            packed = self.snapshot.value.integer
+            return {name: (packed >> shift) & mask for name, shift, mask in self.layout}
+        return {name: int(handle.value) for name, handle in self.handles}
+
+
+class InstructionCheck:
+    """
+    State of a single executed instruction that is handed to its validator.
 
-        if target_addr is not None:
-            addressed_value = mem[target_addr]
+    Holds the register/flag values and memory before and after the
+    instruction, the resolved operand and collects the registers and flags
+    the validator has verified.
+    """
 
-        # Run for cycles specified by the opcode
-        needed_cycles = op.cycles
-        if did_reset:
-            # Reset cycles (ST_RESET -> ST_FETCH_OPERAND_LOW -> ST_FETCH_OPERAND_HIGH -> ST_EXEC (indcludes fetch for next operation))
-            needed_cycles = needed_cycles + 3
-            did_reset = False
+    def __init__(self, op, opcode_addr, previous_values, current_values, previous_mem, mem, target_addr, addressed_value):
+        self.op = op
+        self.opcode_addr = opcode_addr
+        self.previous_values = previous_values
+        self.current_values = current_values  # StateSampler sample taken after the instruction
+        self.previous_mem = previous_mem
+        self.mem = mem
+        self.target_addr = target_addr
+        self.addressed_value = addressed_value
+        self.verified_regs = []
+        self.verified_flags = []
+        self.next_addr = opcode_addr + op.bytes  # address of the next instruction (changed by jumps)
+
+    def check_unaffected(self):
+        # Check that unaffected registers/flags have not changed
+        for key, previous_value in self.previous_values.items():
+            # Skip affected registers/flags
+            if key not in self.op.affected_flags and key not in self.op.affected_regs:
+                current_value = self.current_values[key]
+                assert (
+                    previous_value == current_value
+                ), f"{key} changed unexpectedly should have stayed {hex(previous_value)} but got {hex(current_value)}"
 
-        await runCycles(needed_cycles)
+    def verify_attr(self, reg, expected_value, verified_array):
+        if self.current_values[reg] != expected_value:
+            assert (
+                False
+            ), f"{reg} should have been {hex(expected_value)} but got {hex(self.current_values[reg])}"
+        verified_array.append(reg)
 
-        # Move to next opcode
-        mem_index = mem_index + op.bytes # TODO: different for jump and branch instructions
+    def verify_reg(self, reg, expected_value):
+        self.verify_attr(reg, expected_value, self.verified_regs)
 
-        def check_unaffected(previous_values, affected_flags, affected_regs):
-            # Check that unaffected registers/flags have not changed
-            for key, previous_value in previous_values.items():
-                # Skip affected registers/flags
-                if key not in affected_flags and key not in affected_regs:
-                    current_value = getattr(dut, key).value
-                    assert (
-                        previous_value == current_value
-                    ), f"{key} changed unexpectedly should have stayed {hex(previous_value)} but got {hex(current_value)}"
+    def verify_flag(self, flag, expected_value):
+        self.verify_attr(flag, expected_value, self.verified_flags)
 
-        def verify_attr(reg, expected_value, verified_array):
-            if getattr(dut, reg).value != expected_value:
+    def verify_memory(self, expected_mem):
+        mem = self.mem
+        expected_writes = expected_mem.expected_writes()
+        # Every address written on the bus during this instruction has to be an expected write
+        for addr in sorted(mem.touched()):
+            if addr not in expected_writes:
                 assert (
                     False
-                ), f"{reg} should have been {hex(expected_value)} but got {hex(getattr(dut, reg).value)}"
-            verified_array.append(reg)
-
-        def verify_memory(expected_mem, mem):
-            for addr, val in enumerate(expected_mem):
-                if mem[addr] != val:
+                ), f"Unexpected write to address {hex(addr)}: wrote {hex(mem[addr])}, was {hex(self.previous_mem[addr])}"
+        for addr, val in expected_writes.items():
+            if addr not in mem.touched():
+                assert (
+                    False
+                ), f"Missing write to address {hex(addr)}: expected {hex(val)}"
+            if mem[addr] != val:
+                assert (
+                    False
+                ), f"Memory mismatch at address {hex(addr)}: expected {hex(val)}, got {hex(mem[addr])}"
+        if MEMORY_CHECK == "full":
+            for addr in range(len(mem)):
+                if mem[addr] != expected_mem[addr]:
                     assert (
                         False
-                    ), f"Memory mismatch at address {hex(addr)}: expected {hex(val)}, got {hex(mem[addr])}"
-                else:
-                    mem[addr] = val
-            # # overwrite memory with expected memory
-            # mem = copy.deepcopy(expected_mem)
-
-        verified_regs = []
-        verified_flags = []
-        if op.name == "ORA":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            expected_acc = (previous_values["ACC"] | addressed_value)
-            verify_attr("ACC", expected_acc, verified_regs)
-            verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_acc == 0, verified_flags)
-
-        elif op.name == "AND":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            expected_acc = previous_values["ACC"] & addressed_value
-            verify_attr("ACC", expected_acc, verified_regs)
-            verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_acc == 0, verified_flags)
-
-        elif op.name == "EOR":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            expected_acc = previous_values["ACC"] ^ addressed_value
-            verify_attr("ACC", expected_acc, verified_regs)
-            verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_acc == 0, verified_flags)
-
-        elif op.name == "ADC":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            if previous_values["D"]:
-                # BCD mode addition
-                acc = previous_values["ACC"]
-                operand = addressed_value
-                carry_in = previous_values["C"]
-
-                lo_nibble = (acc & 0x0F) + (operand & 0x0F) + carry_in
-                if lo_nibble > 9:
-                    lo_nibble += 6
-
-                hi_nibble = (acc >> 4) + (operand >> 4) + (lo_nibble > 0x0F)
-                if hi_nibble > 9:
-                    hi_nibble += 6
-                    expected_carry = 1
-                else:
-                    expected_carry = 0
-
-                expected_acc = ((hi_nibble << 4) | (lo_nibble & 0x0F)) & 0xFF
-
-                verify_attr("ACC", expected_acc, verified_regs)
-                verify_attr("C", expected_carry, verified_flags)
-                verify_attr("Z", expected_acc == 0, verified_flags)
-                verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-                # in decimal mode V is undefined (actually on original 6502 it is not always 0 but datasheet says undefined)
-                verify_attr("V", 0, verified_flags)
-            else:
-                # Verify ACC
-                expected_acc = (previous_values["ACC"] + addressed_value + previous_values["C"]) & 0xFF
-                verify_attr("ACC", expected_acc, verified_regs)
-
-                verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-                verify_attr("Z", expected_acc == 0, verified_flags)
-
-                expected_carry = (
-                    previous_values["ACC"] + addressed_value + previous_values["C"]
-                ) > 0xFF
-                verify_attr("C", expected_carry, verified_flags)
-
-                # Verify Overflow flag # TODO: compare with simulator
-                sign_bit = 0x80  # Mask for the sign bit
-                operand_sign = (addressed_value & sign_bit) != 0
-                acc_sign = (previous_values["ACC"] & sign_bit) != 0
-                result_sign = (expected_acc & sign_bit) != 0
-
-                # Overflow occurs if the signs of the two operands are the same, but the result's sign is different.
-                expected_overflow = (operand_sign == acc_sign) and (result_sign != acc_sign)
-                verify_attr("V", expected_overflow, verified_flags)
-
-        elif op.name == "SBC":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            if previous_values["D"]:
-                # BCD mode subtraction
-                acc = previous_values["ACC"]
-                operand = addressed_value
-                borrow = (~previous_values["C"] & 1)
-
-                lo_nibble = (acc & 0x0F) - (operand & 0x0F) - borrow
-                if lo_nibble < 0:
-                    lo_nibble -= 6
-
-                hi_nibble = (acc >> 4) - (operand >> 4) - (lo_nibble < 0)
-                if hi_nibble < 0:
-                    hi_nibble -= 6
-                    expected_carry = 0
-                else:
-                    expected_carry = 1
-
-                expected_acc = ((hi_nibble << 4) | (lo_nibble & 0x0F)) & 0xFF
-                verify_attr("ACC", expected_acc, verified_regs)
-                verify_attr("C", expected_carry, verified_flags)
-                verify_attr("Z", expected_acc == 0, verified_flags)
-                verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-                # in decimal mode V is undefined (actually on original 6502 it is not always 0 but datasheet says undefined)
-                verify_attr("V", 0, verified_flags)
-            else:
-                result = (
-                    previous_values["ACC"] - addressed_value - (~previous_values["C"] & 1)
-                )
-                # Check if borrow occurred
-                if result < 0:
-                    expected_carry = 0 # Borrow occured -> unset carry
-                    result += 256 # Wrap around to simulate 8-bit unsigned subtraction
-                else:
-                    expected_carry = 1  # No borrow -> set carry
-
-                expected_acc = result & 0xFF  # Mask to 8 bits
-                verify_attr("ACC", expected_acc, verified_regs)
+                    ), f"Memory mismatch at address {hex(addr)}: expected {hex(expected_mem[addr])}, got {hex(mem[addr])}"
 
-                verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-                verify_attr("Z", expected_acc == 0, verified_flags)
-                verify_attr("C", expected_carry, verified_flags)
+    def verify_unchanged(self):
+        """Shortcut for instructions that neither write memory nor touch unaffected registers."""
+        self.verify_memory(self.previous_mem)
+        self.check_unaffected()
 
-                # Overflow flag is set if there is a signed overflow
-                sign_bit = 0x80  # Mask for the sign bit
-                operand_sign = (addressed_value & sign_bit) != 0
-                acc_sign = (previous_values["ACC"] & sign_bit) != 0
-                result_sign = (expected_acc & sign_bit) != 0
+    def status_byte(self):
+        # Status register as pushed by BRK and PHP
+        previous_values = self.previous_values
+        return (
+            (previous_values["N"] << 7) |
+            (previous_values["V"] << 6) |
+            (1 << 5) |  # Ignore flag (TODO: check if this is correct)
+            (1 << 4) |  # Break flag
+            (previous_values["D"] << 3) |
+            (previous_values["I"] << 2) |
+            (previous_values["Z"] << 1) |
+            (previous_values["C"] << 0)
+        )
 
-                # Overflow occurs if the signs of the two operands are the same, but the result's sign is different.
-                expected_overflow = (operand_sign == acc_sign) and (result_sign != acc_sign)
-                verify_attr("V", expected_overflow, verified_flags)
+    def verify_pulled_status(self, expected_status):
+        # Flags restored by PLP and RTI (B is not stored in the status register)
+        self.verify_flag("N", (expected_status & 0b10000000) != 0)
+        self.verify_flag("V", (expected_status & 0b01000000) != 0)
+        self.verify_flag("B", self.previous_values["B"])
+        self.verify_flag("D", (expected_status & 0b00001000) != 0)
+        self.verify_flag("I", (expected_status & 0b00000100) != 0)
+        self.verify_flag("Z", (expected_status & 0b00000010) != 0)
+        self.verify_flag("C", (expected_status & 0b00000001) != 0)
 
-        elif op.name == "STA":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    def verify_nz(self, value):
+        self.verify_flag("N", (value & 0x80) != 0)
+        self.verify_flag("Z", value == 0)
 
-            expected_mem = copy.deepcopy(previous_mem)
-            expected_mem[target_addr] = previous_values["ACC"]
-            verify_memory(expected_mem, mem)
+    def verify_status(self, status, flags):
+        # Flags of a status byte from the reference ALU tables
+        for flag in flags:
+            self.verify_flag(flag, (status >> FLAG_BITS[flag]) & 1)
 
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
 
-        elif op.name == "LDA":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+# ########## Validators ##########
+# One function per instruction, called with the InstructionCheck of the executed instruction
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def validate_ora(chk):
+    chk.verify_unchanged()
 
-            expected_acc = addressed_value
-            verify_attr("ACC", expected_acc, verified_regs)
-            verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_acc == 0, verified_flags)
+    expected_acc = (chk.previous_values["ACC"] | chk.addressed_value)
+    chk.verify_reg("ACC", expected_acc)
+    chk.verify_nz(expected_acc)
 
-        elif op.name == "CMP":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def validate_and(chk):
+    chk.verify_unchanged()
 
-            result = previous_values["ACC"] - addressed_value
-            # Wrap around for negative values
-            if result < 0:
-                result += 256  # Wrap around to simulate 8-bit unsigned subtraction
+    expected_acc = chk.previous_values["ACC"] & chk.addressed_value
+    chk.verify_reg("ACC", expected_acc)
+    chk.verify_nz(expected_acc)
 
-            verify_attr("N", (result & 0x80) != 0, verified_flags)
-            verify_attr("Z", result == 0, verified_flags)
-            verify_attr("C", previous_values["ACC"] >= addressed_value, verified_flags)
 
-        elif op.name == "CPY":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def validate_eor(chk):
+    chk.verify_unchanged()
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    expected_acc = chk.previous_values["ACC"] ^ chk.addressed_value
+    chk.verify_reg("ACC", expected_acc)
+    chk.verify_nz(expected_acc)
 
-            result = previous_values["Y"] - addressed_value
-            # Wrap around for negative values
-            if result < 0:
-                result += 256  # Wrap around to simulate 8-bit unsigned subtraction
 
-            verify_attr("N", (result & 0x80) != 0, verified_flags)
-            verify_attr("Z", result == 0, verified_flags)
-            verify_attr("C", previous_values["Y"] >= addressed_value, verified_flags)
+def verify_arithmetic(chk, alu):
+    # ADC and SBC in binary and BCD mode, expected values from the reference ALU tables (see alu_tables.py).
+    # In decimal mode V is undefined (actually on original 6502 it is not always 0 but datasheet says undefined),
+    # the design clears it.
+    previous_values = chk.previous_values
 
-        elif op.name == "CPX":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    chk.verify_unchanged()
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    expected_acc, status = alu(previous_values["ACC"], chk.addressed_value, previous_values["C"], previous_values["D"])
+    chk.verify_reg("ACC", expected_acc)
+    chk.verify_status(status, ("N", "Z", "C", "V"))
 
-            result = previous_values["X"] - addressed_value
-            # Wrap around for negative values
-            if result < 0:
-                result += 256  # Wrap around to simulate 8-bit unsigned subtraction
 
-            verify_attr("N", (result & 0x80) != 0, verified_flags)
-            verify_attr("Z", result == 0, verified_flags)
-            verify_attr("C", previous_values["X"] >= addressed_value, verified_flags)
+def validate_adc(chk):
+    verify_arithmetic(chk, adc)
 
-        elif op.name == "TAX":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def validate_sbc(chk):
+    verify_arithmetic(chk, sbc)
 
-            expected_x = previous_values["ACC"]
-            verify_attr("X", expected_x, verified_regs)
-            verify_attr("N", (expected_x & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_x == 0, verified_flags)
 
-        elif op.name == "TAY":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def store_validator(reg):
+    # STA, STX, STY: store a register at the target address
+    def validate_store(chk):
+        expected_mem = chk.previous_mem.overlay()
+        expected_mem[chk.target_addr] = chk.previous_values[reg]
+        chk.verify_memory(expected_mem)
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+        chk.check_unaffected()
+    return validate_store
 
-            expected_y = previous_values["ACC"]
-            verify_attr("Y", expected_y, verified_regs)
-            verify_attr("N", (expected_y & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_y == 0, verified_flags)
 
-        elif op.name == "TXA":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def load_validator(reg):
+    # LDA, LDX, LDY: load the addressed value into a register
+    def validate_load(chk):
+        chk.verify_unchanged()
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+        expected_value = chk.addressed_value
+        chk.verify_reg(reg, expected_value)
+        chk.verify_nz(expected_value)
+    return validate_load
 
-            expected_acc = previous_values["X"]
-            verify_attr("ACC", expected_acc, verified_regs)
-            verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_acc == 0, verified_flags)
 
-        elif op.name == "TYA":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def compare_validator(reg):
+    # CMP, CPX, CPY: subtract the addressed value from a register without storing the result
+    def validate_compare(chk):
+        chk.verify_unchanged()
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+        _, status = compare(chk.previous_values[reg], chk.addressed_value)
+        chk.verify_status(status, ("N", "Z", "C"))
+    return validate_compare
 
-            expected_acc = previous_values["Y"]
-            verify_attr("ACC", expected_acc, verified_regs)
-            verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_acc == 0, verified_flags)
 
-        elif op.name == "TSX":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def transfer_validator(source, destination, affects_flags=True):
+    # TAX, TAY, TXA, TYA, TSX, TXS: copy one register into another
+    def validate_transfer(chk):
+        chk.verify_unchanged()
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+        expected_value = chk.previous_values[source]
+        chk.verify_reg(destination, expected_value)
+        if affects_flags:
+            chk.verify_nz(expected_value)
+    return validate_transfer
 
-            expected_x = previous_values["SP"]
-            verify_attr("X", expected_x, verified_regs)
-            verify_attr("N", (expected_x & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_x == 0, verified_flags)
 
-        elif op.name == "TXS":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def step_validator(reg, step):
+    # INX, INY, DEX, DEY: increment or decrement a register (wraps around)
+    def validate_step(chk):
+        chk.verify_unchanged()
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+        expected_value = (chk.previous_values[reg] + step) & 0xFF
+        chk.verify_reg(reg, expected_value)
+        chk.verify_nz(expected_value)
+    return validate_step
 
-            expected_sp = previous_values["X"]
-            verify_attr("SP", expected_sp, verified_regs)
 
-        elif op.name == "LDY":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def memory_step_validator(step):
+    # INC, DEC: increment or decrement the target address (wraps around)
+    def validate_memory_step(chk):
+        expected_mem = chk.previous_mem.overlay()
+        expected_value = (chk.addressed_value + step) & 0xFF
+        expected_mem[chk.target_addr] = expected_value
+        chk.verify_memory(expected_mem)
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+        chk.check_unaffected()
 
-            expected_y = addressed_value
-            verify_attr("Y", expected_y, verified_regs)
-            verify_attr("N", (expected_y & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_y == 0, verified_flags)
+        chk.verify_nz(expected_value)
+    return validate_memory_step
 
-        elif op.name == "LDX":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def flag_validator(flag, value):
+    # SEC, CLC, SEI, CLI, SED, CLD, CLV
+    def validate_flag(chk):
+        chk.verify_unchanged()
 
-            expected_x = addressed_value
-            verify_attr("X", expected_x, verified_regs)
-            verify_attr("N", (expected_x & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_x == 0, verified_flags)
+        chk.verify_flag(flag, value)
+    return validate_flag
 
-        elif op.name == "STY":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
 
-            expected_mem = copy.deepcopy(previous_mem)
-            expected_mem[target_addr] = previous_values["Y"]
-            verify_memory(expected_mem, mem)
+def shift_validator(shift):
+    # ASL, ROL, LSR, ROR on the accumulator or the target address
+    # shift(value, carry_in) returns (result, carry_out)
+    def validate_shift(chk):
+        shifted_value, expected_carry = shift(chk.addressed_value, chk.previous_values["C"])
 
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+        if chk.op.addressing == "acc":
+            chk.verify_reg("ACC", shifted_value)
+            chk.verify_memory(chk.previous_mem)
+        else:
+            expected_mem = chk.previous_mem.overlay()
+            expected_mem[chk.target_addr] = shifted_value
+            chk.verify_memory(expected_mem)
 
-        elif op.name == "STX":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+        chk.check_unaffected()
+        chk.verify_flag("C", expected_carry)
+        chk.verify_nz(shifted_value)
+    return validate_shift
+
+
+def validate_brk(chk):
+    # TODO: varying cycle count
+    previous_values = chk.previous_values
+    mem = chk.mem
 
-            expected_mem = copy.deepcopy(previous_mem)
-            expected_mem[target_addr] = previous_values["X"]
-            verify_memory(expected_mem, mem)
+    # if previous_values["I"] == 1:
+    #     verify_memory(previous_mem, mem)
+    #     check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    #     verify_attr("PC", previous_values["PC"] + 2, verified_regs)
+    #     verify_attr("SP", previous_values["SP"], verified_regs)
+    # else:
+    expected_mem = chk.previous_mem.overlay()
+    expected_mem[previous_values["SP"]] = (previous_values["PC"] + 2) >> 8 # PCH
+    expected_mem[(previous_values["SP"] - 1) & 0xFF] = (previous_values["PC"] + 2) & 0xFF # PCL
+    expected_mem[(previous_values["SP"] - 2) & 0xFF] = chk.status_byte() # STATUS
 
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    chk.verify_memory(expected_mem)
 
-        elif op.name == "INC":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    chk.check_unaffected()
+    chk.verify_flag("I", 1)
+    chk.verify_reg("SP", (previous_values["SP"] - 3) & 0xFF)
+    irq_addr = (mem[0xFFFF] << 8) + mem[0xFFFE]
+    expected_pc = irq_addr
+    chk.verify_reg("PC", expected_pc)
+    chk.next_addr = expected_pc
 
-            expected_mem = copy.deepcopy(previous_mem)
-            incremented_value = (addressed_value + 1) & 0xFF
-            expected_mem[target_addr] = incremented_value
-            verify_memory(expected_mem, mem)
 
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def validate_rti(chk):
+    previous_values = chk.previous_values
+    mem = chk.mem
 
-            verify_attr("N", (incremented_value & 0x80) != 0, verified_flags)
-            verify_attr("Z", incremented_value == 0, verified_flags)
+    # cpu.v pulls with addr <= SP + 1 (16 bit), only SP wraps: with SP = 0xFF the first pull reads 0x0100
+    sp = previous_values["SP"]
+    expected_status = mem[sp + 1]
+    expected_pc = (mem[((sp + 2) & 0xFF) + 1] << 8) + mem[((sp + 1) & 0xFF) + 1]
 
-        elif op.name == "DEC":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-            expected_mem = copy.deepcopy(previous_mem)
-            decremented_value = addressed_value - 1
-            if decremented_value < 0: # handle underflow
-                decremented_value += 256
-            expected_mem[target_addr] = decremented_value
-            verify_memory(expected_mem, mem)
+    chk.verify_unchanged()
 
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    chk.verify_pulled_status(expected_status)
+    chk.verify_reg("SP", (previous_values["SP"] + 3) & 0xFF)
+    chk.verify_reg("PC", expected_pc)
+    chk.next_addr = expected_pc
 
-            verify_attr("N", (decremented_value & 0x80) != 0, verified_flags)
-            verify_attr("Z", decremented_value == 0, verified_flags)
 
-        elif op.name == "INX":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def validate_rts(chk):
+    previous_values = chk.previous_values
+    mem = chk.mem
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    # Pulled like RTI, without wrapping the address (see validate_rti)
+    sp = previous_values["SP"]
+    pulled_pc = (mem[((sp + 1) & 0xFF) + 1] << 8) + mem[sp + 1]
+    expected_pc = pulled_pc + 1
 
-            expected_x = (previous_values["X"] + 1) & 0xFF
-            verify_attr("X", expected_x, verified_regs)
-            verify_attr("N", (expected_x & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_x == 0, verified_flags)
+    chk.verify_unchanged()
+    chk.verify_reg("SP", (previous_values["SP"] + 2) & 0xFF)
+    chk.verify_reg("PC", expected_pc)
+    chk.next_addr = expected_pc
 
-        elif op.name == "INY":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def validate_jsr(chk):
+    previous_values = chk.previous_values
+    mem = chk.mem
+    opcode_addr = chk.opcode_addr
 
-            expected_y = (previous_values["Y"] + 1) & 0xFF
-            verify_attr("Y", expected_y, verified_regs)
-            verify_attr("N", (expected_y & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_y == 0, verified_flags)
+    expected_mem = chk.previous_mem.overlay()
+    stored_pc = previous_values["PC"] + 2
+    expected_mem[previous_values["SP"]] = (stored_pc) >> 8
+    expected_mem[(previous_values["SP"] - 1) & 0xFF] = (stored_pc) & 0xFF
+    chk.verify_memory(expected_mem)
 
-        elif op.name == "DEX":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    expected_pc = (mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1]
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    chk.check_unaffected()
+    chk.verify_reg("SP", (previous_values["SP"] - 2) & 0xFF)
+    chk.verify_reg("PC", expected_pc)
+    chk.next_addr = expected_pc
 
-            expected_x = (previous_values["X"] - 1)
-            if expected_x < 0: # handle underflow
-                expected_x += 256
-            verify_attr("X", expected_x, verified_regs)
-            verify_attr("N", (expected_x & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_x == 0, verified_flags)
 
-        elif op.name == "DEY":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+def validate_jmp(chk):
+    mem = chk.mem
+    opcode_addr = chk.opcode_addr
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    following_addr = (mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1]
+    if chk.op.addressing == "abs":
+        expected_pc = following_addr
+    if chk.op.addressing == "ind":
+        expected_pc = (mem[following_addr + 1] << 8) + mem[following_addr]
 
-            expected_y = (previous_values["Y"] - 1)
-            if expected_y < 0: # handle underflow
-                expected_y += 256
-            verify_attr("Y", expected_y, verified_regs)
-            verify_attr("N", (expected_y & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_y == 0, verified_flags)
+    chk.verify_unchanged()
+    chk.verify_reg("PC", expected_pc)
+    chk.next_addr = expected_pc
 
-        elif op.name == "SEC":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def validate_branch(chk):
+    flag, value = BRANCH_CONDITIONS[chk.op.name]
+    if chk.previous_values[flag] == value:
+        # branch is taken (the extra cycle has already been run)
+        expected_pc = chk.target_addr
+    else:
+        expected_pc = chk.previous_values["PC"] + 2
 
-            verify_attr("C", 1, verified_flags)
+    chk.verify_unchanged()
+    chk.verify_reg("PC", expected_pc)
+    chk.next_addr = expected_pc
 
-        elif op.name == "CLC":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def validate_php(chk):
+    previous_values = chk.previous_values
 
-            verify_attr("C", 0, verified_flags)
+    expected_mem = chk.previous_mem.overlay()
+    expected_mem[previous_values["SP"]] = chk.status_byte()
+    chk.verify_memory(expected_mem)
 
-        elif op.name == "SEI":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    chk.check_unaffected()
+    chk.verify_reg("SP", (previous_values["SP"] - 1) & 0xFF)
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
 
-            verify_attr("I", 1, verified_flags)
+def validate_plp(chk):
+    previous_values = chk.previous_values
 
-        elif op.name == "CLI":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    expected_status = chk.mem[(previous_values["SP"] + 1) & 0xFF]
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    chk.verify_unchanged()
 
-            verify_attr("I", 0, verified_flags)
+    chk.verify_pulled_status(expected_status)
+    chk.verify_reg("SP", (previous_values["SP"] + 1) & 0xFF)
 
-        elif op.name == "SED":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+def validate_pha(chk):
+    previous_values = chk.previous_values
 
-            verify_attr("D", 1, verified_flags)
+    expected_mem = chk.previous_mem.overlay()
+    expected_mem[previous_values["SP"]] = previous_values["ACC"]
 
-        elif op.name == "CLD":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    chk.verify_memory(expected_mem)
+    chk.check_unaffected()
+
+    chk.verify_reg("SP", (previous_values["SP"] - 1) & 0xFF)
+
+
+def validate_pla(chk):
+    previous_values = chk.previous_values
+
+    expected_acc = chk.mem[(previous_values["SP"] + 1) & 0xFF]
+
+    chk.verify_unchanged()
+
+    chk.verify_reg("ACC", expected_acc)
+    chk.verify_nz(expected_acc)
+    chk.verify_reg("SP", (previous_values["SP"] + 1) & 0xFF)
+
+
+def validate_bit(chk):
+    addressed_value = chk.addressed_value
+
+    chk.verify_unchanged()
+
+    expected_v = (addressed_value & 0b01000000) != 0
+    expected_n = (addressed_value & 0b10000000) != 0
+    expected_z = (chk.previous_values["ACC"] & addressed_value) == 0
+
+    chk.verify_flag("V", expected_v)
+    chk.verify_flag("N", expected_n)
+    chk.verify_flag("Z", expected_z)
+
+
+def validate_nop(chk):
+    pass
+
+
+def validate_end(chk):
+    pass
+
+
+def missing_validator(chk):
+    # assert No validator for this opcode
+    assert False, f"No validator for operation {chk.op.name}"
+
+
+validators = {
+    "ORA": validate_ora,
+    "AND": validate_and,
+    "EOR": validate_eor,
+    "ADC": validate_adc,
+    "SBC": validate_sbc,
+    "STA": store_validator("ACC"),
+    "STX": store_validator("X"),
+    "STY": store_validator("Y"),
+    "LDA": load_validator("ACC"),
+    "LDX": load_validator("X"),
+    "LDY": load_validator("Y"),
+    "CMP": compare_validator("ACC"),
+    "CPX": compare_validator("X"),
+    "CPY": compare_validator("Y"),
+    "TAX": transfer_validator("ACC", "X"),
+    "TAY": transfer_validator("ACC", "Y"),
+    "TXA": transfer_validator("X", "ACC"),
+    "TYA": transfer_validator("Y", "ACC"),
+    "TSX": transfer_validator("SP", "X"),
+    "TXS": transfer_validator("X", "SP", affects_flags=False),
+    "INC": memory_step_validator(1),
+    "DEC": memory_step_validator(-1),
+    "INX": step_validator("X", 1),
+    "INY": step_validator("Y", 1),
+    "DEX": step_validator("X", -1),
+    "DEY": step_validator("Y", -1),
+    "SEC": flag_validator("C", 1),
+    "CLC": flag_validator("C", 0),
+    "SEI": flag_validator("I", 1),
+    "CLI": flag_validator("I", 0),
+    "SED": flag_validator("D", 1),
+    "CLD": flag_validator("D", 0),
+    "CLV": flag_validator("V", 0),
+    ########## Arithmetic Operations ##########
+    "ASL": shift_validator(lambda value, carry: ((value << 1) & 0xFF, (value & 0x80) != 0)),
+    "ROL": shift_validator(lambda value, carry: (((value << 1) & 0xFF) | carry, (value & 0x80) != 0)),
+    "LSR": shift_validator(lambda value, carry: (value >> 1, (value & 0x01) != 0)),
+    "ROR": shift_validator(lambda value, carry: ((value >> 1) | (carry << 7), (value & 0x01) != 0)),
+    "BRK": validate_brk,
+    "RTI": validate_rti,
+    "RTS": validate_rts,
+    "JSR": validate_jsr,
+    "JMP": validate_jmp,
+    # Branch instructions
+    "BPL": validate_branch,
+    "BMI": validate_branch,
+    "BVC": validate_branch,
+    "BVS": validate_branch,
+    "BCC": validate_branch,
+    "BCS": validate_branch,
+    "BNE": validate_branch,
+    "BEQ": validate_branch,
+    "PHP": validate_php,
+    "PLP": validate_plp,
+    "PHA": validate_pha,
+    "PLA": validate_pla,
+    "BIT": validate_bit,
+    "NOP": validate_nop,
+    "END": validate_end,
+}
+
+def verify_lockstep(current_values, model, mem):
+    """
+    Compare the DUT with the golden model after both executed the same instruction.
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    :param current_values: StateSampler sample of the DUT after the instruction.
+    :param model: CPUModel that has just executed the instruction.
+    :param mem: Testbench Memory holding the writes of the DUT.
+    """
+    for key, expected_value in model.state().items():
+        current_value = current_values[key]
+        assert (
+            current_value == expected_value
+        ), f"{key} differs from golden model: expected {hex(expected_value)} but got {hex(current_value)}"
+    expected_writes = dict(model.writes)
+    assert (
+        set(mem.touched()) == set(expected_writes)
+    ), f"Written addresses differ from golden model: expected {sorted(map(hex, expected_writes))}, got {sorted(map(hex, mem.touched()))}"
+    for addr, val in expected_writes.items():
+        assert (
+            mem[addr] == val
+        ), f"Memory at {hex(addr)} differs from golden model: expected {hex(val)} but got {hex(mem[addr])}"
+
+
+def verify_trace_record(current_values, record, mem):
+    """
+    Compare the DUT with a record of the expected trace.
 
-            verify_attr("D", 0, verified_flags)
+    :param current_values: StateSampler sample of the DUT after the instruction.
+    :param record: TraceRecord of the instruction that has just been executed.
+    :param mem: Testbench Memory holding the writes of the DUT.
+    """
+    expected_values = {
+        "PC": record.pc,
+        "ACC": record.acc,
+        "SP": record.sp,
+        "X": record.x,
+        "Y": record.y,
+    }
+    expected_values.update(unpack_status(record.status))
+    for key, expected_value in expected_values.items():
+        current_value = current_values[key]
+        assert (
+            current_value == expected_value
+        ), f"{key} differs from expected trace: expected {hex(expected_value)} but got {hex(current_value)}"
+    expected_writes = dict(record.writes)
+    assert (
+        set(mem.touched()) == set(expected_writes)
+    ), f"Written addresses differ from expected trace: expected {sorted(map(hex, expected_writes))}, got {sorted(map(hex, mem.touched()))}"
+    for addr, val in expected_writes.items():
+        assert (
+            mem[addr] == val
+        ), f"Memory at {hex(addr)} differs from expected trace: expected {hex(val)} but got {hex(mem[addr])}"
+
+
+def record_sim_speed(path, simulator, program, cycles, seconds):
+    """
+    Store the simulation speed of this run and compare it with the other simulators.
 
-        elif op.name == "CLV":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    :param path: JSON file with one entry per simulator, shared by the runs of all backends.
+    :param simulator: Name of the simulator (SIM).
+    :param program: Program that was run.
+    :param cycles: Clock cycles simulated.
+    :param seconds: Wall time of the simulation.
+    """
+    speeds = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            speeds = json.load(f)
+    cycles_per_second = cycles / seconds if seconds > 0 else 0.0
+    speeds[simulator] = {
+        "program": os.path.abspath(program),
+        "cycles": cycles,
+        "seconds": round(seconds, 3),
+        "cycles_per_second": round(cycles_per_second, 1),
+    }
+    with open(path, "w") as f:
+        json.dump(speeds, f, indent=2)
+
+    print(f"{simulator}: {cycles} cycles in {seconds:.2f}s ({cycles_per_second:.0f} cycles/s)")
+    for other, speed in speeds.items():
+        if other != simulator and speed["program"] == os.path.abspath(program) and speed["cycles_per_second"] > 0:
+            print(f"  {cycles_per_second / speed['cycles_per_second']:.2f}x the speed of {other} ({speed['cycles_per_second']:.0f} cycles/s)")
+
+
+# opcode byte -> DispatchEntry (metadata, addressing mode resolver, validator)
+dispatch_table = build_dispatch_table(validators, missing_validator)
+
+
+async def run_program(dut, program, outputs_suffix=""):
+    """
+    Test that acts as external memory for 'cpu.v'.
+    instructions are stored in a Python array. The CPU fetches them
+    via addr, data_in, R/W, served by the BusModel coroutine. Every
+    instruction is checked when the CPU starts decoding the next one.
 
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
+    The CPU is reset and the memory is reloaded at the start, so several
+    programs can run one after another in the same simulation.
 
-            verify_attr("V", 0, verified_flags)
+    :param dut: The CPU.
+    :param program: Path of the program image.
+    :param outputs_suffix: Added to the names of the per-program output files
+        (trace, bus trace, CPI report, coverage, profile, sim speed).
+    """
+    replay = read_failure(REPLAY_FILE) if REPLAY_FILE else None
 
-        ########## Arithmetic Operations ##########
-        elif op.name == "ASL":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    # Create a clock (1 us period = 1MHz)
+    cocotb.start_soon(Clock(dut.clk, 1000, units="ns").start())
 
-            shifted_value = (addressed_value << 1) & 0xFF
+    mem = Memory()
 
-            if op.addressing == "acc":
-                verify_attr("ACC", shifted_value, verified_regs)
-            else:
-                expected_mem = copy.deepcopy(previous_mem)
-                expected_mem[target_addr] = shifted_value
-                verify_memory(expected_mem, mem)
+    binary_data = load_image(program)
+    mem.load(binary_data)
 
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("C", (addressed_value & 0x80) != 0, verified_flags)
-            verify_attr("N", (shifted_value & 0x80) != 0, verified_flags)
-            verify_attr("Z", shifted_value == 0, verified_flags)
+    model = None
+    trace = None
+    if REFERENCE == "model":
+        # The golden model works on its own copy of the memory image
+        model = CPUModel(bytearray(mem.data))
+    elif REFERENCE == "trace":
+        trace = read_trace(trace_for(binary_data))
+    assert RUN_VALIDATORS or REFERENCE is not None, "Nothing to check: enable RUN_VALIDATORS or set a REFERENCE"
 
-        elif op.name == "ROL":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    # STACK: mem[0100] ... mem[01FF] (growing top to bottom)
+    # $FFFA, $FFFB ... NMI (Non-Maskable Interrupt) vector
+    # $FFFC, $FFFD ... RES (Reset) vector
+    # $FFFE, $FFFF ... IRQ (Interrupt Request) vector
 
-            rotated_value = ((addressed_value << 1) & 0xFF) | previous_values["C"]
+    # Initialize signals
+    dut.reset_n.value = 0
+    dut.RDY.value = 1
 
-            if op.addressing == "acc":
-                verify_attr("ACC", rotated_value, verified_regs)
-            else:
-                expected_mem = copy.deepcopy(previous_mem)
-                expected_mem[target_addr] = rotated_value
-                verify_memory(expected_mem, mem)
+    wave_window = None
+    if WAVE_MODE == "full":
+        dut.wave_dump_enable.value = 1
+    elif WAVE_MODE == "window":
+        wave_window = parse_wave_window(WAVE_WINDOW)
 
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("C", (addressed_value & 0x80) != 0, verified_flags)
-            verify_attr("N", (rotated_value & 0x80) != 0, verified_flags)
-            verify_attr("Z", rotated_value == 0, verified_flags)
+    # Wait a few clock cycles with reset=0
+    for _ in range(5):
+        await RisingEdge(dut.clk)
 
-        elif op.name == "LSR":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+    sim_start = time.perf_counter()
+    # The bus model serves all memory accesses from here on
+    trace_path = None
+    if TRACE_FILE:
+        root, ext = os.path.splitext(TRACE_FILE)
+        trace_path = root + outputs_suffix + ext
+    trace_log = TraceLog(TRACE_LEVELS[TRACE_LEVEL], path=trace_path, echo=TRACE_ECHO)
+    bus_trace = None
+    if BUS_TRACE_FILE:
+        root, ext = os.path.splitext(BUS_TRACE_FILE)
+        bus_trace = BusTraceWriter(root + outputs_suffix + ext)
+    bus = BusModel(dut, mem, trace_log, bus_trace)
+    profiler = PhaseProfiler(os.path.basename(program)) if PROFILE_FILE and replay is None else None
+    bus.profile = profiler is not None
+    bus.start()
+    dut.reset_n.value = 1
+    reset_start = bus.cycle
 
-            shifted_value = addressed_value >> 1
+    # Reset cycles (ST_RESET -> ST_FETCH_OPERAND_LOW -> ST_FETCH_OPERAND_HIGH) until the first opcode is decoded.
+    # Reset is released on a rising edge, so the first falling edge still sees ST_RESET and is not counted.
+    reset_cycles = await bus.next_instruction() - reset_start - 1
+    assert reset_cycles == RESET_CYCLES, f"Reset took {reset_cycles} cycles, expected {RESET_CYCLES}"
+    did_reset = True
 
-            if op.addressing == "acc":
-                verify_attr("ACC", shifted_value, verified_regs)
-            else:
-                expected_mem = copy.deepcopy(previous_mem)
-                expected_mem[target_addr] = shifted_value
-                verify_memory(expected_mem, mem)
+    # Iterate through Program code and execute every instruction and test the results
 
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("C", (addressed_value & 0x01) != 0, verified_flags)
-            verify_attr("N", (shifted_value & 0x80) != 0, verified_flags)
-            verify_attr("Z", shifted_value == 0, verified_flags)
+    print("########################### START PROGRAM ###########################")
+    sampler = StateSampler(dut)
+    current_values = sampler.sample()
+    mem_index = 0x0600
+    instruction = 0  # index of the executed instruction
+    checkpoints = deque(maxlen=REPLAY_INSTRUCTIONS + 1)  # (instruction, cycle, opcode address)
+    cpi_stats = CPIStats(os.path.basename(program)) if CPI_REPORT and replay is None else None
+    coverage = CoverageCollector(os.path.basename(program)) if COVERAGE_FILE and replay is None else None
+    stop_instruction = None
+    if replay is not None:
+        window = replay["window"]
+        stop_instruction = replay["instruction"]
+        if window["instruction"] > 0:
+            # Run up to the window without checking anything
+            await bus.next_instruction(at_cycle=window["cycle"])
+            assert (
+                bus.cycle == window["cycle"]
+            ), f"Replay reached an instruction boundary at cycle {bus.cycle}, expected {window['cycle']}"
+            for _ in range(window["instruction"]):
+                if model is not None:
+                    model.step()
+                if trace is not None:
+                    next(trace)
+            instruction = window["instruction"]
+            mem_index = window["opcode_addr"]
+            did_reset = False
+            current_values = sampler.sample()
+        # Per-cycle trace for the replayed instructions
+        trace_log.set_level(TRACE_CYCLE)
+        trace_log.echo = True
+    if profiler is not None:
+        profiler.start(bus.busy)
+    try:
+        while mem_index < len(mem):
+            # The state after the last instruction is the state before this one
+            previous_values = current_values
+            mem.begin_instruction()
+            previous_mem = mem.previous()
+
+            if stop_instruction is not None and instruction > stop_instruction:
+                print(f"Failure of instruction {stop_instruction} did not reproduce in the replay")
+                break
+
+            opcode_addr = mem_index
+            opcode = mem[opcode_addr]
+            checkpoints.append((instruction, bus.cycle, opcode_addr))
+
+            # Get opcode metadata, addressing mode resolver and validator from the dispatch table
+            entry = dispatch_table[opcode]
+            if entry is INVALID_OPCODE:
+                assert False, f"Invalid opcode {hex(opcode)} found at address {opcode_addr}"
+            op = entry.op
+
+            if RUN_VALIDATORS:
+                target_addr, addressed_value = entry.resolve(mem, opcode_addr, previous_values)
+
+            # END is not implemented by the CPU, stop before it is executed
+            if op.name == "END":
+                break
+
+            if wave_window is not None:
+                if instruction == wave_window[0]:
+                    dut.wave_dump_enable.value = 1
+                elif wave_window[1] is not None and instruction == wave_window[1] + 1:
+                    dut.wave_dump_enable.value = 0
+
+            taken = None
+            if entry.branch is not None:
+                taken = previous_values[entry.branch[0]] == entry.branch[1]
+
+            # Cycles specified by the opcode
+            needed_cycles = op.cycles
+            if taken:
+                # Taken branches need one extra cycle
+                needed_cycles = needed_cycles + 1
+
+            # Let the CPU run until it decodes the next opcode
+            if profiler is not None:
+                profiler.lap(BOOKKEEPING)
+            start_cycle = bus.cycle
+            cycles = await bus.next_instruction() - start_cycle
+            if profiler is not None:
+                profiler.wait_lap(bus.busy)
+            current_values = sampler.sample()
+            if profiler is not None:
+                profiler.lap(SAMPLE)
+            if cpi_stats is not None:
+                cpi_stats.add(op, cycles, nmos_cycles(op, previous_mem, opcode_addr, previous_values, taken), taken)
+            if did_reset:
+                cycles = cycles + reset_cycles
+                needed_cycles = needed_cycles + RESET_CYCLES
+                did_reset = False
+            if coverage is not None:
+                crossed = page_crossed(op, previous_mem, opcode_addr, previous_values)
+                coverage.sample(op, previous_values, current_values, taken, crossed)
+            if trace_log.instructions:
+                trace_log.instruction(
+                    instruction, opcode_addr, opcode, current_values["PC"], current_values["ACC"], current_values["X"],
+                    current_values["Y"], current_values["SP"], pack_status(current_values), cycles,
+                )
+            if profiler is not None:
+                profiler.lap(BOOKKEEPING)
 
-        elif op.name == "ROR":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
+            assert (
+                cycles == needed_cycles
+            ), f"{op} at {hex(opcode_addr)} took {cycles} cycles, expected {needed_cycles}"
+            if model is not None:
+                model_cycles = model.step()
+                assert (
+                    model_cycles == cycles
+                ), f"Golden model needed {model_cycles} cycles for {op}, CPU took {cycles}"
+            if trace is not None:
+                record = next(trace)
+                assert (
+                    record.opcode_addr == opcode_addr and record.cycles == cycles
+                ), f"Expected trace executed {hex(record.opcode_addr)} in {record.cycles} cycles, CPU executed {hex(opcode_addr)} in {cycles} cycles"
 
-            rotated_value = (addressed_value >> 1) | (previous_values["C"] << 7)
+            if RUN_VALIDATORS:
+                chk = InstructionCheck(op, opcode_addr, previous_values, current_values, previous_mem, mem, target_addr, addressed_value)
+                entry.validate(chk)
 
-            if op.addressing == "acc":
-                verify_attr("ACC", rotated_value, verified_regs)
-            else:
-                expected_mem = copy.deepcopy(previous_mem)
-                expected_mem[target_addr] = rotated_value
-                verify_memory(expected_mem, mem)
-
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("C", (addressed_value & 0x01) != 0, verified_flags)
-            verify_attr("N", (rotated_value & 0x80) != 0, verified_flags)
-            verify_attr("Z", rotated_value == 0, verified_flags)
-
-        elif op.name == "BRK":
-            # TODO: varying cycle count
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            # if previous_values["I"] == 1:
-            #     verify_memory(previous_mem, mem)
-            #     check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            #     verify_attr("PC", previous_values["PC"] + 2, verified_regs)
-            #     verify_attr("SP", previous_values["SP"], verified_regs)
-            # else:
-            expected_mem = copy.deepcopy(previous_mem)
-            expected_mem[previous_values["SP"]] = (previous_values["PC"] + 2) >> 8 # PCH
-            expected_mem[previous_values["SP"] - 1] = (previous_values["PC"] + 2) & 0xFF # PCL
-            expected_mem[previous_values["SP"] - 2] = (
-                (previous_values["N"] << 7) |
-                (previous_values["V"] << 6) |
-                (1 << 5) |  # Ignore flag (TODO: check if this is correct)
-                (1 << 4) |  # Break flag
-                (previous_values["D"] << 3) |
-                (previous_values["I"] << 2) |
-                (previous_values["Z"] << 1) |
-                (previous_values["C"] << 0)
-            ) # STATUS
-
-            verify_memory(expected_mem, mem)
-
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("I", 1, verified_flags)
-            verify_attr("SP", previous_values["SP"] - 3, verified_regs)
-            expected_pc = irq_addr
-            verify_attr("PC", expected_pc, verified_regs)
-            mem_index = expected_pc
-
-        elif op.name == "RTI":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            expected_status = mem[previous_values["SP"] + 1]
-            expected_pc = (mem[previous_values["SP"] + 3] << 8) + mem[previous_values["SP"] + 2]
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            verify_attr("N", (expected_status & 0b10000000) != 0, verified_flags)
-            verify_attr("V", (expected_status & 0b01000000) != 0, verified_flags)
-            verify_attr("B", previous_values["B"], verified_flags)
-            verify_attr("D", (expected_status & 0b00001000) != 0, verified_flags)
-            verify_attr("I", (expected_status & 0b00000100) != 0, verified_flags)
-            verify_attr("Z", (expected_status & 0b00000010) != 0, verified_flags)
-            verify_attr("C", (expected_status & 0b00000001) != 0, verified_flags)
-            verify_attr("SP", previous_values["SP"] + 3, verified_regs)
-            verify_attr("PC", expected_pc, verified_regs)
-            mem_index = expected_pc
-
-        elif op.name == "RTS":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            pulled_pc = (mem[previous_values["SP"] + 2] << 8) + mem[previous_values["SP"] + 1]
-            expected_pc = pulled_pc + 1
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("SP", previous_values["SP"] + 2, verified_regs)
-            verify_attr("PC", expected_pc, verified_regs)
-            mem_index = expected_pc
-
-        elif op.name == "JSR":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            expected_mem = copy.deepcopy(previous_mem)
-            stored_pc = previous_values["PC"] + 2
-            expected_mem[previous_values["SP"]] = (stored_pc) >> 8
-            expected_mem[previous_values["SP"] - 1] = (stored_pc) & 0xFF
-            verify_memory(expected_mem, mem)
-
-            expected_pc = (mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1]
-
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("SP", previous_values["SP"] - 2, verified_regs)
-            verify_attr("PC", expected_pc, verified_regs)
-            mem_index = expected_pc
-
-        elif op.name == "JMP":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            following_addr = (mem[opcode_addr + 2] << 8) + mem[opcode_addr + 1]
-            if op.addressing == "abs":
-                expected_pc = following_addr
-            if op.addressing == "ind":
-                expected_pc = (mem[following_addr + 1] << 8) + mem[following_addr]
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("PC", expected_pc, verified_regs)
-            mem_index = expected_pc
-
-        # Branch instructions
-        elif op.name in ["BPL", "BMI", "BVC", "BVS", "BCC", "BCS", "BNE", "BEQ"]:
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            if (op.name == "BPL" and previous_values["N"] == 0) \
-            or (op.name == "BMI" and previous_values["N"] == 1) \
-            or (op.name == "BVC" and previous_values["V"] == 0) \
-            or (op.name == "BVS" and previous_values["V"] == 1) \
-            or (op.name == "BCC" and previous_values["C"] == 0) \
-            or (op.name == "BCS" and previous_values["C"] == 1) \
-            or (op.name == "BNE" and previous_values["Z"] == 0) \
-            or (op.name == "BEQ" and previous_values["Z"] == 1):
-                # branch is taken
-                await runCycles(1)
-                expected_pc = target_addr
+                # if PC has not been verified manually, verify it automatically
+                if "PC" not in chk.verified_regs:
+                    chk.verify_reg("PC", opcode_addr + op.bytes)
+                if set(chk.verified_regs) != set(op.affected_regs):
+                    assert (
+                        False
+                    ), f"Validated registers do nat match the ones in the opcode declaration. Expected {op.affected_regs}, verified {chk.verified_regs}"
+                if set(chk.verified_flags) != set(op.affected_flags):
+                    assert (
+                        False
+                    ), f"Validated flags do nat match the ones in the opcode declaration. Expected {op.affected_flags}, verified {chk.verified_flags}"
+
+            if model is not None:
+                verify_lockstep(current_values, model, mem)
+            if trace is not None:
+                verify_trace_record(current_values, record, mem)
+            if profiler is not None:
+                profiler.lap(VALIDATION)
+
+            # Move to next opcode
+            if RUN_VALIDATORS:
+                mem_index = chk.next_addr
+            elif model is not None:
+                mem_index = model.PC
             else:
-                expected_pc = previous_values["PC"] + 2
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("PC", expected_pc, verified_regs)
-            mem_index = expected_pc
-
-        elif op.name == "PHP":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            expected_mem = copy.deepcopy(previous_mem)
-            expected_mem[previous_values["SP"]] = (
-                (previous_values["N"] << 7) |
-                (previous_values["V"] << 6) |
-                (1 << 5) |  # Ignore flag (TODO: check if this is correct)
-                (1 << 4) |  # Break flag
-                (previous_values["D"] << 3) |
-                (previous_values["I"] << 2) |
-                (previous_values["Z"] << 1) |
-                (previous_values["C"] << 0)
-            )
-            verify_memory(expected_mem, mem)
-
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-            verify_attr("SP", previous_values["SP"] - 1, verified_regs)
-
-        elif op.name == "PLP":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            expected_status = mem[previous_values["SP"] + 1]
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            verify_attr("N", (expected_status & 0b10000000) != 0, verified_flags)
-            verify_attr("V", (expected_status & 0b01000000) != 0, verified_flags)
-            verify_attr("B", previous_values["B"], verified_flags)
-            verify_attr("D", (expected_status & 0b00001000) != 0, verified_flags)
-            verify_attr("I", (expected_status & 0b00000100) != 0, verified_flags)
-            verify_attr("Z", (expected_status & 0b00000010) != 0, verified_flags)
-            verify_attr("C", (expected_status & 0b00000001) != 0, verified_flags)
-            verify_attr("SP", previous_values["SP"] + 1, verified_regs)
-
-        elif op.name == "PHA":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            expected_mem = copy.deepcopy(previous_mem)
-            expected_mem[previous_values["SP"]] = previous_values["ACC"]
-
-            verify_memory(expected_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            verify_attr("SP", previous_values["SP"] - 1, verified_regs)
-
-        elif op.name == "PLA":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            expected_acc = mem[previous_values["SP"] + 1]
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            verify_attr("ACC", expected_acc, verified_regs)
-            verify_attr("N", (expected_acc & 0x80) != 0, verified_flags)
-            verify_attr("Z", expected_acc == 0, verified_flags)
-            verify_attr("SP", previous_values["SP"] + 1, verified_regs)
-
-        elif op.name == "BIT":
-            print(f"### mem[{hex(opcode_addr)}]: {op}:", end="")
-
-            verify_memory(previous_mem, mem)
-            check_unaffected(previous_values, op.affected_flags, op.affected_regs)
-
-            expected_v = (addressed_value & 0b01000000) != 0
-            expected_n = (addressed_value & 0b10000000) != 0
-            expected_z = (previous_values["ACC"] & addressed_value) == 0
-
-            verify_attr("V", expected_v, verified_flags)
-            verify_attr("N", expected_n, verified_flags)
-            verify_attr("Z", expected_z, verified_flags)
-
-        elif op.name == "NOP":
-            pass
-        elif op.name == "END":
-            break
-
-        else:
-            # assert No validator for this opcode
-            assert False, f"No validator for operation {op.name}"
-
-        # if op.name not in ["JMP", "JSR", "BRK", "RTI", "RTS"]:
-        # if PC has not been verified manually, verify it automatically
-        if "PC" not in verified_regs:
-            verify_attr("PC", opcode_addr + op.bytes, verified_regs)
-        if set(verified_regs) != set(op.affected_regs):
-            assert (
-                False
-            ), f"Validated registers do nat match the ones in the opcode declaration. Expected {op.affected_regs}, verified {verified_regs}"
-        if set(verified_flags) != set(op.affected_flags):
-            assert (
-                False
-            ), f"Validated flags do nat match the ones in the opcode declaration. Expected {op.affected_flags}, verified {verified_flags}"
-
-        print(f" OK")
-        # print("\n")
+                mem_index = record.pc
+
+            instruction += 1
+            if profiler is not None:
+                profiler.end_instruction(opcode)
+    except AssertionError as e:
+        if trace_log.level and not trace_log.echo:
+            print(f"Last instructions before the failure:\n{trace_log.format()}")
+        trace_log.close()
+        if bus_trace is not None:
+            bus.stop()
+            bus_trace.close()
+        if replay is None and not os.path.exists(FAILURE_FILE):
+            # Checkpoints of the last instructions, the replay starts from the oldest one (first failure of the session)
+            write_failure(FAILURE_FILE, program, instruction, checkpoints[-1][1], opcode_addr, str(e), list(checkpoints))
+            print(f"Failure in instruction {instruction}, written to {FAILURE_FILE}")
+        raise
+
+    bus.stop()
+    trace_log.close()
+    if bus_trace is not None:
+        bus_trace.close()
+    if cpi_stats is not None:
+        report = cpi_stats.report()
+        root, ext = os.path.splitext(CPI_REPORT)
+        write_report(report, root + outputs_suffix + ext)
+        print(format_report(report).splitlines()[0])
+    if coverage is not None:
+        root, ext = os.path.splitext(COVERAGE_FILE)
+        coverage.save(root + outputs_suffix + ext)
+    if profiler is not None:
+        report = profiler.report()
+        root, ext = os.path.splitext(PROFILE_FILE)
+        write_profile(report, root + outputs_suffix + ext)
+        print(format_profile(report))
+    if replay is None:
+        root, ext = os.path.splitext(SIM_SPEED_FILE)
+        record_sim_speed(root + outputs_suffix + ext, SIM, program, bus.cycle, time.perf_counter() - sim_start)
+
+
+def program_list():
+    """
+    :return: Programs run by this simulation, from PROGRAMS or PROGRAM.
+    """
+    if REPLAY_FILE or not PROGRAMS:
+        paths = [PROGRAM]
+    else:
+        paths = []
+        for path in PROGRAMS.split(os.pathsep):
+            if os.path.isdir(path):
+                paths += sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.endswith(PROGRAM_EXTENSIONS))
+            elif path:
+                paths.append(path)
+    # Sources are assembled (cached by their hash)
+    return [assemble_file(path) if path.endswith(".65s") else path for path in paths]
+
+
+def program_test(program, name, outputs_suffix):
+    """Create the cocotb test running one program."""
+    async def test(dut):
+        await run_program(dut, program, outputs_suffix)
+
+    test.__name__ = test.__qualname__ = name
+    test.__doc__ = f"Run {program} and check every instruction."
+    return cocotb.test()(test)
+
+
+# Stale results of an earlier session must not be replayed
+if os.path.exists(FAILURE_FILE) and not REPLAY_FILE:
+    os.remove(FAILURE_FILE)
+
+_programs = program_list()
+if len(_programs) == 1:
+    cpu_minimal_test = program_test(_programs[0], "cpu_minimal_test", "")
+else:
+    for _program in _programs:
+        _name = "cpu_" + "".join(c if c.isalnum() else "_" for c in os.path.splitext(os.path.basename(_program))[0])
+        while _name in globals():
+            _name += "_"
+        globals()[_name] = program_test(_program, _name, "." + _name[4:])
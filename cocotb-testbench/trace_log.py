@@ -0,0 +1,123 @@
+"""
+Buffered trace of the executed instructions and bus cycles.
+
+Records are kept as tuples in a ring buffer and optionally appended to a
+binary file. Text is only formatted when the records are printed: on a
+failure, on request, or for every record when echo is enabled.
+
+Levels:
+    TRACE_NONE          nothing is recorded
+    TRACE_INSTRUCTION   one record per instruction (opcode, registers, cycles)
+    TRACE_CYCLE         additionally one record per bus cycle (state, addr, RW, data)
+
+Usage: python trace_log.py trace.bin
+"""
+import struct
+import sys
+from collections import deque
+
+from opcodes import opcode_list
+
+TRACE_NONE = 0
+TRACE_INSTRUCTION = 1
+TRACE_CYCLE = 2
+TRACE_LEVELS = {"none": TRACE_NONE, "instruction": TRACE_INSTRUCTION, "cycle": TRACE_CYCLE}
+
+KIND_INSTRUCTION = 0
+KIND_CYCLE = 1
+# kind, instruction index, opcode address, opcode, PC, ACC, X, Y, SP, status, cycles
+INSTRUCTION_RECORD = struct.Struct("<BIHBHBBBBBH")
+# kind, cycle, state, addr, RW, data
+CYCLE_RECORD = struct.Struct("<BIBHBB")
+
+opcode_names = {op.opcode: str(op) for op in opcode_list}
+
+
+class TraceLog:
+    """
+    Trace sink of the testbench.
+
+    :param level: One of TRACE_NONE, TRACE_INSTRUCTION, TRACE_CYCLE.
+    :param capacity: Number of records kept in the ring buffer.
+    :param path: Optional binary file all records are appended to.
+    :param echo: Print every record when it is recorded.
+    """
+
+    def __init__(self, level=TRACE_INSTRUCTION, capacity=256, path=None, echo=False):
+        self.records = deque(maxlen=capacity)
+        self.file = open(path, "wb") if path else None
+        self.echo = echo
+        self.set_level(level)
+
+    def set_level(self, level):
+        self.level = level
+        # Checked by the callers before building a record
+        self.instructions = level >= TRACE_INSTRUCTION
+        self.cycles = level >= TRACE_CYCLE
+
+    def instruction(self, index, opcode_addr, opcode, pc, acc, x, y, sp, status, cycles):
+        record = (KIND_INSTRUCTION, index, opcode_addr, opcode, pc, acc, x, y, sp, status, cycles)
+        self.add(record)
+
+    def cycle(self, cycle, state, addr, rw, data):
+        record = (KIND_CYCLE, cycle, state, addr, rw, data)
+        self.add(record)
+
+    def add(self, record):
+        self.records.append(record)
+        if self.file is not None:
+            if record[0] == KIND_INSTRUCTION:
+                self.file.write(INSTRUCTION_RECORD.pack(*record))
+            else:
+                self.file.write(CYCLE_RECORD.pack(*record))
+        if self.echo:
+            print(format_record(record))
+
+    def format(self, last=None):
+        """
+        Format the buffered records.
+
+        :param last: Only the last records, all buffered records if None.
+        :return: Text with one line per record.
+        """
+        records = list(self.records)
+        if last is not None:
+            records = records[-last:]
+        return "\n".join(format_record(record) for record in records)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def format_record(record):
+    if record[0] == KIND_INSTRUCTION:
+        _, index, opcode_addr, opcode, pc, acc, x, y, sp, status, cycles = record
+        return (
+            f"{index:8d} mem[{opcode_addr:#06x}]: {opcode_names.get(opcode, hex(opcode)):<22} "
+            f"PC={pc:04x} A={acc:02x} X={x:02x} Y={y:02x} SP={sp:02x} NV-BDIZC={status:08b} cycles={cycles}"
+        )
+    _, cycle, state, addr, rw, data = record
+    return f"         cycle {cycle:8d}: state={state:2d} addr={addr:04x} {'R' if rw == 1 else 'W'} data={data:02x}"
+
+
+def read_records(path):
+    """
+    Read a binary trace file.
+
+    :param path: File written by TraceLog.
+    :return: Generator of record tuples.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        record_type = INSTRUCTION_RECORD if data[offset] == KIND_INSTRUCTION else CYCLE_RECORD
+        yield record_type.unpack_from(data, offset)
+        offset += record_type.size
+
+
+if __name__ == "__main__":
+    for record in read_records(sys.argv[1]):
+        print(format_record(record))
@@ -0,0 +1,250 @@
+"""
+Memory map of the FPGA RAM.
+
+The RAM of the FPGA only holds some windows of the 64 KiB address space. This
+packs the windows of a program image into the smallest RAM image (in address
+order, without gaps) and writes:
+    <output>.bin        packed RAM image
+    <output>.hex        $readmemh file of the flip-flop RAM, one byte per line (as xxd -p -c1)
+    <output>_bram.vh    INITVAL_xx parameters of ECP5 DP16KD blocks in 2048x9 mode
+    memmap.vh           address translation of the RAM module in top.v (included by it)
+
+Windows are given as START-END (inclusive), NAME=START-END or one of the
+presets (zp, stack, vectors). Accesses outside of all windows read 0 and
+writes are dropped. The default windows keep the map of the old
+shrink-memory.sh: 0x0000-0x0EFF and the last 16 bytes (vectors) at 0x0F00.
+
+Note that the stack of cpu.v lives in page zero, the stack preset is only
+needed for programs written for the page 1 stack of a standard 6502.
+
+Usage:
+    python memmap.py [test.bin] [-w 0x0000-0x0EFF -w 0xFFF0-0xFFFF] [-o test_fpga]
+    python memmap.py test.bin --auto -w zp
+"""
+import argparse
+import os
+import re
+import sys
+
+IMAGE_SIZE = 65536
+FILL = 0x00  # fill byte of the assembler, unused RAM is initialized with it
+
+PRESETS = {
+    "zp": (0x0000, 0x00FF),
+    "stack": (0x0100, 0x01FF),
+    "vectors": (0xFFF0, 0xFFFF),
+}
+DEFAULT_WINDOWS = ["0x0000-0x0EFF", "vectors"]
+
+BRAM_DEPTH = 2048  # DP16KD in 2048x9 mode, the 9th bit is unused
+BRAM_INIT_WORDS = 32  # bytes per INITVAL_xx parameter
+VERILOG_INCLUDE = "memmap.vh"
+
+
+class MemoryMapError(Exception):
+    pass
+
+
+def parse_window(text):
+    """
+    :param text: START-END, NAME=START-END or the name of a preset.
+    :return: (name, start, end) with end inclusive.
+    """
+    name, _, spec = text.rpartition("=")
+    if not name and spec in PRESETS:
+        return (spec,) + PRESETS[spec]
+    match = re.fullmatch(r"\s*(\w+)\s*-\s*(\w+)\s*", spec)
+    try:
+        start, end = int(match.group(1), 0), int(match.group(2), 0)
+    except (AttributeError, ValueError):
+        raise MemoryMapError(f"Invalid window '{text}', expected START-END or one of {', '.join(PRESETS)}") from None
+    if not 0 <= start <= end < IMAGE_SIZE:
+        raise MemoryMapError(f"Window '{text}' is empty or outside of the address space")
+    return name or f"{start:04X}", start, end
+
+
+def auto_windows(image, granularity=256):
+    """
+    Windows covering all blocks of the image that hold anything but the fill byte.
+
+    Addresses the program only writes at runtime (variables without initial
+    value, stack) are not found and have to be added as windows.
+
+    :param granularity: Size and alignment of the blocks in bytes.
+    :return: List of (name, start, end) with end inclusive.
+    """
+    windows = []
+    for block in range(0, IMAGE_SIZE, granularity):
+        if image[block:block + granularity].strip(bytes([FILL])):
+            end = min(block + granularity, IMAGE_SIZE) - 1
+            if windows and windows[-1][2] + 1 == block:
+                windows[-1] = (windows[-1][0], windows[-1][1], end)
+            else:
+                windows.append((f"{block:04X}", block, end))
+    return windows
+
+
+def pack_windows(windows):
+    """
+    Merge overlapping or adjacent windows and place them one after another in the RAM.
+
+    :param windows: List of (name, start, end) with end inclusive.
+    :return: List of (name, start, end, offset), offset is the RAM index of start.
+    """
+    merged = []
+    for name, start, end in sorted(windows, key=lambda window: window[1]):
+        if merged and start <= merged[-1][2] + 1:
+            last_name, last_start, last_end = merged[-1]
+            if end > last_end:
+                merged[-1] = (f"{last_name}+{name}", last_start, end)
+        else:
+            merged.append((name, start, end))
+    packed = []
+    offset = 0
+    for name, start, end in merged:
+        packed.append((name, start, end, offset))
+        offset += end - start + 1
+    return packed
+
+
+def ram_size(memory_map):
+    name, start, end, offset = memory_map[-1]
+    return offset + end - start + 1
+
+
+def pack_image(image, memory_map):
+    return b"".join(bytes(image[start:end + 1]) for _, start, end, _ in memory_map)
+
+
+def write_readmemh(ram, path):
+    with open(path, "w") as f:
+        f.write("".join(f"{value:02x}\n" for value in ram))
+
+
+def bram_initvals(ram):
+    """
+    Split the RAM into DP16KD blocks and encode their INITVAL_00..INITVAL_3F parameters.
+
+    Every 320 bit parameter holds 16 groups of 20 bits, each with two 9 bit
+    words in the low 18 bits. Group 0 is the least significant one.
+
+    :return: One list of 64 hex strings (80 digits, most significant first) per block.
+    """
+    blocks = []
+    for base in range(0, len(ram), BRAM_DEPTH):
+        words = ram[base:base + BRAM_DEPTH].ljust(BRAM_DEPTH, bytes([FILL]))
+        initvals = []
+        for row in range(0, BRAM_DEPTH, BRAM_INIT_WORDS):
+            value = 0
+            for group in range(BRAM_INIT_WORDS // 2):
+                low, high = words[row + 2 * group], words[row + 2 * group + 1]
+                value |= ((high << 9) | low) << (20 * group)
+            initvals.append(f"{value:080X}")
+        blocks.append(initvals)
+    return blocks
+
+
+def write_bram_init(ram, path):
+    blocks = bram_initvals(ram)
+    with open(path, "w") as f:
+        f.write("// Generated by memmap.py, do not edit\n")
+        f.write(f"// INITVAL parameters of {len(blocks)} DP16KD block(s) in 2048x9 mode, "
+                f"block N holds RAM index N*{BRAM_DEPTH}..N*{BRAM_DEPTH}+{BRAM_DEPTH - 1}\n")
+        for number, initvals in enumerate(blocks):
+            for row, value in enumerate(initvals):
+                f.write(f"localparam [319:0] BRAM{number}_INITVAL_{row:02X} = 320'h{value};\n")
+    return len(blocks)
+
+
+def write_verilog_map(memory_map, path, init_file):
+    """
+    Write the address translation of the RAM module as Verilog include.
+
+    It defines RAM_SIZE, RAM_INIT_FILE and the functions ram_mapped(addr) and ram_index(addr).
+    """
+    size = ram_size(memory_map)
+    index_bits = max(1, (size - 1).bit_length())
+    lines = [
+        "// Generated by memmap.py, do not edit",
+        "//   window                       RAM index",
+    ]
+    for name, start, end, offset in memory_map:
+        lines.append(f"//   {start:04X}-{end:04X} {name:<16} {offset:04X}-{offset + end - start:04X}")
+    lines += [
+        f"localparam RAM_SIZE = {size};",
+        f"localparam RAM_INIT_FILE = \"{init_file}\";",
+        "",
+        "function ram_mapped;",
+        "    input [15:0] addr;",
+        "    begin",
+        "        ram_mapped = " + " ||\n                     ".join(
+            f"(addr >= 16'h{start:04X} && addr <= 16'h{end:04X})" for _, start, end, _ in memory_map) + ";",
+        "    end",
+        "endfunction",
+        "",
+        f"function [{index_bits - 1}:0] ram_index;",
+        "    input [15:0] addr;",
+        "    begin",
+    ]
+    for number, (_, start, end, offset) in enumerate(memory_map):
+        keyword = "if" if number == 0 else "else if"
+        lines.append(f"        {keyword} (addr >= 16'h{start:04X} && addr <= 16'h{end:04X})")
+        lines.append(f"            ram_index = addr - 16'h{start:04X} + {offset};")
+    lines += [
+        "        else",
+        "            ram_index = 0;",
+        "    end",
+        "endfunction",
+    ]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def format_map(memory_map):
+    lines = [f"{'window':<24} {'address':<11} {'RAM index':<11} size"]
+    for name, start, end, offset in memory_map:
+        lines.append(f"{name:<24} {start:04X}-{end:04X}   {offset:04X}-{offset + end - start:04X}   {end - start + 1}")
+    size = ram_size(memory_map)
+    lines.append(f"RAM size: {size} bytes ({-(-size // BRAM_DEPTH)} DP16KD blocks)")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack address windows of a program into the FPGA RAM")
+    parser.add_argument("program", nargs="?", default="test.bin", help="flat binary loaded at address 0")
+    parser.add_argument("-w", "--window", action="append", dest="windows",
+                        help=f"START-END, NAME=START-END or a preset ({', '.join(PRESETS)}), can be repeated")
+    parser.add_argument("--auto", action="store_true",
+                        help="add the 256 byte pages holding program data to the windows")
+    parser.add_argument("-o", "--output", default="test_fpga", help="prefix of the RAM images")
+    parser.add_argument("--verilog", default=VERILOG_INCLUDE, help="address translation include of top.v")
+    args = parser.parse_args()
+
+    with open(args.program, "rb") as f:
+        data = f.read()
+    if len(data) > IMAGE_SIZE:
+        parser.error(f"{args.program} is larger than 64 KiB")
+    image = data + bytes([FILL]) * (IMAGE_SIZE - len(data))
+
+    try:
+        windows = [parse_window(window) for window in args.windows or ([] if args.auto else DEFAULT_WINDOWS)]
+    except MemoryMapError as error:
+        parser.error(str(error))
+    if args.auto:
+        windows += auto_windows(image)
+    if not windows:
+        parser.error("No windows")
+    memory_map = pack_windows(windows)
+    ram = pack_image(image, memory_map)
+
+    with open(args.output + ".bin", "wb") as f:
+        f.write(ram)
+    write_readmemh(ram, args.output + ".hex")
+    write_bram_init(ram, args.output + "_bram.vh")
+    write_verilog_map(memory_map, args.verilog, os.path.basename(args.output) + ".hex")
+    print(format_map(memory_map))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
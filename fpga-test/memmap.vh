@@ -0,0 +1,26 @@
+// Generated by memmap.py, do not edit
+//   window                       RAM index
+//   0000-0EFF 0000             0000-0EFF
+//   FFF0-FFFF vectors          0F00-0F0F
+localparam RAM_SIZE = 3856;
+localparam RAM_INIT_FILE = "test_fpga.hex";
+
+function ram_mapped;
+    input [15:0] addr;
+    begin
+        ram_mapped = (addr >= 16'h0000 && addr <= 16'h0EFF) ||
+                     (addr >= 16'hFFF0 && addr <= 16'hFFFF);
+    end
+endfunction
+
+function [11:0] ram_index;
+    input [15:0] addr;
+    begin
+        if (addr >= 16'h0000 && addr <= 16'h0EFF)
+            ram_index = addr - 16'h0000 + 0;
+        else if (addr >= 16'hFFF0 && addr <= 16'hFFFF)
+            ram_index = addr - 16'hFFF0 + 3840;
+        else
+            ram_index = 0;
+    end
+endfunction
@@ -147,31 +147,24 @@ module RAM (
     input wire RW,              // Write enable
 );
     // ### Stripped RAM to fit FPGA ###
-    // included: 0000 - 0FFF (4096 bytes)
-    // stripped: 0F00 - FFEF ()
-    // included: FFF0 - FFFF (16 bytes)
-    // total: 4096 + 16 bytes = 4112
+    // Only some windows of the address space are stored, memmap.vh (generated by memmap.py)
+    // defines the RAM size and the translation of the address to the RAM index.
+    // Addresses outside of the windows read 0, writes to them are dropped.
+    `include "memmap.vh"
 
     wire [7:0] data_out;
     assign data = (RW == 1'b1) ? data_out : 8'bz;
-    // assign data_out = ram[addr];  // Read data from RAM
-    assign data_out = ((addr >= 16'h0F00 && addr < 16'hFFF0)) ? 8'b0 : ((addr >= 16'hFFF0)) ? ram[addr - 16'hFFF0 + 16'h0F00] : ram[addr];  // Read data from RAM
+    assign data_out = ram_mapped(addr) ? ram[ram_index(addr)] : 8'b0;  // Read data from RAM
 
-    // Declare the RAM using the FPGA's block RAM primitive
-    reg [7:0] ram [0:4112];  // 64KB RAM (65536 addresses, 8-bit data)
+    reg [7:0] ram [0:RAM_SIZE-1];
 
     always @(posedge clk) begin
-        if (~RW) begin
-            if (addr < 16'hFFF0) begin
-                ram[addr] <= data;
-            end
-            else if (addr >= 16'hFFF0) begin
-                ram[addr - 16'hFFF0 + 16'h0F00] <= data;
-            end
+        if (~RW && ram_mapped(addr)) begin
+            ram[ram_index(addr)] <= data;
         end
     end
     // Load program from external file (readmemh not supported on hardware)
     initial begin
-        $readmemh("test_fpga.hex", ram); // Load HEX file
+        $readmemh(RAM_INIT_FILE, ram); // Load HEX file
     end
 endmodule